@@ -1,20 +1,42 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, WebSocket, WebSocketDisconnect, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, CursorType, IndexModel, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
+from bson import ObjectId
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, create_model
+from typing import List, Optional, Dict, Any, Tuple, AsyncIterator
 import uuid
 from datetime import datetime, timedelta
 import jwt
 import hashlib
+import math
+import base64
+import binascii
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
 import httpx
 from passlib.context import CryptContext
 import json
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+import heapq
+
+try:
+    import orjson
+except ImportError:  # FastJSONResponse falls back to the stdlib encoder
+    orjson = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -23,13 +45,64 @@ load_dotenv(ROOT_DIR / '.env')
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
+# apply: create missing indexes at startup; check: refuse to start if any are missing; off: skip
+INDEX_BOOTSTRAP = os.environ.get('INDEX_BOOTSTRAP', 'apply')
 
 # Security
 security = HTTPBearer()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+optional_security = HTTPBearer(auto_error=False)
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '4'))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', '64'))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 SECRET_KEY = os.environ.get('SECRET_KEY', 'globalhaven-secret-key-2025')
 ALGORITHM = "HS256"
 MCP_API_KEY = os.environ.get('MCP_API_KEY', 'mcp-globalhaven-2025')
+PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', '10000'))
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.environ.get('PRINCIPAL_CACHE_TTL_SECONDS', '60'))
+COMMUNITY_STATS_REFRESH_SECONDS = float(os.environ.get('COMMUNITY_STATS_REFRESH_SECONDS', '30'))
+COMMUNITY_STATS_MAX_AGE_SECONDS = float(os.environ.get('COMMUNITY_STATS_MAX_AGE_SECONDS', '120'))
+# Buffered view counters: at most this many seconds of increments are lost on a crash
+COUNTER_FLUSH_INTERVAL_SECONDS = float(os.environ.get('COUNTER_FLUSH_INTERVAL_SECONDS', '10'))
+COUNTER_MAX_PENDING_KEYS = int(os.environ.get('COUNTER_MAX_PENDING_KEYS', '10000'))
+# How often each worker checks whether another worker changed the guides it has cached
+GUIDE_CACHE_REFRESH_SECONDS = float(os.environ.get('GUIDE_CACHE_REFRESH_SECONDS', '30'))
+# Water quality score: a report's weight halves every this many days (weights are stored
+# relative to 2025-01-01 and grow by 2x per half-life; startup refuses values that would
+# overflow them within ten years)
+QUALITY_SCORE_HALF_LIFE_DAYS = float(os.environ.get('QUALITY_SCORE_HALF_LIFE_DAYS', '30'))
+# Full-text search: how often other workers' writes are pulled into the local index, and
+# how much proximity counts against text relevance when a location is given (0..1)
+SEARCH_REFRESH_SECONDS = float(os.environ.get('SEARCH_REFRESH_SECONDS', '10'))
+SEARCH_DISTANCE_WEIGHT = float(os.environ.get('SEARCH_DISTANCE_WEIGHT', '0.3'))
+SEARCH_DISTANCE_SCALE_KM = float(os.environ.get('SEARCH_DISTANCE_SCALE_KM', '5'))
+# MCP batches: how many actions of one batch run at the same time
+MCP_BATCH_CONCURRENCY = int(os.environ.get('MCP_BATCH_CONCURRENCY', '8'))
+# Live event stream: local delivers within one worker, mongo fans out to all workers
+# through a capped collection; subscription radii are capped so matching stays local
+STREAM_BUS = os.environ.get('STREAM_BUS', 'local')
+STREAM_BUS_SIZE_BYTES = int(os.environ.get('STREAM_BUS_SIZE_BYTES', str(16 * 1024 * 1024)))
+STREAM_MAX_RADIUS_KM = float(os.environ.get('STREAM_MAX_RADIUS_KM', '100'))
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', '100'))
+STREAM_KEEPALIVE_SECONDS = float(os.environ.get('STREAM_KEEPALIVE_SECONDS', '15'))
+# Alert fan-out into per-user notification inboxes
+ALERT_FANOUT_WORKERS = int(os.environ.get('ALERT_FANOUT_WORKERS', '2'))
+ALERT_FANOUT_BATCH_SIZE = int(os.environ.get('ALERT_FANOUT_BATCH_SIZE', '500'))
+
+# Geocoding (Nominatim usage policy: at most 1 request per second)
+NOMINATIM_URL = os.environ.get('NOMINATIM_URL', 'https://nominatim.openstreetmap.org/search')
+NOMINATIM_MIN_INTERVAL_SECONDS = float(os.environ.get('NOMINATIM_MIN_INTERVAL_SECONDS', '1.0'))
+GEOCODE_TIMEOUT_SECONDS = float(os.environ.get('GEOCODE_TIMEOUT_SECONDS', '10'))
+GEOCODE_CACHE_TTL_DAYS = float(os.environ.get('GEOCODE_CACHE_TTL_DAYS', '30'))
+GEOCODE_NEGATIVE_TTL_HOURS = float(os.environ.get('GEOCODE_NEGATIVE_TTL_HOURS', '24'))
+# Uncached upstream lookups one MCP bulk create may wait for; the rest are deferred
+BULK_GEOCODE_MAX_LOOKUPS = int(os.environ.get('BULK_GEOCODE_MAX_LOOKUPS', '10'))
+# Providers tried in order by geocode_address: nominatim, gazetteer
+GEOCODER_PROVIDERS = [p.strip() for p in os.environ.get('GEOCODER_PROVIDERS', 'nominatim,gazetteer').split(',') if p.strip()]
+GAZETTEER_PATH = os.environ.get('GAZETTEER_PATH')  # GeoNames-style TSV for offline geocoding
+
+# List serialization: off (build response models), validate (batched TypeAdapter), trusted (stored documents as-is)
+FAST_SERIALIZATION = os.environ.get('FAST_SERIALIZATION', 'off')
 
 # Create the main app
 app = FastAPI(title="GlobalHaven API", description="Community Resource Sharing Platform")
@@ -47,6 +120,17 @@ class User(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     is_active: bool = True
 
+class Principal(BaseModel):
+    """Authenticated user as seen by request handlers; never carries the password hash"""
+    id: str
+    username: str
+    email: str
+    full_name: Optional[str] = None
+    location: Optional[Dict[str, float]] = None
+    phone: Optional[str] = None
+    created_at: datetime
+    is_active: bool = True
+
 class UserCreate(BaseModel):
     username: str
     email: str
@@ -78,6 +162,7 @@ class Resource(BaseModel):
     is_active: bool = True
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    distance_km: Optional[float] = None  # only set on radius searches
 
 class ResourceCreate(BaseModel):
     title: str
@@ -96,6 +181,7 @@ class Message(BaseModel):
     receiver_id: str
     resource_id: Optional[str] = None
     content: str
+    thread_id: Optional[str] = None
     is_read: bool = False
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -104,6 +190,16 @@ class MessageCreate(BaseModel):
     resource_id: Optional[str] = None
     content: str
 
+class MessageThread(BaseModel):
+    """Summary of one conversation: between two users, optionally about one resource"""
+    id: str
+    participants: List[str]
+    resource_id: Optional[str] = None
+    last_message: Optional[Message] = None
+    unread: Dict[str, int] = {}  # participant id -> messages they have not read
+    created_at: datetime
+    updated_at: datetime
+
 class MCPRequest(BaseModel):
     action: str
     data: Optional[Dict[str, Any]] = None
@@ -124,9 +220,11 @@ class WaterSource(BaseModel):
     added_by: str  # user_id
     verified_by: Optional[str] = None  # user_id of verifier
     community_rating: float = 0.0
+    quality_score: Optional[float] = None  # 0 (unsafe) .. 1 (safe), time-decayed over all reports
     is_active: bool = True
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    distance_km: Optional[float] = None  # only set on radius searches
 
 class WaterSourceCreate(BaseModel):
     name: str
@@ -189,6 +287,7 @@ class InfrastructurePlan(BaseModel):
     is_active: bool = True
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    distance_km: Optional[float] = None  # only set on radius searches
 
 class InfrastructurePlanCreate(BaseModel):
     title: str
@@ -254,6 +353,28 @@ class WaterAlert(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class Notification(BaseModel):
+    """Inbox entry telling a user about a water alert near them or their water sources"""
+    id: str
+    user_id: str
+    kind: str  # water_alert
+    alert_id: str
+    title: str
+    alert_type: str
+    severity: str
+    priority: int  # 0 = critical .. 3 = low
+    location: Dict[str, float]
+    radius_km: float
+    distance_km: Optional[float] = None  # from the user's location, when known
+    water_source_ids: List[str] = []  # first affected sources
+    water_source_count: int = 0
+    read: bool = False
+    created_at: datetime
+    expires_at: Optional[datetime] = None
+
+class NotificationsRead(BaseModel):
+    ids: Optional[List[str]] = None  # all of the user's notifications when omitted
+
 class WaterAlertCreate(BaseModel):
     title: str
     description: str
@@ -288,12 +409,310 @@ class WaterUsageCreate(BaseModel):
     source_ids: List[str] = []
     notes: Optional[str] = None
 
+class WaterUsageBatchItem(WaterUsageCreate):
+    user_id: Optional[str] = None  # defaults to the caller; any other user is rejected
+
+class WaterUsageBatch(BaseModel):
+    items: List[WaterUsageBatchItem]
+
+# In-process caches
+class TTLCache:
+    """Bounded LRU cache whose entries expire ttl seconds after being set"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Any) -> Any:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Any, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Any):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+class SnapshotCache:
+    """Single value recomputed in the background every refresh_interval seconds.
+    
+    Readers get the current snapshot without waiting; they only compute inline
+    when there is none yet or it is older than max_age (e.g. the refresher
+    stalled). Concurrent refreshes are coalesced into one.
+    """
+
+    def __init__(self, name: str, compute, refresh_interval: float, max_age: float):
+        self.name = name
+        self.compute = compute
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.value = None
+        self.generated_at: Optional[datetime] = None
+        self.refreshes = 0
+        self.failures = 0
+        self._refreshed_at = 0.0
+        self._inflight: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def age(self) -> Optional[float]:
+        return time.monotonic() - self._refreshed_at if self.value is not None else None
+
+    async def get(self) -> Any:
+        if self.value is None or self.age() > self.max_age:
+            await self.refresh()
+        return self.value
+
+    async def refresh(self):
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._compute())
+        inflight = self._inflight
+        try:
+            await asyncio.shield(inflight)
+        finally:
+            if self._inflight is inflight and inflight.done():
+                self._inflight = None
+
+    async def _compute(self):
+        self.value = await self.compute()
+        self.generated_at = datetime.utcnow()
+        self._refreshed_at = time.monotonic()
+        self.refreshes += 1
+
+    async def _refresh_forever(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.failures += 1
+                logger.warning("%s refresh failed: %s", self.name, e)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_forever())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        age = self.age()
+        return {
+            "age_seconds": round(age, 1) if age is not None else None,
+            "refresh_interval_seconds": self.refresh_interval,
+            "max_age_seconds": self.max_age,
+            "refreshes": self.refreshes,
+            "failures": self.failures
+        }
+
+class CounterBuffer:
+    """Write-behind counters for one collection.
+    
+    increment() only adds to an in-memory tally; flush() applies all pending
+    tallies with a single unordered bulk_write of $inc updates. Flushes run
+    every flush_interval seconds, as soon as max_keys documents are pending,
+    and on close(), which bounds what a crash can lose. Increments from a
+    failed flush are merged back and retried with the next one.
+    """
+
+    def __init__(self, name: str, collection, key_field: str = "id", flush_interval: float = 10.0, max_keys: int = 10000, on_flush=None):
+        self.name = name
+        self.collection = collection
+        self.key_field = key_field
+        self.flush_interval = flush_interval
+        self.max_keys = max_keys
+        self.on_flush = on_flush  # async callable({key: {field: amount}}) with what each flush applied
+        self.pending: Dict[Any, Dict[str, int]] = {}
+        self.flushes = 0
+        self.flushed_increments = 0
+        self.failures = 0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._early_flush: Optional[asyncio.Future] = None
+
+    def _add(self, key: Any, field: str, amount: int):
+        counts = self.pending.setdefault(key, {})
+        counts[field] = counts.get(field, 0) + amount
+
+    def increment(self, key: Any, field: str, amount: int = 1):
+        self._add(key, field, amount)
+        if len(self.pending) >= self.max_keys and (self._early_flush is None or self._early_flush.done()):
+            self._early_flush = asyncio.ensure_future(self.flush())
+
+    def pending_count(self, key: Any, field: str) -> int:
+        """Increments of key.field not yet written, to add to a freshly read value"""
+        return self.pending.get(key, {}).get(field, 0)
+
+    async def flush(self) -> int:
+        """Write all pending increments; returns how many were applied"""
+        async with self._lock:
+            if not self.pending:
+                return 0
+            batch, self.pending = self.pending, {}
+            keys = list(batch)
+            operations = [UpdateOne({self.key_field: key}, {"$inc": batch[key]}) for key in keys]
+            failed = keys
+            try:
+                await self.collection.bulk_write(operations, ordered=False)
+                failed = []
+            except BulkWriteError as e:
+                failed = [keys[error["index"]] for error in e.details.get("writeErrors", [])]
+            except Exception as e:
+                logger.warning("%s flush failed: %s", self.name, e)
+            if failed:
+                self.failures += 1
+                for key in failed:
+                    for field, amount in batch[key].items():
+                        self._add(key, field, amount)
+            applied = sum(sum(batch[key].values()) for key in keys) - sum(sum(batch[key].values()) for key in failed)
+            self.flushes += 1
+            self.flushed_increments += applied
+        if self.on_flush is not None and applied:
+            try:
+                failed = set(failed)
+                await self.on_flush({key: batch[key] for key in keys if key not in failed})
+            except Exception as e:
+                logger.warning("%s on_flush failed: %s", self.name, e)
+        return applied
+
+    async def _flush_forever(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_forever())
+
+    async def close(self):
+        """Stop the periodic flush and write whatever is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending_keys": len(self.pending),
+            "pending_increments": sum(sum(counts.values()) for counts in self.pending.values()),
+            "flushes": self.flushes,
+            "flushed_increments": self.flushed_increments,
+            "failures": self.failures,
+            "flush_interval_seconds": self.flush_interval
+        }
+
+# Principals keyed by token subject (username)
+principal_cache = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL_SECONDS)
+PRINCIPAL_PROJECTION = {"_id": 0, "password_hash": 0}
+
+def invalidate_principal(username: str):
+    """Drop a cached principal; call whenever a user document is changed or deactivated"""
+    principal_cache.invalidate(username)
+
+# Password hashing
+class PasswordHasher:
+    """Runs bcrypt in a bounded thread pool so hashing never blocks the event loop.
+    
+    Calls beyond max_pending (running + queued) are rejected with a 503 instead
+    of piling up behind a login burst.
+    """
+
+    def __init__(self, context: CryptContext, workers: int, max_pending: int):
+        self.context = context
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+
+    def _timed(self, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.completed += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent sign-ins, please retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._timed, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify_and_update(self, password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+        """Verify a password; also return a new hash when the stored one uses outdated settings"""
+        return await self._run(self.context.verify_and_update, password, password_hash)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "in_flight": min(self.pending, self.workers),
+            "queue_depth": max(0, self.pending - self.workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "avg_ms": round(self.total_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 2)
+        }
+
+password_hasher = PasswordHasher(pwd_context, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
 # Authentication functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    return await password_hasher.verify_and_update(plain_password, hashed_password)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await password_hasher.hash(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -306,23 +725,32 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await principal_for_token(credentials.credentials)
+
+async def principal_for_token(token: str) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
     except jwt.PyJWTError:
         raise credentials_exception
     
-    user = await db.users.find_one({"username": username})
-    if user is None:
+    principal = principal_cache.get(username)
+    if principal is None:
+        user = await db.users.find_one({"username": username}, PRINCIPAL_PROJECTION)
+        if user is None:
+            raise credentials_exception
+        principal = Principal(**user)
+        principal_cache.set(username, principal)
+    if not principal.is_active:
         raise credentials_exception
-    return User(**user)
+    return principal
 
 def verify_mcp_api_key(credentials: HTTPAuthorizationCredentials = Depends(security)):
     if credentials.credentials != MCP_API_KEY:
@@ -332,29 +760,1522 @@ def verify_mcp_api_key(credentials: HTTPAuthorizationCredentials = Depends(secur
         )
     return True
 
-# Geocoding function
-async def geocode_address(address: str) -> Optional[Dict[str, float]]:
-    """Geocode address using Nominatim (OpenStreetMap)"""
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://nominatim.openstreetmap.org/search",
-                params={
-                    "q": address,
-                    "format": "json",
-                    "limit": 1
-                },
-                headers={"User-Agent": "GlobalHaven/1.0"}
+# Geocoding
+def normalize_address(address: str) -> str:
+    """Cache key for an address: case-folded, whitespace collapsed, tidy commas"""
+    key = " ".join(address.casefold().split())
+    return re.sub(r"\s*,\s*", ", ", key).strip(" ,.")
+
+class Geocoder:
+    """Nominatim client with a shared connection pool, layered caching and request coalescing.
+    
+    Lookups go memory -> persistent store (Mongo, with TTL) -> upstream. Misses
+    are cached too, for a shorter time. Concurrent lookups of the same address
+    share one upstream request, and upstream requests are serialized and spaced
+    at least min_interval seconds apart.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        store=None,
+        min_interval: float = 1.0,
+        timeout: float = 10.0,
+        ttl: timedelta = timedelta(days=30),
+        negative_ttl: timedelta = timedelta(hours=24),
+    ):
+        self.url = url
+        self.store = store
+        self.min_interval = min_interval
+        self.timeout = timeout
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = TTLCache(10000, 3600)
+        self.counters = {"store_hits": 0, "negative_hits": 0, "coalesced": 0, "upstream_requests": 0, "upstream_errors": 0}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._throttle = asyncio.Lock()
+        self._last_request = 0.0
+
+    def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=2, max_keepalive_connections=2),
+                headers={"User-Agent": "GlobalHaven/1.0"},
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def geocode(self, address: str) -> Optional[Dict[str, float]]:
+        key = normalize_address(address)
+        if not key:
+            return None
+        
+        cached = self.memory.get(key)
+        if cached is not None:
+            location, = cached
+            if location is None:
+                self.counters["negative_hits"] += 1
+            return location
+        
+        future = self._inflight.get(key)
+        if future is not None:
+            self.counters["coalesced"] += 1
+        else:
+            future = asyncio.ensure_future(self._resolve(key, address))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def cached(self, address: str) -> Optional[Tuple[Optional[Dict[str, float]]]]:
+        """(location,) if the address has a cached answer (location None for a cached miss), else None; never goes upstream"""
+        key = normalize_address(address)
+        if not key:
+            return (None,)
+        cached = self.memory.get(key)
+        if cached is not None:
+            return cached
+        return await self._stored(key)
+
+    async def _stored(self, key: str) -> Optional[Tuple[Optional[Dict[str, float]]]]:
+        if self.store is None:
+            return None
+        doc = await self.store.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+        if doc is None:
+            return None
+        self.counters["store_hits"] += 1
+        if doc["location"] is None:
+            self.counters["negative_hits"] += 1
+        self.memory.set(key, (doc["location"],))
+        return (doc["location"],)
+
+    async def _resolve(self, key: str, address: str) -> Optional[Dict[str, float]]:
+        stored = await self._stored(key)
+        if stored is not None:
+            return stored[0]
+        
+        try:
+            location = await self._request(address)
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            # Transient failures are not cached
+            self.counters["upstream_errors"] += 1
+            logger.warning("Geocoding error for %r: %s", address, e)
+            return None
+        
+        self.memory.set(key, (location,))
+        if self.store is not None:
+            now = datetime.utcnow()
+            expires_at = now + (self.ttl if location is not None else self.negative_ttl)
+            await self.store.update_one(
+                {"_id": key},
+                {"$set": {"location": location, "expires_at": expires_at, "updated_at": now}},
+                upsert=True
             )
-            data = response.json()
-            if data:
-                return {"lat": float(data[0]["lat"]), "lng": float(data[0]["lon"])}
-    except Exception as e:
-        print(f"Geocoding error: {e}")
+        return location
+
+    async def _request(self, address: str) -> Optional[Dict[str, float]]:
+        self.start()
+        async with self._throttle:
+            wait = self._last_request + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                self.counters["upstream_requests"] += 1
+                response = await self._client.get(self.url, params={"q": address, "format": "json", "limit": 1})
+                response.raise_for_status()
+                data = response.json()
+            finally:
+                self._last_request = time.monotonic()
+        if data:
+            return {"lat": float(data[0]["lat"]), "lng": float(data[0]["lon"])}
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"memory": self.memory.stats(), **self.counters, "inflight": len(self._inflight)}
+
+geocoder = Geocoder(
+    NOMINATIM_URL,
+    store=db.geocode_cache,
+    min_interval=NOMINATIM_MIN_INTERVAL_SECONDS,
+    timeout=GEOCODE_TIMEOUT_SECONDS,
+    ttl=timedelta(days=GEOCODE_CACHE_TTL_DAYS),
+    negative_ttl=timedelta(hours=GEOCODE_NEGATIVE_TTL_HOURS),
+)
+
+# Offline gazetteer
+def normalize_place_name(name: str) -> str:
+    """Case-folded, accent-free, alphanumeric words only"""
+    decomposed = unicodedata.normalize("NFKD", name.casefold())
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(re.sub(r"[\W_]+", " ", stripped).split())
+
+def name_trigrams(name: str) -> set:
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class Gazetteer:
+    """In-memory place index loaded from a GeoNames-style TSV.
+    
+    Places live in parallel compact arrays. Lookups try an exact name match,
+    then a prefix range over the sorted names, then trigram similarity for
+    misspellings, and can be scoped by country and first-level admin region.
+    """
+
+    FUZZY_THRESHOLD = 0.5
+    FUZZY_CANDIDATES = 50
+    MAX_POSTING = 20000  # trigrams this common do not help narrow candidates
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.countries: List[str] = []
+        self.admin1: List[str] = []
+        self.lat = array("d")
+        self.lng = array("d")
+        self.population = array("q")
+        self.country_codes: Dict[str, str] = {}  # normalized country name -> ISO code
+        self.admin1_codes: Dict[str, set] = defaultdict(set)  # normalized region name -> {(country, code)}
+        self._exact: Dict[str, List[int]] = defaultdict(list)
+        self._trigrams: Dict[str, array] = defaultdict(lambda: array("I"))
+        self._sorted_keys: List[str] = []
+        self._sorted_ids = array("I")
+        self._country_set: set = set()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def load(cls, path: str) -> "Gazetteer":
+        """Load a GeoNames dump (geonameid, name, asciiname, alternatenames, lat, lng, class, code, country, cc2, admin1, ..., population, ...)"""
+        gazetteer = cls()
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                row = line.rstrip("\n").split("\t")
+                if len(row) < 15 or line.startswith("#"):
+                    continue
+                gazetteer.add(
+                    row[1], float(row[4]), float(row[5]), row[8], row[10],
+                    population=int(row[14] or 0),
+                    alternate_names=([row[2]] + row[3].split(",")) if row[3] else [row[2]],
+                    feature_code=row[7]
+                )
+        gazetteer.finalize()
+        return gazetteer
+
+    def add(self, name: str, lat: float, lng: float, country: str = "", admin1: str = "", population: int = 0, alternate_names: List[str] = (), feature_code: str = ""):
+        place_id = len(self.names)
+        self.names.append(name)
+        self.countries.append(country.upper())
+        self.admin1.append(admin1)
+        self.lat.append(lat)
+        self.lng.append(lng)
+        self.population.append(population)
+        
+        primary = normalize_place_name(name)
+        keys = {primary} | {normalize_place_name(alt) for alt in alternate_names if alt}
+        keys.discard("")
+        for key in keys:
+            self._exact[key].append(place_id)
+        for trigram in name_trigrams(primary):
+            self._trigrams[trigram].append(place_id)
+        
+        if feature_code.startswith("PCL"):
+            for key in keys:
+                self.country_codes[key] = country.upper()
+        elif feature_code == "ADM1":
+            for key in keys:
+                self.admin1_codes[key].add((country.upper(), admin1))
+
+    def finalize(self):
+        """Freeze the indexes after loading"""
+        self._exact = dict(self._exact)
+        self._trigrams = dict(self._trigrams)
+        ordered = sorted((key, place_id) for key, ids in self._exact.items() for place_id in ids)
+        self._sorted_keys = [key for key, _ in ordered]
+        self._sorted_ids = array("I", (place_id for _, place_id in ordered))
+        self._country_set = set(self.countries)
+
+    def _in_scope(self, place_id: int, country: Optional[str], regions: Optional[set]) -> bool:
+        if country and self.countries[place_id] != country:
+            return False
+        if regions and (self.countries[place_id], self.admin1[place_id]) not in regions:
+            return False
+        return True
+
+    def _candidates(self, key: str, limit: int) -> List[Tuple[float, int]]:
+        """(score, place_id) from exact, prefix and trigram matches, best first"""
+        scores: Dict[int, float] = {}
+        for place_id in self._exact.get(key, []):
+            scores[place_id] = 1.0
+        
+        start = bisect_left(self._sorted_keys, key)
+        end = start
+        while end < len(self._sorted_keys) and self._sorted_keys[end].startswith(key) and end - start < limit * 20:
+            place_id = self._sorted_ids[end]
+            scores.setdefault(place_id, 0.5 + 0.4 * len(key) / len(self._sorted_keys[end]))
+            end += 1
+        
+        if not scores:
+            query_trigrams = name_trigrams(key)
+            overlaps: Dict[int, int] = defaultdict(int)
+            for trigram in query_trigrams:
+                posting = self._trigrams.get(trigram)
+                if posting is not None and len(posting) <= self.MAX_POSTING:
+                    for place_id in posting:
+                        overlaps[place_id] += 1
+            best = sorted(overlaps.items(), key=lambda item: -item[1])[:self.FUZZY_CANDIDATES]
+            for place_id, overlap in best:
+                candidate_trigrams = len(name_trigrams(normalize_place_name(self.names[place_id])))
+                dice = 2 * overlap / (len(query_trigrams) + candidate_trigrams)
+                if dice >= self.FUZZY_THRESHOLD:
+                    scores[place_id] = 0.5 * dice
+        
+        return sorted(((score, place_id) for place_id, score in scores.items()), key=lambda item: (-item[0], -self.population[item[1]]))
+
+    def search(self, query: str, country: Optional[str] = None, admin1: Optional[str] = None, limit: int = 5) -> List[Dict[str, Any]]:
+        """Best matches for a place name, optionally scoped to a country code and/or region name"""
+        key = normalize_place_name(query)
+        if not key:
+            return []
+        regions = self.admin1_codes.get(normalize_place_name(admin1)) if admin1 else None
+        if admin1 and not regions:
+            return []
+        
+        results = []
+        for score, place_id in self._candidates(key, limit):
+            if self._in_scope(place_id, country.upper() if country else None, regions):
+                results.append({
+                    "name": self.names[place_id],
+                    "country": self.countries[place_id],
+                    "admin1": self.admin1[place_id],
+                    "location": {"lat": self.lat[place_id], "lng": self.lng[place_id]},
+                    "score": round(score, 3)
+                })
+                if len(results) >= limit:
+                    break
+        return results
+
+    def lookup(self, address: str) -> Optional[Dict[str, float]]:
+        """Geocode "place[, region][, country]"; trailing parts that name a known country or region scope the match"""
+        parts = [part for part in (p.strip() for p in address.split(",")) if part]
+        if not parts:
+            return None
+        country, admin1 = None, None
+        for hint in parts[1:]:
+            key = normalize_place_name(hint)
+            if len(key) == 2 and key.upper() in self._country_set:
+                country = key.upper()
+            elif key in self.country_codes:
+                country = self.country_codes[key]
+            elif key in self.admin1_codes:
+                admin1 = hint
+        
+        matches = self.search(parts[0], country=country, admin1=admin1, limit=1)
+        if not matches and (country or admin1):
+            matches = self.search(parts[0], limit=1)
+        return matches[0]["location"] if matches else None
+
+gazetteer: Optional[Gazetteer] = None
+
+async def load_gazetteer():
+    global gazetteer
+    if GAZETTEER_PATH and "gazetteer" in GEOCODER_PROVIDERS:
+        start = time.perf_counter()
+        gazetteer = await asyncio.get_running_loop().run_in_executor(None, Gazetteer.load, GAZETTEER_PATH)
+        logger.info("gazetteer loaded %d places from %s in %.1fs", len(gazetteer), GAZETTEER_PATH, time.perf_counter() - start)
+
+async def geocode_address(address: str, upstream: bool = True) -> Optional[Dict[str, float]]:
+    """Geocode address with the configured providers in order (Nominatim, offline gazetteer).
+    
+    With upstream=False Nominatim only answers from its caches.
+    """
+    for provider in GEOCODER_PROVIDERS:
+        if provider == "gazetteer":
+            location = gazetteer.lookup(address) if gazetteer is not None else None
+        elif provider == "nominatim":
+            if upstream:
+                location = await geocoder.geocode(address)
+            else:
+                cached = await geocoder.cached(address)
+                location = cached[0] if cached else None
+        else:
+            continue
+        if location:
+            return location
+    return None
+
+# Pagination helpers
+# List endpoints use keyset pagination on a stable (sort_field, id) key. The
+# cursor is an opaque token holding the key of the last item on the page, so
+# every page is a bounded index range scan regardless of depth.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(values: List[Any]) -> str:
+    payload = [{"$date": value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(payload, list):
+            raise ValueError("cursor payload must be a list")
+        return [
+            datetime.fromisoformat(value["$date"]) if isinstance(value, dict) else value
+            for value in payload
+        ]
+    except (ValueError, TypeError, KeyError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def page_limit(value: Any, default: int = DEFAULT_PAGE_SIZE) -> int:
+    """Clamp an MCP-supplied limit to [1, MAX_PAGE_SIZE]"""
+    try:
+        return max(1, min(int(value if value is not None else default), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="limit must be an integer")
+
+def keyset_query(filter_query: dict, sort_field: str, direction: int, cursor: Optional[str]) -> dict:
+    """Restrict filter_query to items after the cursor in (sort_field, id) order"""
+    if not cursor:
+        return filter_query
+    values = decode_cursor(cursor)
+    if len(values) != 2:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    last_value, last_id = values
+    op = "$lt" if direction < 0 else "$gt"
+    after = {"$or": [{sort_field: {op: last_value}}, {sort_field: last_value, "id": {op: last_id}}]}
+    return {"$and": [filter_query, after]} if filter_query else after
+
+async def paginate(collection, filter_query: dict, sort_field: str, direction: int, limit: int, cursor: Optional[str] = None, projection: Optional[dict] = None) -> Tuple[List[dict], Optional[str]]:
+    """Fetch one page ordered by (sort_field, id) and the cursor for the next page, if any"""
+    query = keyset_query(filter_query, sort_field, direction, cursor)
+    docs = await collection.find(query, projection).sort([(sort_field, direction), ("id", direction)]).limit(limit + 1).to_list(limit + 1)
+    return split_page(docs, limit, sort_field)
+
+# Response serialization
+# List endpoints fetch only the fields of their response model. With
+# FAST_SERIALIZATION enabled they also skip building one model per document
+# and FastAPI's response_model re-validation: the page is either validated in
+# one TypeAdapter call (`validate`) or, for documents this API wrote itself,
+# passed through with defaults filled in (`trusted`), then rendered by orjson.
+# Handlers keep their response_model, so the OpenAPI schema is unchanged.
+#
+# A `fields` selection (sparse fieldset) narrows both the projection and the
+# response to a generated sub-model of the listed fields. Fields that paging
+# and location filtering read are always fetched, then dropped from the output.
+PAGE_KEY_FIELDS = ("id", "created_at", "date", "test_date", "community_rating", "distance_km", "location", "radius_km")
+SPARSE_CACHE_SIZE = 256  # fieldsets are client-chosen, so the per-fieldset models and adapters are bounded
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson when installed; datetimes become ISO strings"""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(content, default=json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def parse_fields(model, fields: Any) -> Optional[Tuple[str, ...]]:
+    """Validate a sparse fieldset ("a,b" or ["a", "b"]) against a response model"""
+    if not fields:
+        return None
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    if not isinstance(fields, list) or not all(isinstance(name, str) for name in fields):
+        raise HTTPException(status_code=400, detail="fields must be a comma-separated string or a list of field names")
+    requested = dict.fromkeys(name.strip() for name in fields if name.strip())
+    unknown = [name for name in requested if name not in model.model_fields]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(model.model_fields)}"
+        )
+    # Model order, so every permutation of the same fields shares one cached sparse model
+    return tuple(name for name in model.model_fields if name in requested) or None
+
+@lru_cache(maxsize=SPARSE_CACHE_SIZE)
+def sparse_model(model, fields: Tuple[str, ...]):
+    """Response model restricted to fields, keeping their types and defaults"""
+    return create_model(
+        f"{model.__name__}Fields",
+        **{name: (field.annotation, field) for name, field in model.model_fields.items() if name in fields}
+    )
+
+@lru_cache(maxsize=SPARSE_CACHE_SIZE)
+def response_projection(model, fields: Optional[Tuple[str, ...]] = None) -> Dict[str, int]:
+    """Mongo projection returning exactly the fields of a response model (or of a fieldset plus paging keys)"""
+    if fields:
+        fields = fields + tuple(name for name in PAGE_KEY_FIELDS if name in model.model_fields and name not in fields)
+    return {"_id": 0, **{name: 1 for name in (fields or model.model_fields)}}
+
+@lru_cache(maxsize=SPARSE_CACHE_SIZE)
+def list_adapter(model) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+@lru_cache(maxsize=None)
+def field_defaults(model) -> Dict[str, Any]:
+    """Static defaults of a model, for documents stored before a field existed"""
+    return {name: field.default for name, field in model.model_fields.items() if field.default_factory is None and not field.is_required()}
+
+def serialize_page(model, docs: List[dict], fields: Optional[Tuple[str, ...]] = None) -> List[Any]:
+    """JSON-ready list equal to what FastAPI renders for response_model=List[model]"""
+    if fields:
+        model = sparse_model(model, fields)
+    if FAST_SERIALIZATION == "trusted":
+        defaults = field_defaults(model)
+        if fields:
+            return [{**defaults, **{name: doc[name] for name in fields if name in doc}} for doc in docs]
+        return [{**defaults, **doc} for doc in docs]
+    adapter = list_adapter(model)
+    return adapter.dump_python(adapter.validate_python(docs), mode="json")
+
+def list_response(model, docs: List[dict], next_cursor: Optional[str], response: Response, fields: Optional[Tuple[str, ...]] = None, facets: Optional[dict] = None):
+    """Body of a REST list endpoint declared with response_model=List[model]"""
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    if facets is not None:
+        response.headers[FACETS_HEADER] = facets_header(facets)
+    if FAST_SERIALIZATION == "off" and not fields:
+        return [model(**doc) for doc in docs]
+    headers = {name: value for name, value in response.headers.items() if name != "content-length"}
+    return FastJSONResponse(serialize_page(model, docs, fields), headers=headers)
+
+def mcp_page(key: str, model, docs: List[dict], next_cursor: Optional[str], fields: Optional[Tuple[str, ...]] = None, facets: Optional[dict] = None):
+    """Body of an MCP search action: {key: [...], "next_cursor": ...}, plus "facets" when asked for"""
+    extra = {"facets": facets} if facets is not None else {}
+    if FAST_SERIALIZATION == "off" and not fields:
+        return {key: [model(**doc).dict() for doc in docs], "next_cursor": next_cursor, **extra}
+    return FastJSONResponse({key: serialize_page(model, docs, fields), "next_cursor": next_cursor, **extra})
+
+# Conditional GET
+# Writes bump a version counter per collection (or per user, for per-user
+# lists) in `collection_versions`. List endpoints derive a strong ETag from
+# that version and the query string, and answer a matching If-None-Match with
+# 304 after a single _id lookup, without reading any documents. The version is
+# read before the page, so a body is never tagged newer than what it reflects.
+ALERT_EXPIRY_BUCKET_SECONDS = 60  # active alert lists also change when alerts expire
+
+def version_scope(collection: str, user_id: Optional[str] = None) -> str:
+    return f"{collection}:user:{user_id}" if user_id else collection
+
+async def bump_versions(*scopes: str):
+    """Invalidate the ETags of every list reading from scopes"""
+    await db.collection_versions.bulk_write(
+        [UpdateOne({"_id": scope}, {"$inc": {"version": 1}}, upsert=True) for scope in dict.fromkeys(scopes)],
+        ordered=False
+    )
+
+async def collection_version(scope: str) -> int:
+    doc = await db.collection_versions.find_one({"_id": scope}, {"version": 1})
+    return doc["version"] if doc else 0
+
+def list_etag(scope: str, version: int, request: Request, *extra: Any) -> str:
+    params = sorted(request.query_params.multi_items())
+    digest = hashlib.sha1(json.dumps([request.url.path, scope, version, params, *extra]).encode()).hexdigest()
+    return f'"{digest}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 requires for GET)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+async def not_modified(request: Request, response: Response, scope: str, *extra: Any, version: Optional[int] = None) -> Optional[Response]:
+    """304 response if the client's copy of this list is current; otherwise tag the response and return None.
+    
+    Pass version when the page is served from an in-memory copy loaded at that version.
+    """
+    if version is None:
+        version = await collection_version(scope)
+    etag = list_etag(scope, version, request, *extra)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
     return None
 
+# Geospatial helpers
+# Documents keep the {"lat", "lng"} `location` dict used by the API and also
+# carry a GeoJSON `geo` point so radius searches can run on a 2dsphere index.
+GEO_COLLECTIONS = ["resources", "water_sources", "infrastructure_plans", "users"]
+EARTH_RADIUS_KM = 6371.0
+
+def geo_point(location: Dict[str, float]) -> Dict[str, Any]:
+    """Convert a {"lat", "lng"} dict into a GeoJSON point"""
+    return {"type": "Point", "coordinates": [location["lng"], location["lat"]]}
+
+def geo_document(model: BaseModel) -> dict:
+    """Storage form of a located model, with its GeoJSON point"""
+    return {**model.dict(exclude={"distance_km"}), "geo": geo_point(model.location)}
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance in km"""
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def geo_near_stage(filter_query: dict, lat: float, lng: float, radius_km: float) -> dict:
+    return {"$geoNear": {
+        "near": geo_point({"lat": lat, "lng": lng}),
+        "key": "geo",
+        "distanceField": "distance_km",
+        "distanceMultiplier": 0.001,
+        "maxDistance": radius_km * 1000,
+        "spherical": True,
+        "query": filter_query
+    }}
+
+def geo_cursor_position(cursor: str) -> Tuple[float, dict]:
+    """Distance of the last item returned and a $match for the items after it"""
+    values = decode_cursor(cursor)
+    if len(values) != 2:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    last_distance, last_id = values
+    return last_distance, {"$match": {"$or": [
+        {"distance_km": {"$gt": last_distance}},
+        {"distance_km": last_distance, "id": {"$gt": last_id}}
+    ]}}
+
+def split_page(docs: List[dict], limit: int, sort_field: str) -> Tuple[List[dict], Optional[str]]:
+    """Trim a limit + 1 fetch to the page and the cursor for the next one, if any"""
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    return docs, encode_cursor([docs[-1][sort_field], docs[-1]["id"]])
+
+async def geo_window(collection, near: dict, after: Optional[dict], docs: List[dict], limit: int, projection: Optional[dict] = None) -> List[dict]:
+    """Order a limit + 1 window from $geoNear by (distance_km, id).
+
+    $geoNear returns documents nearest first but equal distances in no fixed
+    order, so when the page ends inside a run of ties the window may hold the
+    wrong ones. Only then, re-read that one ring: every document at the
+    boundary distance past the cursor, lowest ids first.
+    """
+    if len(docs) > limit and docs[limit - 1]["distance_km"] == docs[limit]["distance_km"]:
+        boundary = docs[limit]["distance_km"]
+        ring = {**near["$geoNear"], "minDistance": max(0.0, boundary * 1000 - 1), "maxDistance": boundary * 1000 + 1}
+        pipeline = [{"$geoNear": ring}, {"$match": {"distance_km": boundary}}]
+        if after:
+            pipeline.append(after)
+        pipeline += [{"$sort": {"id": 1}}, {"$limit": limit + 1}]
+        if projection:
+            pipeline.append({"$project": projection})
+        ties = await collection.aggregate(pipeline).to_list(limit + 1)
+        docs = [doc for doc in docs if doc["distance_km"] < boundary] + ties
+    docs.sort(key=lambda doc: (doc["distance_km"], doc["id"]))
+    return docs
+
+async def geo_search(collection, filter_query: dict, lat: float, lng: float, radius_km: float, limit: int, cursor: Optional[str] = None, projection: Optional[dict] = None) -> Tuple[List[dict], Optional[str]]:
+    """Return one page of documents matching filter_query within radius_km, nearest first, with distance_km set"""
+    near = geo_near_stage(filter_query, lat, lng, radius_km)
+    pipeline, after = [near], None
+    if cursor:
+        last_distance, after = geo_cursor_position(cursor)
+        # Start the index scan just inside the last ring, then drop what was already returned
+        near["$geoNear"]["minDistance"] = max(0.0, last_distance * 1000 - 1)
+        pipeline.append(after)
+    # No $sort: re-sorting would make Mongo read and sort every match in the radius on every
+    # page; geo_window settles distance ties at the page boundary instead
+    pipeline.append({"$limit": limit + 1})
+    if projection:
+        pipeline.append({"$project": projection})
+    
+    docs = await collection.aggregate(pipeline).to_list(limit + 1)
+    return split_page(await geo_window(collection, near, after, docs, limit, projection), limit, "distance_km")
+
+# Faceted pages
+# With facets= a list runs as one aggregation: the filter (or $geoNear for a
+# radius search) first, then a $facet whose branches are the page and one
+# $group per facet field. The counts cover every match in the same area and
+# filters, not just the page, without a second round trip; they do mean
+# reading every match, so only ask for them when they are shown.
+FACET_FIELDS = {
+    "resources": ("category", "type"),
+    "water_sources": ("quality_status", "type", "accessibility"),
+    "infrastructure_plans": ("plan_type", "funding_status"),
+}
+FACETS_HEADER = "X-Facets"
+FACET_MAX_BUCKETS = 20  # most common values per field; categories are free-form
+FACETS_HEADER_MAX_BYTES = 4096  # well under common proxy header limits (8 KB)
+
+def parse_facets(collection_name: str, facets: Any) -> Tuple[str, ...]:
+    """Validate facets ("a,b" or ["a", "b"]) against the fields that can be counted for a collection"""
+    if not facets:
+        return ()
+    if isinstance(facets, str):
+        facets = facets.split(",")
+    if not isinstance(facets, list) or not all(isinstance(name, str) for name in facets):
+        raise HTTPException(status_code=400, detail="facets must be a comma-separated string or a list of field names")
+    names = tuple(dict.fromkeys(name.strip() for name in facets if name.strip()))
+    allowed = FACET_FIELDS[collection_name]
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown facets: {', '.join(unknown)}. Available: {', '.join(allowed)}")
+    return names
+
+def facet_buckets(facets: Tuple[str, ...], groups: Dict[str, List[dict]]) -> Dict[str, Dict[str, int]]:
+    """{field: {value: count}} for the FACET_MAX_BUCKETS largest values; documents without the field count as unknown"""
+    return {
+        field: {
+            (bucket["_id"] if bucket["_id"] is not None else "unknown"): bucket["count"]
+            for bucket in sorted(groups[field], key=lambda bucket: (-bucket["count"], str(bucket["_id"])))[:FACET_MAX_BUCKETS]
+        }
+        for field in facets
+    }
+
+def facets_header(facets: Dict[str, Dict[str, int]]) -> str:
+    """Compact JSON for the X-Facets header, dropping the smallest buckets until it fits FACETS_HEADER_MAX_BYTES"""
+    facets = {field: dict(buckets) for field, buckets in facets.items()}
+    while True:
+        value = json.dumps(facets, separators=(",", ":"))  # ASCII-only, as header values must be
+        longest = max(facets.values(), key=len, default=None)
+        if len(value) <= FACETS_HEADER_MAX_BYTES or not longest:
+            return value
+        longest.popitem()
+
+async def list_page(collection, filter_query: dict, near: Optional[Tuple[float, float, float]], limit: int, cursor: Optional[str], projection: Optional[dict], facets: Tuple[str, ...] = ()) -> Tuple[List[dict], Optional[str], Optional[Dict[str, Dict[str, int]]]]:
+    """One page nearest first within `near` = (lat, lng, radius_km), or newest first, plus facet counts when asked"""
+    if not facets:
+        if near:
+            return (*await geo_search(collection, filter_query, *near, limit, cursor, projection), None)
+        return (*await paginate(collection, filter_query, "created_at", -1, limit, cursor, projection), None)
+    
+    after = None
+    if near:
+        sort_field, pipeline, page = "distance_km", [geo_near_stage(filter_query, *near)], []
+        if cursor:
+            after = geo_cursor_position(cursor)[1]
+            page.append(after)
+    else:
+        sort_field, pipeline, page = "created_at", [{"$match": filter_query}], []
+        if cursor:
+            page.append({"$match": keyset_query({}, "created_at", -1, cursor)})
+        page.append({"$sort": {"created_at": -1, "id": -1}})
+    page.append({"$limit": limit + 1})
+    if projection:
+        page.append({"$project": projection})
+    pipeline.append({"$facet": {
+        "page": page,
+        **{
+            field: [
+                {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}},
+                {"$limit": FACET_MAX_BUCKETS}
+            ]
+            for field in facets
+        }
+    }})
+    
+    result = (await collection.aggregate(pipeline).to_list(1))[0]
+    docs = await geo_window(collection, pipeline[0], after, result["page"], limit, projection) if near else result["page"]
+    return (*split_page(docs, limit, sort_field), facet_buckets(facets, result))
+
+# Reverse-geofence index for circular areas (water alerts). Each circle stores
+# the grid cells it touches at the finest level of a fixed hierarchy that keeps
+# the cover small; a point is looked up by its own cell at every level, so
+# "which circles cover me" is an indexed $in instead of a scan.
+COVERAGE_CELL_DEGREES = [0.05, 0.2, 1.0, 4.0, 15.0, 45.0]  # each divides 360 so columns wrap cleanly
+COVERAGE_MAX_CELLS = 16
+COVERAGE_GLOBAL_CELL = "*"
+
+def _coverage_cell_id(level: int, ix: int, iy: int) -> str:
+    columns = round(360 / COVERAGE_CELL_DEGREES[level])
+    return f"{level}:{ix % columns}:{iy}"
+
+def point_coverage_cells(lat: float, lng: float) -> List[str]:
+    """Cells containing a point at every level, plus the global cell"""
+    cells = [COVERAGE_GLOBAL_CELL]
+    for level, size in enumerate(COVERAGE_CELL_DEGREES):
+        cells.append(_coverage_cell_id(level, math.floor((lng + 180) / size), math.floor((lat + 90) / size)))
+    return cells
+
+def circle_coverage_cells(location: Dict[str, float], radius_km: float) -> List[str]:
+    """Cells covering a circle's bounding box at the finest level with at most COVERAGE_MAX_CELLS cells"""
+    lat, lng = location["lat"], location["lng"]
+    angular_radius = radius_km / EARTH_RADIUS_KM
+    dlat = math.degrees(angular_radius)
+    if lat + dlat >= 90 or lat - dlat <= -90:
+        return [COVERAGE_GLOBAL_CELL]
+    # Widest longitude extent of a spherical cap
+    sin_extent = math.sin(angular_radius) / math.cos(math.radians(lat))
+    if sin_extent >= 1:
+        return [COVERAGE_GLOBAL_CELL]
+    dlng = math.degrees(math.asin(sin_extent))
+    
+    for level, size in enumerate(COVERAGE_CELL_DEGREES):
+        x0, x1 = math.floor((lng - dlng + 180) / size), math.floor((lng + dlng + 180) / size)
+        y0, y1 = math.floor((lat - dlat + 90) / size), math.floor((lat + dlat + 90) / size)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= COVERAGE_MAX_CELLS:
+            return sorted({_coverage_cell_id(level, ix, iy) for ix in range(x0, x1 + 1) for iy in range(y0, y1 + 1)})
+    return [COVERAGE_GLOBAL_CELL]
+
+def alert_document(alert: WaterAlert) -> dict:
+    """Storage form of an alert, including its coverage cells; new alerts await fan-out"""
+    return {**alert.dict(), "coverage_cells": circle_coverage_cells(alert.location, alert.radius_km), "fanout": "pending"}
+
+def alerts_covering(alerts: List[dict], lat: float, lng: float) -> List[dict]:
+    """Exact point-in-circle check for candidates returned by the coverage index"""
+    return [
+        alert for alert in alerts
+        if haversine_km(lat, lng, alert["location"]["lat"], alert["location"]["lng"]) <= alert["radius_km"]
+    ]
+
+async def alerts_page(filter_query: dict, lat: Optional[float], lng: Optional[float], limit: int, cursor: Optional[str], projection: Optional[dict] = None) -> Tuple[List[dict], Optional[str]]:
+    """One page of alerts, newest first; with a location, only alerts whose circle contains it"""
+    if lat is None or lng is None:
+        return await paginate(db.water_alerts, filter_query, "created_at", -1, limit, cursor, projection)
+    
+    filter_query = {**filter_query, "coverage_cells": {"$in": point_coverage_cells(lat, lng)}}
+    alerts = []
+    while True:
+        candidates, cursor = await paginate(db.water_alerts, filter_query, "created_at", -1, limit, cursor, projection)
+        alerts += alerts_covering(candidates, lat, lng)
+        if len(alerts) >= limit or not cursor:
+            break
+    if len(alerts) > limit:
+        alerts = alerts[:limit]
+        cursor = encode_cursor([alerts[-1]["created_at"], alerts[-1]["id"]])
+    return alerts, cursor
+
+async def backfill_spatial_fields():
+    """Backfill `geo`/`coverage_cells` on documents written before they existed"""
+    for name in GEO_COLLECTIONS:
+        await db[name].update_many(
+            {"geo": {"$exists": False}, "location.lat": {"$exists": True}, "location.lng": {"$exists": True}},
+            [{"$set": {"geo": {"type": "Point", "coordinates": ["$location.lng", "$location.lat"]}}}]
+        )
+    
+    async for alert in db.water_alerts.find({"coverage_cells": {"$exists": False}}, {"id": 1, "location": 1, "radius_km": 1}):
+        await db.water_alerts.update_one(
+            {"id": alert["id"]},
+            {"$set": {"coverage_cells": circle_coverage_cells(alert["location"], alert.get("radius_km", 5.0))}}
+        )
+
+# Full-text search
+# `q=` searches rank against an in-process BM25 index per collection. It is
+# built from the active documents when the worker starts. The writing worker
+# updates it directly; other workers' writes are pulled in by polling the
+# collection version and re-reading documents updated since the last sync.
+# The last query word also matches as a prefix, for typeahead. With a
+# location, relevance is blended with proximity and results outside the radius
+# are dropped. Only ids are ranked in memory; the page is then one `$in` read.
+SEARCH_PREFIX_WEIGHT = 0.7
+SEARCH_MAX_PREFIX_TERMS = 50
+SEARCH_SYNC_OVERLAP = timedelta(minutes=1)  # tolerated clock skew between workers
+
+def search_tokens(text: str) -> List[str]:
+    """Normalized words, with a plain plural `s` folded ("bags" -> "bag")"""
+    tokens = []
+    for token in normalize_place_name(text).split():
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+class TextIndex:
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, collection, scope: str, text_fields: Dict[str, int], filter_fields: Tuple[str, ...], refresh_interval: float):
+        self.collection = collection
+        self.scope = scope
+        self.text_fields = text_fields  # field -> weight (term frequency multiplier)
+        self.filter_fields = filter_fields
+        self.refresh_interval = refresh_interval
+        self.version: Optional[int] = None
+        self.synced_at: Optional[datetime] = None
+        self.syncs = 0
+        self._docs: Dict[str, Tuple[dict, Dict[str, int], int]] = {}  # id -> (filter attrs, term counts, length)
+        self._postings: Dict[str, Dict[str, int]] = {}  # term -> {id: weighted term frequency}
+        self._terms: List[str] = []  # sorted, for prefix lookups; may hold terms whose postings emptied
+        self._total_length = 0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._docs)
+
+    @property
+    def projection(self) -> Dict[str, int]:
+        fields = ["id", "is_active", "location", *self.text_fields, *self.filter_fields]
+        return {"_id": 0, **{field: 1 for field in fields}}
+
+    def add(self, doc: dict, sort_terms: bool = True):
+        """Index (or re-index) a document; inactive documents are removed"""
+        self.remove(doc["id"])
+        if not doc.get("is_active", True):
+            return
+        counts: Dict[str, int] = defaultdict(int)
+        for field, weight in self.text_fields.items():
+            for token in search_tokens(doc.get(field) or ""):
+                counts[token] += weight
+        attrs = {field: doc.get(field) for field in self.filter_fields}
+        attrs["location"] = doc.get("location")
+        length = sum(counts.values())
+        self._docs[doc["id"]] = (attrs, dict(counts), length)
+        self._total_length += length
+        for term, count in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                if sort_terms:
+                    insort(self._terms, term)
+            postings[doc["id"]] = count
+
+    def remove(self, doc_id: str):
+        entry = self._docs.pop(doc_id, None)
+        if entry is None:
+            return
+        self._total_length -= entry[2]
+        for term in entry[1]:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+
+    def _prefix_terms(self, prefix: str) -> List[str]:
+        terms, i = [], bisect_left(self._terms, prefix)
+        # Walk forward by index: slicing (or islice) would touch the whole tail of the vocabulary
+        while i < len(self._terms) and self._terms[i].startswith(prefix):
+            if self._terms[i] in self._postings:
+                terms.append(self._terms[i])
+            i += 1
+        # The most common completions, if a short prefix has many
+        return heapq.nlargest(SEARCH_MAX_PREFIX_TERMS, terms, key=lambda term: len(self._postings[term]))
+
+    async def _load(self):
+        version = await collection_version(self.scope)
+        started = datetime.utcnow()
+        self._docs, self._postings, self._total_length = {}, {}, 0
+        async for doc in self.collection.find({"is_active": True}, self.projection):
+            self.add(doc, sort_terms=False)
+        self._terms = sorted(self._postings)
+        self.version, self.synced_at, self._loaded = version, started, True
+
+    async def ensure(self):
+        if not self._loaded:
+            async with self._lock:
+                if not self._loaded:
+                    await self._load()
+
+    async def sync(self):
+        """Pull in documents written by other workers since the last sync"""
+        async with self._lock:
+            version = await collection_version(self.scope)
+            if version == self.version:
+                return
+            started = datetime.utcnow()
+            async for doc in self.collection.find({"updated_at": {"$gte": self.synced_at - SEARCH_SYNC_OVERLAP}}, self.projection):
+                self.add(doc)
+            if len(self._terms) > 2 * len(self._postings):
+                self._terms = sorted(self._postings)
+            self.version, self.synced_at = version, started
+            self.syncs += 1
+
+    def rank(
+        self, query: str, filters: Dict[str, Any], lat: Optional[float], lng: Optional[float], radius_km: Optional[float]
+    ) -> List[Tuple[float, str, Optional[float]]]:
+        """(score, id, distance_km) of every matching document, unordered"""
+        tokens = search_tokens(query)
+        if not tokens or not self._docs:
+            return []
+        weights = {token: 1.0 for token in tokens}
+        for term in self._prefix_terms(tokens[-1]):
+            weights.setdefault(term, SEARCH_PREFIX_WEIGHT)
+        
+        count = len(self._docs)
+        average_length = self._total_length / count or 1.0
+        scores: Dict[str, float] = defaultdict(float)
+        for term, weight in weights.items():
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings.items():
+                length = self._docs[doc_id][2]
+                scores[doc_id] += weight * idf * frequency * (self.K1 + 1) / (
+                    frequency + self.K1 * (1 - self.B + self.B * length / average_length)
+                )
+        
+        filters = {field: value for field, value in filters.items() if value}
+        located = lat is not None and lng is not None
+        matches = []
+        for doc_id, score in scores.items():
+            attrs = self._docs[doc_id][0]
+            if any(attrs.get(field) != value for field, value in filters.items()):
+                continue
+            distance = None
+            if located:
+                location = attrs.get("location") or {}
+                if "lat" not in location or "lng" not in location:
+                    continue
+                distance = haversine_km(lat, lng, location["lat"], location["lng"])
+                if radius_km is not None and distance > radius_km:
+                    continue
+            matches.append((score, doc_id, distance))
+        
+        best = max((score for score, _, _ in matches), default=0.0) or 1.0
+        ranked = []
+        for score, doc_id, distance in matches:
+            relevance = score / best
+            if located:
+                relevance = (1 - SEARCH_DISTANCE_WEIGHT) * relevance + SEARCH_DISTANCE_WEIGHT / (1 + distance / SEARCH_DISTANCE_SCALE_KM)
+            ranked.append((relevance, doc_id, distance))
+        return ranked
+
+    async def search(
+        self, query: str, filters: Dict[str, Any], lat: Optional[float], lng: Optional[float], radius_km: Optional[float],
+        limit: int, cursor: Optional[str] = None, projection: Optional[dict] = None, facets: Tuple[str, ...] = ()
+    ) -> Tuple[List[dict], Optional[str], Optional[Dict[str, Dict[str, int]]]]:
+        """One page of matching documents, best first, with distance_km set when located, and facet counts over all matches"""
+        await self.ensure()
+        ranked = self.rank(query, filters, lat, lng, radius_km)
+        counts = self.facet_counts(ranked, facets) if facets else None
+        if cursor:
+            values = decode_cursor(cursor)
+            if len(values) != 2:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            last_score, last_id = values
+            ranked = [match for match in ranked if (-match[0], match[1]) > (-last_score, last_id)]
+        top = heapq.nsmallest(limit + 1, ranked, key=lambda match: (-match[0], match[1]))
+        next_cursor = None
+        if len(top) > limit:
+            top = top[:limit]
+            next_cursor = encode_cursor([top[-1][0], top[-1][1]])
+        
+        ids = [doc_id for _, doc_id, _ in top]
+        docs = {doc["id"]: doc async for doc in self.collection.find({"id": {"$in": ids}, "is_active": True}, projection)}
+        page = []
+        for _, doc_id, distance in top:
+            doc = docs.get(doc_id)
+            if doc is not None:
+                if distance is not None:
+                    doc["distance_km"] = distance
+                page.append(doc)
+        return page, next_cursor, counts
+
+    def facet_counts(self, ranked: List[Tuple[float, str, Optional[float]]], facets: Tuple[str, ...]) -> Dict[str, Dict[str, int]]:
+        """Same shape as facet_buckets, counted from the indexed filter attributes of every match"""
+        groups: Dict[str, Dict[Any, int]] = {field: defaultdict(int) for field in facets}
+        for _, doc_id, _ in ranked:
+            attrs = self._docs[doc_id][0]
+            for field in facets:
+                groups[field][attrs.get(field)] += 1
+        return facet_buckets(facets, {
+            field: [{"_id": value, "count": count} for value, count in values.items()] for field, values in groups.items()
+        })
+
+    async def _sync_forever(self):
+        while True:
+            try:
+                await self.ensure()
+            except Exception as e:
+                logger.warning("%s search index load failed: %s", self.scope, e)
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                if self._loaded:
+                    await self.sync()
+            except Exception as e:
+                logger.warning("%s search index sync failed: %s", self.scope, e)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._sync_forever())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"documents": len(self._docs), "terms": len(self._postings), "version": self.version, "syncs": self.syncs}
+
+resource_search = TextIndex(
+    db.resources, "resources", {"title": 3, "description": 1, "category": 1, "address": 1}, ("category", "type"), SEARCH_REFRESH_SECONDS
+)
+water_source_search = TextIndex(
+    db.water_sources, "water_sources", {"name": 3, "type": 1, "address": 1}, ("type", "accessibility", "quality_status"), SEARCH_REFRESH_SECONDS
+)
+
+# Live event stream
+# Clients keep one /api/stream connection (SSE, or a WebSocket to move the area
+# without reconnecting) for a circle and optional topics/categories, and get new
+# resources, new water sources, new water alerts and water source quality
+# changes inside it instead of re-polling the list endpoints. Writes publish
+# events on `stream_bus`, which hands every event to each worker's StreamHub;
+# the hub indexes subscriptions by the coverage cells of their centre, so an
+# event only looks at subscriptions within reach. Delivery is best effort: a
+# client that falls behind gets a "lagged" event and should refetch.
+STREAM_TOPICS = ("resources", "water_sources", "water_alerts")
+
+class Subscription:
+    def __init__(self, lat: float, lng: float, radius_km: float, topics: Tuple[str, ...], categories: Optional[Tuple[str, ...]], queue_size: int):
+        self.id = str(uuid.uuid4())
+        self.lat, self.lng, self.radius_km = lat, lng, radius_km
+        self.topics = topics
+        self.categories = categories
+        self.cells: List[str] = []
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.lagged = False
+
+    def matches(self, event: dict) -> bool:
+        if event["topic"] not in self.topics:
+            return False
+        # Categories only narrow resources; alerts and water sources have none
+        if self.categories and event.get("category") is not None and event["category"] not in self.categories:
+            return False
+        location = event["location"]
+        return haversine_km(self.lat, self.lng, location["lat"], location["lng"]) <= self.radius_km + event.get("radius_km", 0.0)
+
+    async def next_event(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """The next event for this subscriber, or None after `timeout` seconds without one"""
+        if self.lagged:
+            self.lagged = False
+            return {"topic": None, "type": "lagged"}
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+class StreamHub:
+    """This worker's stream subscriptions, indexed for matching located events"""
+
+    def __init__(self, max_radius_km: float, queue_size: int):
+        self.max_radius_km = max_radius_km
+        self.queue_size = queue_size
+        self._subscriptions: Dict[str, Subscription] = {}
+        self._cells: Dict[str, set] = defaultdict(set)  # coverage cell -> subscription ids
+        self.events = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def subscribe(self, lat: float, lng: float, radius_km: float, topics: Tuple[str, ...] = STREAM_TOPICS, categories: Optional[Tuple[str, ...]] = None) -> Subscription:
+        subscription = Subscription(lat, lng, radius_km, topics, categories, self.queue_size)
+        self._subscriptions[subscription.id] = subscription
+        self.update(subscription, lat, lng, radius_km, topics, categories)
+        return subscription
+
+    def update(self, subscription: Subscription, lat: float, lng: float, radius_km: float, topics: Tuple[str, ...] = STREAM_TOPICS, categories: Optional[Tuple[str, ...]] = None):
+        """Move a subscription to a new area or filter, keeping its queue"""
+        self._unindex(subscription)
+        subscription.lat, subscription.lng = lat, lng
+        subscription.radius_km = min(radius_km, self.max_radius_km)
+        subscription.topics, subscription.categories = topics, categories
+        subscription.cells = point_coverage_cells(lat, lng)
+        for cell in subscription.cells:
+            self._cells[cell].add(subscription.id)
+
+    def unsubscribe(self, subscription: Subscription):
+        self._unindex(subscription)
+        self._subscriptions.pop(subscription.id, None)
+
+    def _unindex(self, subscription: Subscription):
+        for cell in subscription.cells:
+            ids = self._cells.get(cell)
+            if ids is not None:
+                ids.discard(subscription.id)
+                if not ids:
+                    del self._cells[cell]
+        subscription.cells = []
+
+    def candidates(self, location: Dict[str, float], radius_km: float = 0.0) -> set:
+        """Ids of subscriptions whose centre may lie within `radius_km` plus the largest subscription radius"""
+        ids = set()
+        for cell in circle_coverage_cells(location, radius_km + self.max_radius_km):
+            ids |= self._cells.get(cell, set())
+        return ids
+
+    def dispatch(self, event: dict):
+        """Queue an event for every matching subscription; never blocks"""
+        self.events += 1
+        for subscription_id in self.candidates(event["location"], event.get("radius_km", 0.0)):
+            subscription = self._subscriptions[subscription_id]
+            if not subscription.matches(event):
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                subscription.lagged = True
+                self.dropped += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"subscriptions": len(self._subscriptions), "cells": len(self._cells), "events": self.events, "delivered": self.delivered, "dropped": self.dropped}
+
+class LocalEventBus:
+    """In-process pub/sub: events reach the handlers of this worker only"""
+
+    def __init__(self):
+        self._handlers = []
+        self.published = 0
+        self.received = 0
+
+    def subscribe(self, handler):
+        self._handlers.append(handler)
+
+    async def publish(self, events: List[dict]):
+        self.published += len(events)
+        for event in events:
+            self._deliver(event)
+
+    def _deliver(self, event: dict):
+        self.received += 1
+        for handler in self._handlers:
+            try:
+                handler(event)
+            except Exception:
+                logger.exception("Stream event handler failed")
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "local", "published": self.published, "received": self.received}
+
+class MongoEventBus(LocalEventBus):
+    """Pub/sub over a capped collection, tailed by every worker, so events reach all workers"""
+
+    def __init__(self, collection, size_bytes: int):
+        super().__init__()
+        self.collection = collection
+        self.size_bytes = size_bytes
+        self._task: Optional[asyncio.Task] = None
+
+    async def publish(self, events: List[dict]):
+        await self.collection.insert_many([dict(event) for event in events])
+        self.published += len(events)
+
+    async def _ensure_collection(self):
+        try:
+            await self.collection.database.create_collection(self.collection.name, capped=True, size=self.size_bytes)
+        except CollectionInvalid:
+            pass
+
+    async def _tail_forever(self):
+        last_id = None
+        while True:
+            try:
+                if last_id is None:
+                    await self._ensure_collection()
+                    # Start at the end: earlier events were for earlier connections
+                    newest = await self.collection.find({}, {"_id": 1}).sort("$natural", -1).to_list(1)
+                    last_id = newest[0]["_id"] if newest else ObjectId("0" * 24)
+                cursor = self.collection.find({"_id": {"$gt": last_id}}, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for event in cursor:
+                        last_id = event.pop("_id")
+                        self._deliver(event)
+                    await asyncio.sleep(0.1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Stream bus tail failed: %s", e)
+            await asyncio.sleep(1)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._tail_forever())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "backend": "mongo"}
+
+stream_hub = StreamHub(STREAM_MAX_RADIUS_KM, STREAM_QUEUE_SIZE)
+stream_bus = MongoEventBus(db.stream_events, STREAM_BUS_SIZE_BYTES) if STREAM_BUS == "mongo" else LocalEventBus()
+stream_bus.subscribe(stream_hub.dispatch)
+
+def stream_event(topic: str, event_type: str, item: BaseModel) -> dict:
+    data = item.dict()
+    return {
+        "topic": topic,
+        "type": event_type,
+        "location": data["location"],
+        "radius_km": data.get("radius_km", 0.0),
+        "category": data.get("category"),
+        "data": data,
+    }
+
+async def publish_events(events: List[dict]):
+    """Publish stream events after a write; a bus failure never fails the write"""
+    if not events:
+        return
+    try:
+        await stream_bus.publish(events)
+    except Exception:
+        logger.exception("Publishing %d stream events failed", len(events))
+
+# Alert fan-out
+# A new water alert is queued for fan-out by severity (critical first). A
+# worker resolves the affected water sources (inside the alert circle, or
+# named in water_source_ids) and the affected users: those whose location is
+# inside the circle, plus the owners of affected sources. It then writes one
+# compact inbox entry per user into `notifications` in batched unordered
+# bulk_writes. Entry ids are derived from (alert, user), so a retried or
+# resumed fan-out never notifies anyone twice. Alerts stay "pending" until
+# fanned out and are picked up again on startup.
+ALERT_SEVERITY_PRIORITY = {"critical": 0, "high": 1, "medium": 2, "low": 3}
+ALERT_NOTIFICATION_MAX_SOURCES = 20
+DUPLICATE_KEY_ERROR = 11000
+
+def notification_id(alert_id: str, user_id: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"globalhaven:notification:{alert_id}:{user_id}"))
+
+class AlertFanout:
+    def __init__(self, database, workers: int, batch_size: int):
+        self.db = database
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._sequence = 0  # keeps equal-priority alerts in arrival order
+        self._tasks: List[asyncio.Task] = []
+        self.alerts = 0
+        self.notifications = 0
+        self.failures = 0
+
+    def enqueue(self, alert: dict):
+        self._sequence += 1
+        self.queue.put_nowait((ALERT_SEVERITY_PRIORITY.get(alert.get("severity"), len(ALERT_SEVERITY_PRIORITY)), self._sequence, alert))
+
+    async def affected_sources(self, alert: dict, within: dict) -> List[dict]:
+        clauses = [{"geo": within}]
+        if alert.get("water_source_ids"):
+            clauses.append({"id": {"$in": alert["water_source_ids"]}})
+        return await self.db.water_sources.find({"$or": clauses, "is_active": True}, {"id": 1, "added_by": 1}).to_list(None)
+
+    async def _write(self, operations: List[InsertOne]) -> int:
+        try:
+            result = await self.db.notifications.bulk_write(operations, ordered=False)
+            return result.inserted_count
+        except BulkWriteError as e:
+            if any(error["code"] != DUPLICATE_KEY_ERROR for error in e.details.get("writeErrors", [])):
+                raise
+            return e.details.get("nInserted", 0)
+
+    async def fan_out(self, alert: dict) -> int:
+        """Write inbox entries for everyone an alert affects; returns how many were new"""
+        location = alert["location"]
+        within = {"$geoWithin": {"$centerSphere": [[location["lng"], location["lat"]], alert["radius_km"] / EARTH_RADIUS_KM]}}
+        sources = await self.affected_sources(alert, within)
+        entry = {
+            "kind": "water_alert",
+            "alert_id": alert["id"],
+            "title": alert["title"],
+            "alert_type": alert["alert_type"],
+            "severity": alert["severity"],
+            "priority": ALERT_SEVERITY_PRIORITY.get(alert["severity"], len(ALERT_SEVERITY_PRIORITY)),
+            "location": location,
+            "radius_km": alert["radius_km"],
+            "water_source_ids": [source["id"] for source in sources[:ALERT_NOTIFICATION_MAX_SOURCES]],
+            "water_source_count": len(sources),
+            "read": False,
+            "created_at": alert["created_at"],
+            "expires_at": alert.get("expires_at"),
+        }
+        
+        def notification(user_id: str, user_location: Optional[Dict[str, float]]) -> InsertOne:
+            distance = haversine_km(location["lat"], location["lng"], user_location["lat"], user_location["lng"]) if user_location else None
+            return InsertOne({**entry, "id": notification_id(alert["id"], user_id), "user_id": user_id, "distance_km": distance})
+        
+        notified, inserted, batch = {alert["issued_by"]}, 0, []
+        async for user in self.db.users.find({"geo": within, "is_active": True}, {"id": 1, "location": 1}):
+            if user["id"] in notified:
+                continue
+            notified.add(user["id"])
+            batch.append(notification(user["id"], user.get("location")))
+            if len(batch) >= self.batch_size:
+                inserted += await self._write(batch)
+                batch = []
+        # Owners of affected sources hear about them wherever they are
+        for owner in {source["added_by"] for source in sources} - notified:
+            notified.add(owner)
+            batch.append(notification(owner, None))
+            if len(batch) >= self.batch_size:
+                inserted += await self._write(batch)
+                batch = []
+        if batch:
+            inserted += await self._write(batch)
+        
+        await self.db.water_alerts.update_one({"id": alert["id"]}, {"$set": {"fanout": "done"}})
+        self.alerts += 1
+        self.notifications += inserted
+        return inserted
+
+    async def _work(self):
+        while True:
+            _, _, alert = await self.queue.get()
+            try:
+                await self.fan_out(alert)
+            except Exception as e:
+                # Left pending; the next startup retries it
+                self.failures += 1
+                logger.warning("Fan-out of alert %s failed: %s", alert.get("id"), e)
+            finally:
+                self.queue.task_done()
+
+    async def _resume(self):
+        try:
+            async for alert in self.db.water_alerts.find({"fanout": "pending", "active": True}, {"_id": 0, "coverage_cells": 0}):
+                self.enqueue(alert)
+        except Exception as e:
+            logger.warning("Resuming alert fan-out failed: %s", e)
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._resume())]
+            self._tasks += [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def stats(self) -> Dict[str, Any]:
+        return {"queued": self.queue.qsize(), "alerts": self.alerts, "notifications": self.notifications, "failures": self.failures}
+
+alert_fanout = AlertFanout(db, ALERT_FANOUT_WORKERS, ALERT_FANOUT_BATCH_SIZE)
+
+# Required indexes, declared per collection. Every query path in this module
+# should be served by one of these; bootstrap_indexes() creates what is
+# missing and reports drift.
+ACTIVE_ALERTS = {"active": True}
+REQUIRED_INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("username", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)], unique=True),
+        IndexModel([("geo", GEOSPHERE)]),
+    ],
+    "resources": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("is_active", ASCENDING), ("category", ASCENDING), ("type", ASCENDING)]),
+        IndexModel([("is_active", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("user_id", ASCENDING)]),
+        IndexModel([("geo", GEOSPHERE)]),
+        IndexModel([("updated_at", ASCENDING)]),
+    ],
+    "water_sources": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("is_active", ASCENDING), ("type", ASCENDING), ("accessibility", ASCENDING)]),
+        IndexModel([("is_active", ASCENDING), ("quality_status", ASCENDING)]),
+        IndexModel([("is_active", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("geo", GEOSPHERE)]),
+        IndexModel([("updated_at", ASCENDING)]),
+    ],
+    "quality_reports": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("water_source_id", ASCENDING), ("test_date", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("test_date", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "infrastructure_plans": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("is_active", ASCENDING), ("plan_type", ASCENDING), ("funding_status", ASCENDING)]),
+        IndexModel([("is_active", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("geo", GEOSPHERE)]),
+    ],
+    "purification_guides": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("is_active", ASCENDING), ("community_rating", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("is_active", ASCENDING), ("method_type", ASCENDING)]),
+    ],
+    "water_alerts": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("coverage_cells", ASCENDING), ("created_at", DESCENDING)], partialFilterExpression=ACTIVE_ALERTS),
+        IndexModel([("alert_type", ASCENDING), ("severity", ASCENDING), ("created_at", DESCENDING)], partialFilterExpression=ACTIVE_ALERTS),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("fanout", ASCENDING)], partialFilterExpression={"fanout": "pending"}),
+    ],
+    "notifications": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("read", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "water_usage": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("date", DESCENDING)], unique=True),
+    ],
+    "geocode_cache": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "messages": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("sender_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("receiver_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("thread_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "message_threads": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("participants", ASCENDING), ("updated_at", DESCENDING), ("id", DESCENDING)]),
+    ],
+}
+INDEX_OPTIONS = ["unique", "partialFilterExpression", "sparse", "expireAfterSeconds"]
+
+async def diff_indexes() -> Dict[str, Dict[str, List[str]]]:
+    """Compare REQUIRED_INDEXES with the database: missing, mismatched and extra index names per collection"""
+    report = {}
+    for collection_name, models in REQUIRED_INDEXES.items():
+        existing = await db[collection_name].index_information()
+        required = {model.document["name"]: model.document for model in models}
+        missing, mismatched = [], []
+        for name, spec in required.items():
+            current = existing.get(name)
+            if current is None:
+                missing.append(name)
+            elif list(current["key"]) != list(spec["key"].items()) or any(
+                current.get(option) != spec.get(option) for option in INDEX_OPTIONS
+            ):
+                mismatched.append(name)
+        extra = sorted(set(existing) - set(required) - {"_id_"})
+        report[collection_name] = {"missing": missing, "mismatched": mismatched, "extra": extra}
+    return report
+
+def log_index_report(report: Dict[str, Dict[str, List[str]]]):
+    for collection_name, diff in report.items():
+        if not any(diff.values()):
+            logger.info("indexes %s: ok", collection_name)
+            continue
+        for kind, names in diff.items():
+            if names:
+                logger.warning("indexes %s: %s %s", collection_name, kind, ", ".join(names))
+
+async def bootstrap_indexes(mode: str = "apply") -> Dict[str, Dict[str, List[str]]]:
+    """Log the index diff; in apply mode create missing indexes, in check mode fail if any are missing"""
+    report = await diff_indexes()
+    log_index_report(report)
+    missing = {name: diff["missing"] for name, diff in report.items() if diff["missing"]}
+    
+    if mode == "check" and missing:
+        raise RuntimeError(f"Missing required indexes: {missing}")
+    if mode == "apply":
+        for collection_name, names in missing.items():
+            models = [model for model in REQUIRED_INDEXES[collection_name] if model.document["name"] in names]
+            try:
+                created = await db[collection_name].create_indexes(models)
+                logger.info("indexes %s: created %s", collection_name, ", ".join(created))
+            except OperationFailure as e:
+                # e.g. duplicates blocking a unique index; keep serving and surface it in the log
+                logger.error("indexes %s: could not create %s: %s", collection_name, ", ".join(names), e)
+    return report
+
 # Authentication routes
-@api_router.post("/auth/register", response_model=User)
+@api_router.post("/auth/register", response_model=Principal)
 async def register(user_data: UserCreate):
     # Check if user exists
     existing_user = await db.users.find_one({"$or": [{"username": user_data.username}, {"email": user_data.email}]})
@@ -362,7 +2283,7 @@ async def register(user_data: UserCreate):
         raise HTTPException(status_code=400, detail="Username or email already registered")
     
     # Hash password
-    password_hash = get_password_hash(user_data.password)
+    password_hash = await get_password_hash(user_data.password)
     
     # Create user
     user_dict = user_data.dict()
@@ -370,14 +2291,26 @@ async def register(user_data: UserCreate):
     user_dict["password_hash"] = password_hash
     user = User(**user_dict)
     
-    await db.users.insert_one(user.dict())
+    document = user.dict()
+    if user.location:
+        document["geo"] = geo_point(user.location)  # alert fan-out finds users by location
+    await db.users.insert_one(document)
+    invalidate_principal(user.username)
     return user
 
 @api_router.post("/auth/login", response_model=Token)
 async def login(user_data: UserLogin):
     user = await db.users.find_one({"username": user_data.username})
-    if not user or not verify_password(user_data.password, user["password_hash"]):
+    if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
+    valid, new_hash = await verify_password(user_data.password, user["password_hash"])
+    if not valid:
+        raise HTTPException(status_code=400, detail="Incorrect username or password")
+    
+    # Transparently upgrade hashes made with a different bcrypt cost
+    if new_hash:
+        await db.users.update_one({"id": user["id"]}, {"$set": {"password_hash": new_hash}})
+        password_hasher.rehashed += 1
     
     access_token_expires = timedelta(minutes=30)
     access_token = create_access_token(
@@ -387,12 +2320,16 @@ async def login(user_data: UserLogin):
 
 # Resource routes
 @api_router.post("/resources", response_model=Resource)
-async def create_resource(resource_data: ResourceCreate, current_user: User = Depends(get_current_user)):
+async def create_resource(resource_data: ResourceCreate, current_user: Principal = Depends(get_current_user)):
     resource_dict = resource_data.dict()
     resource_dict["user_id"] = current_user.id
     resource = Resource(**resource_dict)
     
-    await db.resources.insert_one(resource.dict())
+    document = geo_document(resource)
+    await db.resources.insert_one(document)
+    resource_search.add(document)
+    await bump_versions("resources")
+    await publish_events([stream_event("resources", "created", resource)])
     return resource
 
 @api_router.get("/resources", response_model=List[Resource])
@@ -402,8 +2339,26 @@ async def get_resources(
     lat: Optional[float] = None,
     lng: Optional[float] = None,
     radius: Optional[float] = 10.0,  # km
-    current_user: User = Depends(get_current_user)
+    q: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    facets: Optional[str] = None,
+    request: Request = None,
+    response: Response = None,
+    current_user: Principal = Depends(get_current_user)
 ):
+    fields = parse_fields(Resource, fields)
+    facets = parse_facets("resources", facets)
+    if q:
+        # Ranked results reflect the search index, so the tag also carries the
+        # version it last synced to; local writes change the index without a
+        # sync but always bump the collection version
+        await resource_search.ensure()
+    cached = await not_modified(request, response, "resources", *((resource_search.version,) if q else ()))
+    if cached:
+        return cached
+    
     filter_query = {"is_active": True}
     
     if category:
@@ -411,73 +2366,208 @@ async def get_resources(
     if type:
         filter_query["type"] = type
     
-    resources = await db.resources.find(filter_query).to_list(1000)
+    # Text search if q is given, ranked by relevance blended with proximity;
+    # otherwise filter by location if provided, nearest first; otherwise newest first
+    if q:
+        resources, next_cursor, counts = await resource_search.search(
+            q, {"category": category, "type": type}, lat, lng, radius, limit, cursor, response_projection(Resource, fields), facets
+        )
+    else:
+        near = (lat, lng, radius) if lat is not None and lng is not None else None
+        resources, next_cursor, counts = await list_page(db.resources, filter_query, near, limit, cursor, response_projection(Resource, fields), facets)
     
-    # Filter by location if provided
-    if lat is not None and lng is not None:
-        filtered_resources = []
-        for resource in resources:
-            res_lat = resource["location"]["lat"]
-            res_lng = resource["location"]["lng"]
-            
-            # Simple distance calculation (Haversine formula would be more accurate)
-            distance = ((lat - res_lat) ** 2 + (lng - res_lng) ** 2) ** 0.5 * 111  # Approximate km
-            if distance <= radius:
-                filtered_resources.append(resource)
-        resources = filtered_resources
-    
-    return [Resource(**resource) for resource in resources]
+    return list_response(Resource, resources, next_cursor, response, fields, counts)
 
 @api_router.get("/resources/{resource_id}", response_model=Resource)
-async def get_resource(resource_id: str, current_user: User = Depends(get_current_user)):
+async def get_resource(resource_id: str, current_user: Principal = Depends(get_current_user)):
     resource = await db.resources.find_one({"id": resource_id, "is_active": True})
     if not resource:
         raise HTTPException(status_code=404, detail="Resource not found")
     return Resource(**resource)
 
 @api_router.put("/resources/{resource_id}", response_model=Resource)
-async def update_resource(resource_id: str, resource_data: ResourceCreate, current_user: User = Depends(get_current_user)):
+async def update_resource(resource_id: str, resource_data: ResourceCreate, current_user: Principal = Depends(get_current_user)):
     resource = await db.resources.find_one({"id": resource_id, "user_id": current_user.id})
     if not resource:
         raise HTTPException(status_code=404, detail="Resource not found or not owned by user")
     
     update_data = resource_data.dict()
+    update_data["geo"] = geo_point(resource_data.location)
     update_data["updated_at"] = datetime.utcnow()
     
     await db.resources.update_one({"id": resource_id}, {"$set": update_data})
+    await bump_versions("resources")
     updated_resource = await db.resources.find_one({"id": resource_id})
+    resource_search.add(updated_resource)
     return Resource(**updated_resource)
 
 @api_router.delete("/resources/{resource_id}")
-async def delete_resource(resource_id: str, current_user: User = Depends(get_current_user)):
+async def delete_resource(resource_id: str, current_user: Principal = Depends(get_current_user)):
     resource = await db.resources.find_one({"id": resource_id, "user_id": current_user.id})
     if not resource:
         raise HTTPException(status_code=404, detail="Resource not found or not owned by user")
     
-    await db.resources.update_one({"id": resource_id}, {"$set": {"is_active": False}})
+    await db.resources.update_one({"id": resource_id}, {"$set": {"is_active": False, "updated_at": datetime.utcnow()}})
+    resource_search.remove(resource_id)
+    await bump_versions("resources")
     return {"message": "Resource deleted successfully"}
 
 # Messaging routes
+# Messages between two users (per resource, when one is given) form a thread.
+# Each thread has a summary document in `message_threads` with the last
+# message and an unread count per participant, updated on every send and read,
+# so the inbox is one indexed query on `participants` however long the
+# history is.
+def message_thread_id(sender_id: str, receiver_id: str, resource_id: Optional[str]) -> str:
+    """Deterministic thread id for a pair of users and an optional resource"""
+    first, second = sorted([sender_id, receiver_id])
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"globalhaven:thread:{first}:{second}:{resource_id or ''}"))
+
+async def record_thread_message(message: Message):
+    """Upsert the message's thread summary: last message, updated_at and the receiver's unread count"""
+    await db.message_threads.update_one(
+        {"id": message.thread_id},
+        {
+            "$setOnInsert": {
+                "id": message.thread_id,
+                "participants": sorted({message.sender_id, message.receiver_id}),
+                "resource_id": message.resource_id,
+                "created_at": message.created_at,
+            },
+            "$set": {"last_message": message.dict(), "updated_at": message.created_at},
+            "$inc": {f"unread.{message.receiver_id}": 1},
+        },
+        upsert=True
+    )
+
+async def rebuild_message_thread(thread_id: str):
+    """Recompute a thread summary from its messages"""
+    last = await db.messages.find_one({"thread_id": thread_id}, {"_id": 0}, sort=[("created_at", -1), ("id", -1)])
+    if last is None:
+        return
+    unread = {
+        row["_id"]: row["count"]
+        async for row in db.messages.aggregate([
+            {"$match": {"thread_id": thread_id, "is_read": False}},
+            {"$group": {"_id": "$receiver_id", "count": {"$sum": 1}}}
+        ])
+    }
+    first = await db.messages.find_one({"thread_id": thread_id}, {"created_at": 1}, sort=[("created_at", 1), ("id", 1)])
+    await db.message_threads.replace_one(
+        {"id": thread_id},
+        {
+            "id": thread_id,
+            "participants": sorted({last["sender_id"], last["receiver_id"]}),
+            "resource_id": last.get("resource_id"),
+            "last_message": Message(**last).dict(),
+            "unread": unread,
+            "created_at": first["created_at"],
+            "updated_at": last["created_at"],
+        },
+        upsert=True
+    )
+
+async def backfill_message_threads():
+    """Assign threads to messages sent before threads existed and rebuild those threads"""
+    operations, thread_ids = [], set()
+    async for message in db.messages.find({"thread_id": {"$exists": False}}, {"id": 1, "sender_id": 1, "receiver_id": 1, "resource_id": 1}):
+        thread_id = message_thread_id(message["sender_id"], message["receiver_id"], message.get("resource_id"))
+        operations.append(UpdateOne({"id": message["id"]}, {"$set": {"thread_id": thread_id}}))
+        thread_ids.add(thread_id)
+        if len(operations) >= 1000:
+            await db.messages.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        await db.messages.bulk_write(operations, ordered=False)
+    for thread_id in thread_ids:
+        await rebuild_message_thread(thread_id)
+    if thread_ids:
+        logger.info("backfilled %d message threads", len(thread_ids))
+
+async def decrement_thread_unread(thread_id: str, user_id: str, count: int):
+    """Take count off a participant's unread count, never below zero (e.g. after a rebuild raced a read)"""
+    field = f"unread.{user_id}"
+    await db.message_threads.update_one(
+        {"id": thread_id},
+        [{"$set": {field: {"$max": [0, {"$subtract": [{"$ifNull": [f"${field}", 0]}, count]}]}}}]
+    )
+
+async def participant_thread(thread_id: str, user_id: str) -> dict:
+    thread = await db.message_threads.find_one({"id": thread_id, "participants": user_id}, {"_id": 0})
+    if not thread:
+        raise HTTPException(status_code=404, detail="Thread not found")
+    return thread
+
 @api_router.post("/messages", response_model=Message)
-async def send_message(message_data: MessageCreate, current_user: User = Depends(get_current_user)):
+async def send_message(message_data: MessageCreate, current_user: Principal = Depends(get_current_user)):
     message_dict = message_data.dict()
     message_dict["sender_id"] = current_user.id
+    message_dict["thread_id"] = message_thread_id(current_user.id, message_data.receiver_id, message_data.resource_id)
     message = Message(**message_dict)
     
     await db.messages.insert_one(message.dict())
+    await record_thread_message(message)
     return message
 
+@api_router.get("/messages/threads", response_model=List[MessageThread])
+async def get_message_threads(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    response: Response = None,
+    current_user: Principal = Depends(get_current_user)
+):
+    """The current user's threads, most recently active first"""
+    threads, next_cursor = await paginate(
+        db.message_threads, {"participants": current_user.id}, "updated_at", -1, limit, cursor, response_projection(MessageThread)
+    )
+    return list_response(MessageThread, threads, next_cursor, response)
+
+@api_router.get("/messages/threads/{thread_id}", response_model=List[Message])
+async def get_thread_messages(
+    thread_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    response: Response = None,
+    current_user: Principal = Depends(get_current_user)
+):
+    """Messages of one thread, newest first"""
+    await participant_thread(thread_id, current_user.id)
+    messages, next_cursor = await paginate(db.messages, {"thread_id": thread_id}, "created_at", -1, limit, cursor, response_projection(Message))
+    return list_response(Message, messages, next_cursor, response)
+
+@api_router.put("/messages/threads/{thread_id}/read")
+async def mark_thread_read(thread_id: str, current_user: Principal = Depends(get_current_user)):
+    await participant_thread(thread_id, current_user.id)
+    result = await db.messages.update_many(
+        {"thread_id": thread_id, "receiver_id": current_user.id, "is_read": False},
+        {"$set": {"is_read": True}}
+    )
+    # Subtract what was marked rather than zeroing, so messages that arrive meanwhile stay counted
+    if result.modified_count:
+        await decrement_thread_unread(thread_id, current_user.id, result.modified_count)
+    return {"message": "Thread marked as read", "marked": result.modified_count}
+
 @api_router.get("/messages", response_model=List[Message])
-async def get_messages(current_user: User = Depends(get_current_user)):
-    messages = await db.messages.find({"$or": [{"sender_id": current_user.id}, {"receiver_id": current_user.id}]}).to_list(1000)
-    return [Message(**message) for message in messages]
+async def get_messages(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    response: Response = None,
+    current_user: Principal = Depends(get_current_user)
+):
+    filter_query = {"$or": [{"sender_id": current_user.id}, {"receiver_id": current_user.id}]}
+    messages, next_cursor = await paginate(db.messages, filter_query, "created_at", -1, limit, cursor, response_projection(Message))
+    
+    return list_response(Message, messages, next_cursor, response)
 
 @api_router.put("/messages/{message_id}/read")
-async def mark_message_read(message_id: str, current_user: User = Depends(get_current_user)):
-    await db.messages.update_one(
-        {"id": message_id, "receiver_id": current_user.id},
-        {"$set": {"is_read": True}}
+async def mark_message_read(message_id: str, current_user: Principal = Depends(get_current_user)):
+    message = await db.messages.find_one_and_update(
+        {"id": message_id, "receiver_id": current_user.id, "is_read": False},
+        {"$set": {"is_read": True}},
+        {"thread_id": 1}
     )
+    if message and message.get("thread_id"):
+        await decrement_thread_unread(message["thread_id"], current_user.id, 1)
     return {"message": "Message marked as read"}
 
 # MCP Server endpoints
@@ -488,6 +2578,8 @@ async def mcp_search_resources(
 ):
     """Search resources via MCP"""
     data = request.data or {}
+    fields = parse_fields(Resource, data.get("fields"))
+    facets = parse_facets("resources", data.get("facets"))
     
     filter_query = {"is_active": True}
     if data.get("category"):
@@ -495,23 +2587,21 @@ async def mcp_search_resources(
     if data.get("type"):
         filter_query["type"] = data["type"]
     
-    resources = await db.resources.find(filter_query).to_list(100)
+    limit = page_limit(data.get("limit"))
     
-    # Location filtering if provided
-    if data.get("lat") and data.get("lng"):
-        lat, lng = data["lat"], data["lng"]
-        radius = data.get("radius", 10.0)
-        
-        filtered_resources = []
-        for resource in resources:
-            res_lat = resource["location"]["lat"]
-            res_lng = resource["location"]["lng"]
-            distance = ((lat - res_lat) ** 2 + (lng - res_lng) ** 2) ** 0.5 * 111
-            if distance <= radius:
-                filtered_resources.append(resource)
-        resources = filtered_resources
+    # Text search if q is given, best match first; otherwise location
+    # filtering if provided, nearest first; otherwise newest first
+    if data.get("q"):
+        lat, lng = (data["lat"], data["lng"]) if data.get("lat") and data.get("lng") else (None, None)
+        filters = {"category": data.get("category"), "type": data.get("type")}
+        resources, next_cursor, counts = await resource_search.search(
+            data["q"], filters, lat, lng, data.get("radius", 10.0), limit, data.get("cursor"), response_projection(Resource, fields), facets
+        )
+    else:
+        near = (data["lat"], data["lng"], data.get("radius", 10.0)) if data.get("lat") and data.get("lng") else None
+        resources, next_cursor, counts = await list_page(db.resources, filter_query, near, limit, data.get("cursor"), response_projection(Resource, fields), facets)
     
-    return {"resources": [Resource(**resource).dict() for resource in resources]}
+    return mcp_page("resources", Resource, resources, next_cursor, fields, counts)
 
 @api_router.post("/mcp/search_water_sources")
 async def mcp_search_water_sources(
@@ -520,6 +2610,8 @@ async def mcp_search_water_sources(
 ):
     """Search water sources via MCP"""
     data = request.data or {}
+    fields = parse_fields(WaterSource, data.get("fields"))
+    facets = parse_facets("water_sources", data.get("facets"))
     
     filter_query = {"is_active": True}
     if data.get("type"):
@@ -529,23 +2621,21 @@ async def mcp_search_water_sources(
     if data.get("quality_status"):
         filter_query["quality_status"] = data["quality_status"]
     
-    sources = await db.water_sources.find(filter_query).to_list(100)
+    limit = page_limit(data.get("limit"))
     
-    # Location filtering if provided
-    if data.get("lat") and data.get("lng"):
-        lat, lng = data["lat"], data["lng"]
-        radius = data.get("radius", 10.0)
-        
-        filtered_sources = []
-        for source in sources:
-            source_lat = source["location"]["lat"]
-            source_lng = source["location"]["lng"]
-            distance = ((lat - source_lat) ** 2 + (lng - source_lng) ** 2) ** 0.5 * 111
-            if distance <= radius:
-                filtered_sources.append(source)
-        sources = filtered_sources
+    # Text search if q is given, best match first; otherwise location
+    # filtering if provided, nearest first; otherwise newest first
+    if data.get("q"):
+        lat, lng = (data["lat"], data["lng"]) if data.get("lat") and data.get("lng") else (None, None)
+        filters = {field: data.get(field) for field in ("type", "accessibility", "quality_status")}
+        sources, next_cursor, counts = await water_source_search.search(
+            data["q"], filters, lat, lng, data.get("radius", 10.0), limit, data.get("cursor"), response_projection(WaterSource, fields), facets
+        )
+    else:
+        near = (data["lat"], data["lng"], data.get("radius", 10.0)) if data.get("lat") and data.get("lng") else None
+        sources, next_cursor, counts = await list_page(db.water_sources, filter_query, near, limit, data.get("cursor"), response_projection(WaterSource, fields), facets)
     
-    return {"water_sources": [WaterSource(**source).dict() for source in sources]}
+    return mcp_page("water_sources", WaterSource, sources, next_cursor, fields, counts)
 
 @api_router.post("/mcp/get_water_alerts")
 async def mcp_get_water_alerts(
@@ -554,6 +2644,7 @@ async def mcp_get_water_alerts(
 ):
     """Get water alerts via MCP"""
     data = request.data or {}
+    fields = parse_fields(WaterAlert, data.get("fields"))
     
     filter_query = {"active": True}
     if data.get("alert_type"):
@@ -567,22 +2658,11 @@ async def mcp_get_water_alerts(
         {"expires_at": None}
     ]
     
-    alerts = await db.water_alerts.find(filter_query).sort("created_at", -1).to_list(50)
-    
-    # Location filtering if provided
-    if data.get("lat") and data.get("lng"):
-        lat, lng = data["lat"], data["lng"]
-        
-        filtered_alerts = []
-        for alert in alerts:
-            alert_lat = alert["location"]["lat"]
-            alert_lng = alert["location"]["lng"]
-            distance = ((lat - alert_lat) ** 2 + (lng - alert_lng) ** 2) ** 0.5 * 111
-            if distance <= alert["radius_km"]:
-                filtered_alerts.append(alert)
-        alerts = filtered_alerts
+    # Location filtering if provided: only alerts whose circle contains the point
+    lat, lng = (data["lat"], data["lng"]) if data.get("lat") and data.get("lng") else (None, None)
+    alerts, next_cursor = await alerts_page(filter_query, lat, lng, page_limit(data.get("limit"), 50), data.get("cursor"), response_projection(WaterAlert, fields))
     
-    return {"water_alerts": [WaterAlert(**alert).dict() for alert in alerts]}
+    return mcp_page("water_alerts", WaterAlert, alerts, next_cursor, fields)
 
 @api_router.post("/mcp/get_purification_guides")
 async def mcp_get_purification_guides(
@@ -591,18 +2671,12 @@ async def mcp_get_purification_guides(
 ):
     """Get purification guides via MCP"""
     data = request.data or {}
+    fields = parse_fields(PurificationGuide, data.get("fields"))
     
-    filter_query = {"is_active": True}
-    if data.get("method_type"):
-        filter_query["method_type"] = data["method_type"]
-    if data.get("effectiveness"):
-        filter_query["effectiveness"] = data["effectiveness"]
-    if data.get("difficulty_level"):
-        filter_query["difficulty_level"] = data["difficulty_level"]
-    
-    guides = await db.purification_guides.find(filter_query).sort("community_rating", -1).to_list(50)
+    filters = {field: data.get(field) for field in GuideCache.INDEXED_FIELDS}
+    guides, next_cursor = await guide_cache.page(filters, page_limit(data.get("limit"), 50), data.get("cursor"))
     
-    return {"purification_guides": [PurificationGuide(**guide).dict() for guide in guides]}
+    return mcp_page("purification_guides", PurificationGuide, guides, next_cursor, fields)
 
 @api_router.post("/mcp/create_water_source")
 async def mcp_create_water_source(
@@ -630,7 +2704,11 @@ async def mcp_create_water_source(
     source_dict["added_by"] = data["user_id"]
     source = WaterSource(**source_dict)
     
-    await db.water_sources.insert_one(source.dict())
+    document = geo_document(source)
+    await db.water_sources.insert_one(document)
+    water_source_search.add(document)
+    await bump_versions("water_sources")
+    await publish_events([stream_event("water_sources", "created", source)])
     return {"water_source": source.dict()}
 
 @api_router.post("/mcp/create_water_alert")
@@ -653,7 +2731,11 @@ async def mcp_create_water_alert(
     alert_dict["issued_by"] = data["user_id"]
     alert = WaterAlert(**alert_dict)
     
-    await db.water_alerts.insert_one(alert.dict())
+    document = alert_document(alert)
+    await db.water_alerts.insert_one(document)
+    alert_fanout.enqueue(document)
+    await bump_versions("water_alerts")
+    await publish_events([stream_event("water_alerts", "created", alert)])
     return {"water_alert": alert.dict()}
 
 @api_router.post("/mcp/log_water_usage")
@@ -672,37 +2754,9 @@ async def mcp_log_water_usage(
         raise HTTPException(status_code=404, detail="User not found")
     
     usage_data = WaterUsageCreate(**{k: v for k, v in data.items() if k != "user_id"})
-    usage_dict = usage_data.dict()
-    usage_dict["user_id"] = data["user_id"]
-    
-    if not usage_dict["date"]:
-        usage_dict["date"] = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    
-    # Calculate total
-    total = (usage_dict["drinking_liters"] + usage_dict["cooking_liters"] + 
-             usage_dict["cleaning_liters"] + usage_dict["agriculture_liters"] + 
-             usage_dict["other_liters"])
-    usage_dict["total_liters"] = total
-    
-    usage = WaterUsage(**usage_dict)
-    
-    # Check if usage already exists for this date, update if so
-    existing = await db.water_usage.find_one({
-        "user_id": data["user_id"],
-        "date": usage_dict["date"]
-    })
-    
-    if existing:
-        await db.water_usage.update_one(
-            {"id": existing["id"]},
-            {"$set": usage_dict}
-        )
-        result_usage = WaterUsage(**{**existing, **usage_dict})
-    else:
-        await db.water_usage.insert_one(usage.dict())
-        result_usage = usage
+    usage = await upsert_water_usage(data["user_id"], usage_data)
     
-    return {"water_usage": result_usage.dict()}
+    return {"water_usage": WaterUsage(**usage).dict()}
 
 @api_router.post("/mcp/create_resource")
 async def mcp_create_resource(
@@ -730,53 +2784,271 @@ async def mcp_create_resource(
     resource_dict["user_id"] = data["user_id"]
     resource = Resource(**resource_dict)
     
-    await db.resources.insert_one(resource.dict())
+    document = geo_document(resource)
+    await db.resources.insert_one(document)
+    resource_search.add(document)
+    await bump_versions("resources")
+    await publish_events([stream_event("resources", "created", resource)])
     return {"resource": resource.dict()}
 
+# Bulk creation over MCP
+# One user check, one concurrent geocoding pass over the distinct addresses and
+# one unordered insert_many per request, with a status per submitted item.
+MAX_MCP_BULK_ITEMS = 1000
+
+def validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in error.errors())
+
+async def geocode_many(addresses: List[str], max_lookups: int = BULK_GEOCODE_MAX_LOOKUPS) -> Tuple[Dict[str, Optional[Dict[str, float]]], set]:
+    """Geocode each distinct (normalized) address once; returns the locations and the deferred addresses.
+    
+    Nominatim requests are serialized at one per NOMINATIM_MIN_INTERVAL_SECONDS, so
+    only max_lookups addresses without a cached answer go upstream. The others
+    still get the offline gazetteer, and are deferred if that finds nothing.
+    """
+    distinct = {}
+    for address in addresses:
+        distinct.setdefault(normalize_address(address), address)
+    uncached = []
+    if "nominatim" in GEOCODER_PROVIDERS:
+        cached = await asyncio.gather(*(geocoder.cached(address) for address in distinct.values()))
+        uncached = [key for key, answer in zip(distinct, cached) if answer is None]
+    lookups = set(uncached[:max_lookups])
+    locations = dict(zip(distinct, await asyncio.gather(*(
+        geocode_address(address, upstream=key in lookups) for key, address in distinct.items()
+    ))))
+    return locations, {key for key in uncached[max_lookups:] if locations[key] is None}
+
+async def mcp_bulk_create(request: MCPRequest, collection, create_model, model, owner_field: str, search_index: TextIndex) -> Dict[str, Any]:
+    data = request.data
+    if not data or not data.get("user_id"):
+        raise HTTPException(status_code=400, detail="user_id required in data")
+    items = data.get("items")
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="items must be a non-empty list")
+    if len(items) > MAX_MCP_BULK_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_MCP_BULK_ITEMS} items per request")
+    
+    # Verify user exists
+    user = await db.users.find_one({"id": data["user_id"]}, {"id": 1})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    results = [{"index": i, "status": "pending"} for i in range(len(items))]
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[i].update({"status": "error", "error": "item must be an object"})
+    items = [item if isinstance(item, dict) else None for item in items]
+    
+    # Geocode addresses of items that have no location
+    locations, deferred = await geocode_many([
+        item["address"] for item in items if item and item.get("address") and not item.get("location")
+    ])
+    
+    documents, doc_indexes, created_items = [], [], []
+    for i, item in enumerate(items):
+        if item is None:
+            continue
+        item = {key: value for key, value in item.items() if key != "user_id"}
+        if item.get("address") and not item.get("location"):
+            key = normalize_address(item["address"])
+            if key in deferred:
+                results[i].update({
+                    "status": "error", "geocode_deferred": True,
+                    "error": f"Address not geocoded: at most {BULK_GEOCODE_MAX_LOOKUPS} new addresses per request, send this item again or with a location"
+                })
+                continue
+            if locations.get(key):
+                item["location"] = locations[key]
+        try:
+            created = model(**create_model(**item).dict(), **{owner_field: data["user_id"]})
+        except ValidationError as e:
+            results[i].update({"status": "error", "error": validation_message(e)})
+            continue
+        results[i]["id"] = created.id
+        documents.append(geo_document(created))
+        doc_indexes.append(i)
+        created_items.append(created)
+    
+    if documents:
+        errors = {}
+        try:
+            await collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            errors = {entry["index"]: entry.get("errmsg", "write failed") for entry in e.details.get("writeErrors", [])}
+        await bump_versions(collection.name)
+        events = []
+        for op_index, i in enumerate(doc_indexes):
+            if op_index in errors:
+                results[i].update({"status": "error", "error": errors[op_index]})
+            else:
+                results[i]["status"] = "inserted"
+                search_index.add(documents[op_index])
+                events.append(stream_event(collection.name, "created", created_items[op_index]))
+        await publish_events(events)
+    
+    summary = {status_name: sum(1 for r in results if r["status"] == status_name) for status_name in ("inserted", "error")}
+    return {"results": results, **summary, "geocode_deferred": sum(1 for r in results if r.get("geocode_deferred"))}
+
+@api_router.post("/mcp/bulk_create_resources")
+async def mcp_bulk_create_resources(
+    request: MCPRequest,
+    api_key_valid: bool = Depends(verify_mcp_api_key)
+):
+    """Create many resources for one user via MCP (data: user_id, items).
+    
+    At most BULK_GEOCODE_MAX_LOOKUPS addresses without a cached answer are
+    geocoded per request; items needing more are returned with geocode_deferred.
+    """
+    return await mcp_bulk_create(request, db.resources, ResourceCreate, Resource, "user_id", resource_search)
+
+@api_router.post("/mcp/bulk_create_water_sources")
+async def mcp_bulk_create_water_sources(
+    request: MCPRequest,
+    api_key_valid: bool = Depends(verify_mcp_api_key)
+):
+    """Create many water sources for one user via MCP (data: user_id, items).
+    
+    At most BULK_GEOCODE_MAX_LOOKUPS addresses without a cached answer are
+    geocoded per request; items needing more are returned with geocode_deferred.
+    """
+    return await mcp_bulk_create(request, db.water_sources, WaterSourceCreate, WaterSource, "added_by", water_source_search)
+
 @api_router.post("/mcp/get_user_stats")
 async def mcp_get_user_stats(
     request: MCPRequest,
     api_key_valid: bool = Depends(verify_mcp_api_key)
 ):
     """Get community statistics via MCP"""
-    total_users = await db.users.count_documents({"is_active": True})
-    total_resources = await db.resources.count_documents({"is_active": True})
-    active_resources = await db.resources.count_documents({"is_active": True, "type": "available"})
-    needed_resources = await db.resources.count_documents({"is_active": True, "type": "needed"})
-    
-    # Water-specific stats
-    total_water_sources = await db.water_sources.count_documents({"is_active": True})
-    safe_water_sources = await db.water_sources.count_documents({"is_active": True, "quality_status": "safe"})
-    active_alerts = await db.water_alerts.count_documents({"active": True})
-    total_purification_guides = await db.purification_guides.count_documents({"is_active": True})
-    users_tracking_water = await db.water_usage.distinct("user_id")
-    
-    # Resources by category
-    categories = ["food", "water", "tools", "skills", "shelter", "medical", "other"]
-    category_stats = {}
-    for category in categories:
-        count = await db.resources.count_documents({"is_active": True, "category": category})
-        category_stats[category] = count
+    stats = await community_stats.get()
+    return {"stats": stats, "generated_at": community_stats.generated_at}
+
+# MCP batches
+# An agent can send several actions in one request. Consecutive read actions run
+# concurrently (at most MCP_BATCH_CONCURRENCY at a time), while write actions
+# run concurrently with each other but after every earlier action has finished
+# and before any later one starts, so a search that follows a create in the same
+# batch sees it. Results come back in request order with a status per action.
+MAX_MCP_BATCH_ACTIONS = 50
+
+MCP_ACTIONS = {
+    "search_resources": mcp_search_resources,
+    "search_water_sources": mcp_search_water_sources,
+    "get_water_alerts": mcp_get_water_alerts,
+    "get_purification_guides": mcp_get_purification_guides,
+    "get_user_stats": mcp_get_user_stats,
+    "get_stats": mcp_get_user_stats,
+    "create_resource": mcp_create_resource,
+    "create_water_source": mcp_create_water_source,
+    "create_water_alert": mcp_create_water_alert,
+    "log_water_usage": mcp_log_water_usage,
+    "bulk_create_resources": mcp_bulk_create_resources,
+    "bulk_create_water_sources": mcp_bulk_create_water_sources,
+}
+MCP_READ_ACTIONS = {"search_resources", "search_water_sources", "get_water_alerts", "get_purification_guides", "get_user_stats", "get_stats"}
+
+async def run_mcp_action(item: Any, limiter: asyncio.Semaphore) -> Dict[str, Any]:
+    if not isinstance(item, dict) or not isinstance(item.get("action"), str):
+        return {"status": "error", "status_code": 400, "error": "action must be an object with an action name"}
+    handler = MCP_ACTIONS.get(item["action"])
+    if handler is None:
+        return {"action": item["action"], "status": "error", "status_code": 400, "error": f"Unknown action: {item['action']}"}
+    result = {"action": item["action"]}
+    try:
+        action = MCPRequest(**item)
+        async with limiter:
+            body = await handler(action, True)
+    except HTTPException as e:
+        result.update({"status": "error", "status_code": e.status_code, "error": e.detail})
+    except ValidationError as e:
+        result.update({"status": "error", "status_code": 422, "error": validation_message(e)})
+    except Exception:
+        logger.exception("MCP batch action %s failed", item["action"])
+        result.update({"status": "error", "status_code": 500, "error": "Internal error"})
+    else:
+        if isinstance(body, Response):
+            body = json.loads(body.body)
+        result.update({"status": "ok", "result": body})
+    return result
+
+def mcp_batch_stages(actions: List[Any]) -> List[List[int]]:
+    """Split action indexes into runs of reads and single writes, in order"""
+    stages, stage_is_read = [], False
+    for i, item in enumerate(actions):
+        is_read = isinstance(item, dict) and item.get("action") in MCP_READ_ACTIONS
+        if not (is_read and stage_is_read):
+            stages.append([])
+        stage_is_read = is_read
+        stages[-1].append(i)
+    return stages
+
+@api_router.post("/mcp/batch")
+async def mcp_batch(
+    request: MCPRequest,
+    api_key_valid: bool = Depends(verify_mcp_api_key)
+):
+    """Run several MCP actions in one call (data: actions, a list of {action, data})"""
+    actions = (request.data or {}).get("actions")
+    if not isinstance(actions, list) or not actions:
+        raise HTTPException(status_code=400, detail="actions must be a non-empty list")
+    if len(actions) > MAX_MCP_BATCH_ACTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_MCP_BATCH_ACTIONS} actions per batch")
+    
+    limiter = asyncio.Semaphore(MCP_BATCH_CONCURRENCY)
+    results = [None] * len(actions)
+    for stage in mcp_batch_stages(actions):
+        outcomes = await asyncio.gather(*(run_mcp_action(actions[i], limiter) for i in stage))
+        for i, outcome in zip(stage, outcomes):
+            results[i] = {"index": i, **outcome}
+    
+    summary = {status_name: sum(1 for r in results if r["status"] == status_name) for status_name in ("ok", "error")}
+    return {"results": results, **summary}
+
+# Community statistics snapshot
+RESOURCE_CATEGORIES = ["food", "water", "tools", "skills", "shelter", "medical", "other"]
+
+async def facet_counts(collection, match: dict, fields: List[str]) -> Dict[str, Dict[str, int]]:
+    """Per-value counts for several fields in a single $facet pass"""
+    pipeline = [
+        {"$match": match},
+        {"$facet": {field: [{"$group": {"_id": f"${field}", "count": {"$sum": 1}}}] for field in fields}}
+    ]
+    result = (await collection.aggregate(pipeline).to_list(1))[0]
+    return {field: {bucket["_id"]: bucket["count"] for bucket in result[field]} for field in fields}
+
+async def compute_community_stats() -> Dict[str, Any]:
+    (
+        total_users, resources, water_sources, active_alerts, total_purification_guides, usage_rollup
+    ) = await asyncio.gather(
+        db.users.count_documents({"is_active": True}),
+        facet_counts(db.resources, {"is_active": True}, ["type", "category"]),
+        facet_counts(db.water_sources, {"is_active": True}, ["quality_status"]),
+        db.water_alerts.count_documents({"active": True}),
+        db.purification_guides.count_documents({"is_active": True}),
+        db.water_usage_rollups.find_one({"_id": "community"}, {"users": 1}),
+    )
     
     return {
-        "stats": {
-            "total_users": total_users,
-            "total_resources": total_resources,
-            "available_resources": active_resources,
-            "needed_resources": needed_resources,
-            "categories": category_stats,
-            "water_module": {
-                "total_water_sources": total_water_sources,
-                "safe_water_sources": safe_water_sources,
-                "active_water_alerts": active_alerts,
-                "purification_guides": total_purification_guides,
-                "users_tracking_usage": len(users_tracking_water)
-            }
+        "total_users": total_users,
+        "total_resources": sum(resources["type"].values()),
+        "available_resources": resources["type"].get("available", 0),
+        "needed_resources": resources["type"].get("needed", 0),
+        "categories": {category: resources["category"].get(category, 0) for category in RESOURCE_CATEGORIES},
+        "water_module": {
+            "total_water_sources": sum(water_sources["quality_status"].values()),
+            "safe_water_sources": water_sources["quality_status"].get("safe", 0),
+            "active_water_alerts": active_alerts,
+            "purification_guides": total_purification_guides,
+            "users_tracking_usage": (usage_rollup or {}).get("users", 0)
         }
     }
 
+community_stats = SnapshotCache(
+    "community_stats", compute_community_stats, COMMUNITY_STATS_REFRESH_SECONDS, COMMUNITY_STATS_MAX_AGE_SECONDS
+)
+
 @api_router.get("/geocode")
-async def geocode_endpoint(address: str, current_user: User = Depends(get_current_user)):
+async def geocode_endpoint(address: str, current_user: Principal = Depends(get_current_user)):
     """Geocode an address"""
     location = await geocode_address(address)
     if not location:
@@ -787,12 +3059,16 @@ async def geocode_endpoint(address: str, current_user: User = Depends(get_curren
 
 # Water Sources
 @api_router.post("/water/sources", response_model=WaterSource)
-async def create_water_source(source_data: WaterSourceCreate, current_user: User = Depends(get_current_user)):
+async def create_water_source(source_data: WaterSourceCreate, current_user: Principal = Depends(get_current_user)):
     source_dict = source_data.dict()
     source_dict["added_by"] = current_user.id
     source = WaterSource(**source_dict)
     
-    await db.water_sources.insert_one(source.dict())
+    document = geo_document(source)
+    await db.water_sources.insert_one(document)
+    water_source_search.add(document)
+    await bump_versions("water_sources")
+    await publish_events([stream_event("water_sources", "created", source)])
     return source
 
 @api_router.get("/water/sources", response_model=List[WaterSource])
@@ -803,8 +3079,16 @@ async def get_water_sources(
     lat: Optional[float] = None,
     lng: Optional[float] = None,
     radius: Optional[float] = 10.0,
-    current_user: User = Depends(get_current_user)
+    q: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    facets: Optional[str] = None,
+    response: Response = None,
+    current_user: Principal = Depends(get_current_user)
 ):
+    fields = parse_fields(WaterSource, fields)
+    facets = parse_facets("water_sources", facets)
     filter_query = {"is_active": True}
     
     if type:
@@ -814,44 +3098,136 @@ async def get_water_sources(
     if quality_status:
         filter_query["quality_status"] = quality_status
     
-    sources = await db.water_sources.find(filter_query).to_list(1000)
-    
-    # Filter by location if provided
-    if lat is not None and lng is not None:
-        filtered_sources = []
-        for source in sources:
-            source_lat = source["location"]["lat"]
-            source_lng = source["location"]["lng"]
-            distance = ((lat - source_lat) ** 2 + (lng - source_lng) ** 2) ** 0.5 * 111
-            if distance <= radius:
-                filtered_sources.append(source)
-        sources = filtered_sources
+    # Text search if q is given, ranked by relevance blended with proximity;
+    # otherwise filter by location if provided, nearest first; otherwise newest first
+    if q:
+        filters = {"type": type, "accessibility": accessibility, "quality_status": quality_status}
+        sources, next_cursor, counts = await water_source_search.search(q, filters, lat, lng, radius, limit, cursor, response_projection(WaterSource, fields), facets)
+    else:
+        near = (lat, lng, radius) if lat is not None and lng is not None else None
+        sources, next_cursor, counts = await list_page(db.water_sources, filter_query, near, limit, cursor, response_projection(WaterSource, fields), facets)
     
-    return [WaterSource(**source) for source in sources]
+    return list_response(WaterSource, sources, next_cursor, response, fields, counts)
 
 @api_router.get("/water/sources/{source_id}", response_model=WaterSource)
-async def get_water_source(source_id: str, current_user: User = Depends(get_current_user)):
+async def get_water_source(source_id: str, current_user: Principal = Depends(get_current_user)):
     source = await db.water_sources.find_one({"id": source_id, "is_active": True})
     if not source:
         raise HTTPException(status_code=404, detail="Water source not found")
     return WaterSource(**source)
 
 @api_router.put("/water/sources/{source_id}", response_model=WaterSource)
-async def update_water_source(source_id: str, source_data: WaterSourceCreate, current_user: User = Depends(get_current_user)):
+async def update_water_source(source_id: str, source_data: WaterSourceCreate, current_user: Principal = Depends(get_current_user)):
     source = await db.water_sources.find_one({"id": source_id, "added_by": current_user.id})
     if not source:
         raise HTTPException(status_code=404, detail="Water source not found or not owned by user")
     
     update_data = source_data.dict()
+    update_data["geo"] = geo_point(source_data.location)
     update_data["updated_at"] = datetime.utcnow()
     
     await db.water_sources.update_one({"id": source_id}, {"$set": update_data})
+    await bump_versions("water_sources")
     updated_source = await db.water_sources.find_one({"id": source_id})
+    water_source_search.add(updated_source)
+    if updated_source.get("quality_status") != source.get("quality_status"):
+        await publish_events([stream_event("water_sources", "quality_changed", WaterSource(**updated_source))])
     return WaterSource(**updated_source)
 
 # Quality Reports
+# Each water source keeps running aggregates of its reports in `quality_stats`,
+# updated with one $inc per report. The quality score is an exponentially
+# time-decayed average of report ratings, weighted by how reliable the test
+# type is. Weights are stored relative to a fixed epoch (w * 2^(t - epoch) /
+# half-life) rather than decayed in place: the common decay factor cancels out
+# of the average, so the score only changes when a report arrives, and the
+# decayed total weight ("effective reports") is computed when read.
+QUALITY_RATING_VALUES = {"safe": 1.0, "caution": 0.5, "unsafe": 0.0}
+QUALITY_TEST_WEIGHTS = {"laboratory": 3.0, "field_kit": 2.0, "visual": 1.0, "taste": 1.0, "community_feedback": 1.0, "other": 1.0}
+QUALITY_SCORE_EPOCH = datetime(2025, 1, 1)
+QUALITY_SCORE_HORIZON = timedelta(days=3650)
+QUALITY_SCORE_MAX_HALF_LIVES = 1000  # 2 ** 1024 overflows a float; leaves room for test weights and sums
+QUALITY_HISTORY_BUCKETS = ("day", "week", "month")
+
+def check_quality_half_life(now: datetime):
+    """Fail startup if report weights would overflow within QUALITY_SCORE_HORIZON of now"""
+    if QUALITY_SCORE_HALF_LIFE_DAYS <= 0:
+        raise RuntimeError("QUALITY_SCORE_HALF_LIFE_DAYS must be positive")
+    half_lives = (now + QUALITY_SCORE_HORIZON - QUALITY_SCORE_EPOCH).total_seconds() / (QUALITY_SCORE_HALF_LIFE_DAYS * 86400)
+    if half_lives > QUALITY_SCORE_MAX_HALF_LIVES:
+        shortest = (now + QUALITY_SCORE_HORIZON - QUALITY_SCORE_EPOCH).days / QUALITY_SCORE_MAX_HALF_LIVES
+        raise RuntimeError(f"QUALITY_SCORE_HALF_LIFE_DAYS={QUALITY_SCORE_HALF_LIFE_DAYS:g} is too short; use at least {math.ceil(shortest)} days")
+
+def quality_decay_weight(at: datetime) -> float:
+    """2^(age relative to the epoch, in half-lives); grows for newer reports"""
+    return 2 ** ((at - QUALITY_SCORE_EPOCH).total_seconds() / (QUALITY_SCORE_HALF_LIFE_DAYS * 86400))
+
+def quality_stats_update(report: QualityReport) -> Dict[str, Dict[str, Any]]:
+    """$inc/$max/$set that fold one report into its water source's `quality_stats`"""
+    test_type = report.test_type if report.test_type in QUALITY_TEST_WEIGHTS else "other"
+    by_type = f"quality_stats.by_test_type.{test_type}"
+    inc = {"quality_stats.reports": 1, f"{by_type}.reports": 1}
+    value = QUALITY_RATING_VALUES.get(report.overall_rating)
+    if value is not None:
+        weight = QUALITY_TEST_WEIGHTS[test_type] * quality_decay_weight(report.test_date)
+        for prefix in ("quality_stats", by_type):
+            inc[f"{prefix}.weight"] = weight
+            inc[f"{prefix}.safe_weight"] = weight * value
+        inc[f"{by_type}.{report.overall_rating}"] = 1
+    if report.ph_level is not None:
+        inc[f"{by_type}.ph_sum"] = report.ph_level
+        inc[f"{by_type}.ph_count"] = 1
+    if report.bacteria_present is not None:
+        inc[f"{by_type}.bacteria_tested"] = 1
+        inc[f"{by_type}.bacteria_positive"] = int(report.bacteria_present)
+    return {
+        "$inc": inc,
+        "$max": {"quality_stats.last_report_at": report.test_date, f"{by_type}.last_report_at": report.test_date},
+        "$set": {f"{by_type}.last_rating": report.overall_rating},
+    }
+
+def quality_score(stats: dict) -> Optional[float]:
+    return round(stats["safe_weight"] / stats["weight"], 4) if stats.get("weight") else None
+
+def effective_reports(stats: dict, now: datetime) -> float:
+    """Test-weighted number of reports, each decayed by its age"""
+    return round(stats.get("weight", 0.0) / quality_decay_weight(now), 2)
+
+async def record_quality_report(report: QualityReport, status_update: dict) -> Optional[dict]:
+    """Fold a report into its source's aggregates and refresh the stored score"""
+    update = quality_stats_update(report)
+    update["$set"].update(status_update)
+    source = await db.water_sources.find_one_and_update(
+        {"id": report.water_source_id}, update, {"quality_stats": 1}, return_document=ReturnDocument.AFTER
+    )
+    if source is None:
+        return None
+    stats = source["quality_stats"]
+    # Only the writer that saw the latest report count stores the score, so a slower
+    # concurrent writer cannot overwrite it with one computed from fewer reports
+    await db.water_sources.update_one(
+        {"id": report.water_source_id, "quality_stats.reports": stats["reports"]},
+        {"$set": {"quality_score": quality_score(stats)}}
+    )
+    return stats
+
+async def backfill_quality_scores():
+    """Build `quality_stats` for water sources whose reports predate it"""
+    source_ids = await db.quality_reports.distinct("water_source_id")
+    missing = [doc["id"] async for doc in db.water_sources.find({"id": {"$in": source_ids}, "quality_stats": {"$exists": False}}, {"id": 1})]
+    for source_id in missing:
+        operations = [
+            UpdateOne({"id": source_id}, quality_stats_update(QualityReport(**report)))
+            async for report in db.quality_reports.find({"water_source_id": source_id}, {"_id": 0})
+        ]
+        await db.water_sources.bulk_write(operations)
+        source = await db.water_sources.find_one({"id": source_id}, {"quality_stats": 1})
+        await db.water_sources.update_one({"id": source_id}, {"$set": {"quality_score": quality_score(source["quality_stats"])}})
+    if missing:
+        logger.info("backfilled quality scores for %d water sources", len(missing))
+
 @api_router.post("/water/quality-reports", response_model=QualityReport)
-async def create_quality_report(report_data: QualityReportCreate, current_user: User = Depends(get_current_user)):
+async def create_quality_report(report_data: QualityReportCreate, current_user: Principal = Depends(get_current_user)):
     # Verify water source exists
     source = await db.water_sources.find_one({"id": report_data.water_source_id, "is_active": True})
     if not source:
@@ -863,34 +3239,122 @@ async def create_quality_report(report_data: QualityReportCreate, current_user:
     
     await db.quality_reports.insert_one(report.dict())
     
-    # Update water source quality status based on latest report
-    await db.water_sources.update_one(
-        {"id": report_data.water_source_id},
-        {"$set": {"quality_status": report_data.overall_rating, "last_tested": datetime.utcnow()}}
-    )
+    # Update water source quality status based on latest report, and its running aggregates
+    now = datetime.utcnow()
+    status_update = {"quality_status": report_data.overall_rating, "last_tested": now, "updated_at": now}
+    await record_quality_report(report, status_update)
+    water_source_search.add({**source, **status_update})
+    await bump_versions("water_sources")
+    if report_data.overall_rating != source.get("quality_status"):
+        await publish_events([stream_event("water_sources", "quality_changed", WaterSource(**{**source, **status_update}))])
     
     return report
 
 @api_router.get("/water/quality-reports", response_model=List[QualityReport])
 async def get_quality_reports(
     water_source_id: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    response: Response = None,
+    current_user: Principal = Depends(get_current_user)
 ):
     filter_query = {}
     if water_source_id:
         filter_query["water_source_id"] = water_source_id
     
-    reports = await db.quality_reports.find(filter_query).sort("test_date", -1).to_list(1000)
-    return [QualityReport(**report) for report in reports]
+    reports, next_cursor = await paginate(db.quality_reports, filter_query, "test_date", -1, limit, cursor, response_projection(QualityReport))
+    
+    return list_response(QualityReport, reports, next_cursor, response)
+
+def quality_type_summary(stats: dict, now: datetime) -> Dict[str, Any]:
+    return {
+        "reports": stats.get("reports", 0),
+        "score": quality_score(stats),
+        "effective_reports": effective_reports(stats, now),
+        **{rating: stats.get(rating, 0) for rating in QUALITY_RATING_VALUES},
+        "last_rating": stats.get("last_rating"),
+        "last_report_at": stats.get("last_report_at"),
+        "average_ph": round(stats["ph_sum"] / stats["ph_count"], 2) if stats.get("ph_count") else None,
+        "bacteria_positive_rate": round(stats["bacteria_positive"] / stats["bacteria_tested"], 4) if stats.get("bacteria_tested") else None,
+    }
+
+def quality_bucket_counts(group: dict) -> Dict[str, Any]:
+    return {
+        "reports": group["reports"],
+        **{rating: group[rating] for rating in QUALITY_RATING_VALUES},
+        "average_ph": round(group["ph_sum"] / group["ph_count"], 2) if group["ph_count"] else None,
+        "bacteria_positive": group["bacteria_positive"],
+        "bacteria_tested": group["bacteria_tested"],
+    }
+
+async def quality_history(source_id: str, bucket: str, since: datetime) -> List[Dict[str, Any]]:
+    """Report counts per rating, pH and bacteria results per time bucket and test type, oldest first"""
+    per_type = {
+        "reports": {"$sum": 1},
+        **{rating: {"$sum": {"$cond": [{"$eq": ["$overall_rating", rating]}, 1, 0]}} for rating in QUALITY_RATING_VALUES},
+        "ph_sum": {"$sum": "$ph_level"},
+        "ph_count": {"$sum": {"$cond": [{"$isNumber": "$ph_level"}, 1, 0]}},
+        "bacteria_tested": {"$sum": {"$cond": [{"$eq": [{"$type": "$bacteria_present"}, "bool"]}, 1, 0]}},
+        "bacteria_positive": {"$sum": {"$cond": [{"$eq": ["$bacteria_present", True]}, 1, 0]}},
+    }
+    pipeline = [
+        {"$match": {"water_source_id": source_id, "test_date": {"$gte": since}}},
+        {"$group": {"_id": {"period": {"$dateTrunc": {"date": "$test_date", "unit": bucket}}, "test_type": "$test_type"}, **per_type}},
+        {"$group": {
+            "_id": "$_id.period",
+            **{field: {"$sum": f"${field}"} for field in per_type},
+            "by_test_type": {"$push": {"test_type": "$_id.test_type", **{field: f"${field}" for field in per_type}}},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+    return [
+        {
+            "period_start": row["_id"],
+            **quality_bucket_counts(row),
+            "by_test_type": {group["test_type"]: quality_bucket_counts(group) for group in sorted(row["by_test_type"], key=lambda g: str(g["test_type"]))},
+        }
+        async for row in db.quality_reports.aggregate(pipeline)
+    ]
+
+@api_router.get("/water/sources/{source_id}/quality")
+async def get_water_source_quality(
+    source_id: str,
+    bucket: str = "week",  # day, week, month
+    periods: int = Query(12, ge=1, le=366),
+    current_user: Principal = Depends(get_current_user)
+):
+    """Quality score, per-test-type aggregates and the report history in time buckets"""
+    if bucket not in QUALITY_HISTORY_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of: {', '.join(QUALITY_HISTORY_BUCKETS)}")
+    source = await db.water_sources.find_one(
+        {"id": source_id, "is_active": True}, {"quality_status": 1, "quality_score": 1, "quality_stats": 1}
+    )
+    if not source:
+        raise HTTPException(status_code=404, detail="Water source not found")
+    
+    now = datetime.utcnow()
+    since = now - {"day": timedelta(days=periods), "week": timedelta(weeks=periods), "month": timedelta(days=31 * periods)}[bucket]
+    stats = source.get("quality_stats", {})
+    return {
+        "water_source_id": source_id,
+        "quality_status": source.get("quality_status"),
+        "quality_score": source.get("quality_score"),
+        "effective_reports": effective_reports(stats, now),
+        "reports": stats.get("reports", 0),
+        "last_report_at": stats.get("last_report_at"),
+        "by_test_type": {test_type: quality_type_summary(type_stats, now) for test_type, type_stats in stats.get("by_test_type", {}).items()},
+        "bucket": bucket,
+        "history": await quality_history(source_id, bucket, since),
+    }
 
 # Infrastructure Plans
 @api_router.post("/water/infrastructure-plans", response_model=InfrastructurePlan)
-async def create_infrastructure_plan(plan_data: InfrastructurePlanCreate, current_user: User = Depends(get_current_user)):
+async def create_infrastructure_plan(plan_data: InfrastructurePlanCreate, current_user: Principal = Depends(get_current_user)):
     plan_dict = plan_data.dict()
     plan_dict["created_by"] = current_user.id
     plan = InfrastructurePlan(**plan_dict)
     
-    await db.infrastructure_plans.insert_one(plan.dict())
+    await db.infrastructure_plans.insert_one(geo_document(plan))
     return plan
 
 @api_router.get("/water/infrastructure-plans", response_model=List[InfrastructurePlan])
@@ -900,8 +3364,15 @@ async def get_infrastructure_plans(
     lat: Optional[float] = None,
     lng: Optional[float] = None,
     radius: Optional[float] = 50.0,
-    current_user: User = Depends(get_current_user)
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    facets: Optional[str] = None,
+    response: Response = None,
+    current_user: Principal = Depends(get_current_user)
 ):
+    fields = parse_fields(InfrastructurePlan, fields)
+    facets = parse_facets("infrastructure_plans", facets)
     filter_query = {"is_active": True}
     
     if plan_type:
@@ -909,29 +3380,164 @@ async def get_infrastructure_plans(
     if funding_status:
         filter_query["funding_status"] = funding_status
     
-    plans = await db.infrastructure_plans.find(filter_query).to_list(1000)
+    # Filter by location if provided, nearest first; otherwise newest first
+    near = (lat, lng, radius) if lat is not None and lng is not None else None
+    plans, next_cursor, counts = await list_page(db.infrastructure_plans, filter_query, near, limit, cursor, response_projection(InfrastructurePlan, fields), facets)
     
-    # Filter by location if provided
-    if lat is not None and lng is not None:
-        filtered_plans = []
-        for plan in plans:
-            plan_lat = plan["location"]["lat"]
-            plan_lng = plan["location"]["lng"]
-            distance = ((lat - plan_lat) ** 2 + (lng - plan_lng) ** 2) ** 0.5 * 111
-            if distance <= radius:
-                filtered_plans.append(plan)
-        plans = filtered_plans
-    
-    return [InfrastructurePlan(**plan) for plan in plans]
+    return list_response(InfrastructurePlan, plans, next_cursor, response, fields, counts)
 
 # Purification Guides
+# Active guides are served from an in-process copy, kept in list order
+# (community_rating desc, id desc) with per-value position lists for the
+# filterable fields, so list and detail reads do not touch Mongo. Local writes
+# invalidate it; writes from other workers are picked up by polling the
+# collection version every GUIDE_CACHE_REFRESH_SECONDS.
+class GuideCache:
+    INDEXED_FIELDS = ("method_type", "effectiveness", "difficulty_level")
+
+    def __init__(self, collection, scope: str, refresh_interval: float):
+        self.collection = collection
+        self.scope = scope
+        self.refresh_interval = refresh_interval
+        self.version: Optional[int] = None
+        self.loads = 0
+        self._guides: Optional[List[dict]] = None
+        self._by_id: Dict[str, dict] = {}
+        self._ascending_keys: List[Tuple[float, str]] = []
+        self._indexes: Dict[str, Dict[Any, List[int]]] = {}
+        self._generation = 0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _load(self):
+        while True:
+            generation = self._generation
+            # Version first, so the copy is never tagged newer than its contents
+            version = await collection_version(self.scope)
+            guides = await self.collection.find({"is_active": True}, response_projection(PurificationGuide)).to_list(None)
+            if generation == self._generation:
+                break
+        guides.sort(key=lambda guide: (guide.get("community_rating", 0.0), guide["id"]), reverse=True)
+        indexes = {field: defaultdict(list) for field in self.INDEXED_FIELDS}
+        for position, guide in enumerate(guides):
+            for field in self.INDEXED_FIELDS:
+                indexes[field][guide.get(field)].append(position)
+        self._by_id = {guide["id"]: guide for guide in guides}
+        self._ascending_keys = [(guide.get("community_rating", 0.0), guide["id"]) for guide in reversed(guides)]
+        self._indexes = {field: dict(values) for field, values in indexes.items()}
+        self._guides = guides
+        self.version = version
+        self.loads += 1
+
+    async def ensure(self):
+        if self._guides is None:
+            async with self._lock:
+                if self._guides is None:
+                    await self._load()
+
+    def invalidate(self):
+        """Drop the copy; the next read reloads it"""
+        self._generation += 1
+        self._guides = None
+
+    def apply_increments(self, increments: Dict[str, Dict[str, int]]):
+        """Add flushed counter increments to the cached guides in place (none of them are sort or index fields)"""
+        # A load already reading may have missed them; make it read again
+        self._generation += 1
+        for guide_id, fields in increments.items():
+            guide = self._by_id.get(guide_id)
+            if guide is not None:
+                for field, amount in fields.items():
+                    guide[field] = guide.get(field, 0) + amount
+
+    async def get(self, guide_id: str) -> Optional[dict]:
+        await self.ensure()
+        return self._by_id.get(guide_id)
+
+    async def page(self, filters: Dict[str, Any], limit: int, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """Same page and cursor as paginate(..., "community_rating", -1, ...) over active guides"""
+        await self.ensure()
+        guides = self._guides
+        filters = {field: value for field, value in filters.items() if value}
+        start = 0
+        if cursor:
+            values = decode_cursor(cursor)
+            if len(values) != 2:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            # Guides strictly after the cursor key in descending order
+            start = len(guides) - bisect_left(self._ascending_keys, tuple(values))
+        
+        if filters:
+            # Walk the shortest position list and check the other fields on each guide
+            lists = [self._indexes[field].get(value, []) for field, value in filters.items()]
+            positions = min(lists, key=len)
+            candidates = (guides[p] for p in positions[bisect_left(positions, start):])
+            matches = (guide for guide in candidates if all(guide.get(field) == value for field, value in filters.items()))
+        else:
+            matches = iter(guides[start:])
+        
+        page = [guide for _, guide in zip(range(limit + 1), matches)]
+        if len(page) <= limit:
+            return page, None
+        page = page[:limit]
+        return page, encode_cursor([page[-1].get("community_rating", 0.0), page[-1]["id"]])
+
+    async def _refresh_forever(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                if self._guides is not None and await collection_version(self.scope) != self.version:
+                    self.invalidate()
+            except Exception as e:
+                logger.warning("guide cache refresh failed: %s", e)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_forever())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "guides": len(self._guides) if self._guides is not None else None,
+            "version": self.version,
+            "loads": self.loads,
+            "refresh_interval_seconds": self.refresh_interval
+        }
+
+guide_cache = GuideCache(db.purification_guides, "purification_guides", GUIDE_CACHE_REFRESH_SECONDS)
+
+async def guides_changed():
+    """Call after any write to purification guides (creation, ratings)"""
+    await bump_versions("purification_guides")
+    guide_cache.invalidate()
+
+async def guide_usage_flushed(increments: Dict[str, Dict[str, int]]):
+    # Usage counts are not part of the list version: bumping it on every flush
+    # would reload the cache and break 304s while guides are being read. Other
+    # workers' copies show new counts after their next reload.
+    guide_cache.apply_increments(increments)
+
+# Guide views are counted through a write-behind buffer instead of one update per read
+guide_usage = CounterBuffer(
+    "guide_usage",
+    db.purification_guides,
+    flush_interval=COUNTER_FLUSH_INTERVAL_SECONDS,
+    max_keys=COUNTER_MAX_PENDING_KEYS,
+    on_flush=guide_usage_flushed,
+)
+
 @api_router.post("/water/purification-guides", response_model=PurificationGuide)
-async def create_purification_guide(guide_data: PurificationGuideCreate, current_user: User = Depends(get_current_user)):
+async def create_purification_guide(guide_data: PurificationGuideCreate, current_user: Principal = Depends(get_current_user)):
     guide_dict = guide_data.dict()
     guide_dict["created_by"] = current_user.id
     guide = PurificationGuide(**guide_dict)
     
     await db.purification_guides.insert_one(guide.dict())
+    await guides_changed()
     return guide
 
 @api_router.get("/water/purification-guides", response_model=List[PurificationGuide])
@@ -939,39 +3545,48 @@ async def get_purification_guides(
     method_type: Optional[str] = None,
     effectiveness: Optional[str] = None,
     difficulty_level: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    request: Request = None,
+    response: Response = None,
+    current_user: Principal = Depends(get_current_user)
 ):
-    filter_query = {"is_active": True}
+    fields = parse_fields(PurificationGuide, fields)
+    await guide_cache.ensure()
+    cached = await not_modified(request, response, "purification_guides", version=guide_cache.version)
+    if cached:
+        return cached
     
-    if method_type:
-        filter_query["method_type"] = method_type
-    if effectiveness:
-        filter_query["effectiveness"] = effectiveness
-    if difficulty_level:
-        filter_query["difficulty_level"] = difficulty_level
+    filters = {"method_type": method_type, "effectiveness": effectiveness, "difficulty_level": difficulty_level}
+    guides, next_cursor = await guide_cache.page(filters, limit, cursor)
     
-    guides = await db.purification_guides.find(filter_query).sort("community_rating", -1).to_list(1000)
-    return [PurificationGuide(**guide) for guide in guides]
+    return list_response(PurificationGuide, guides, next_cursor, response, fields)
 
 @api_router.get("/water/purification-guides/{guide_id}", response_model=PurificationGuide)
-async def get_purification_guide(guide_id: str, current_user: User = Depends(get_current_user)):
-    guide = await db.purification_guides.find_one({"id": guide_id, "is_active": True})
+async def get_purification_guide(guide_id: str, current_user: Principal = Depends(get_current_user)):
+    guide = await guide_cache.get(guide_id)
     if not guide:
         raise HTTPException(status_code=404, detail="Purification guide not found")
     
-    # Increment usage count
-    await db.purification_guides.update_one({"id": guide_id}, {"$inc": {"usage_count": 1}})
+    # Increment usage count (buffered)
+    guide_usage.increment(guide_id, "usage_count")
+    guide = {**guide, "usage_count": guide.get("usage_count", 0) + guide_usage.pending_count(guide_id, "usage_count")}
     
     return PurificationGuide(**guide)
 
 # Water Alerts
 @api_router.post("/water/alerts", response_model=WaterAlert)
-async def create_water_alert(alert_data: WaterAlertCreate, current_user: User = Depends(get_current_user)):
+async def create_water_alert(alert_data: WaterAlertCreate, current_user: Principal = Depends(get_current_user)):
     alert_dict = alert_data.dict()
     alert_dict["issued_by"] = current_user.id
     alert = WaterAlert(**alert_dict)
     
-    await db.water_alerts.insert_one(alert.dict())
+    document = alert_document(alert)
+    await db.water_alerts.insert_one(document)
+    alert_fanout.enqueue(document)
+    await bump_versions("water_alerts")
+    await publish_events([stream_event("water_alerts", "created", alert)])
     return alert
 
 @api_router.get("/water/alerts", response_model=List[WaterAlert])
@@ -981,8 +3596,18 @@ async def get_water_alerts(
     active_only: bool = True,
     lat: Optional[float] = None,
     lng: Optional[float] = None,
-    current_user: User = Depends(get_current_user)
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    request: Request = None,
+    response: Response = None,
+    current_user: Principal = Depends(get_current_user)
 ):
+    fields = parse_fields(WaterAlert, fields)
+    cached = await not_modified(request, response, "water_alerts", int(time.time() // ALERT_EXPIRY_BUCKET_SECONDS) if active_only else None)
+    if cached:
+        return cached
+    
     filter_query = {}
     
     if active_only:
@@ -998,23 +3623,13 @@ async def get_water_alerts(
     if severity:
         filter_query["severity"] = severity
     
-    alerts = await db.water_alerts.find(filter_query).sort("created_at", -1).to_list(1000)
-    
-    # Filter by user location if provided
-    if lat is not None and lng is not None:
-        filtered_alerts = []
-        for alert in alerts:
-            alert_lat = alert["location"]["lat"]
-            alert_lng = alert["location"]["lng"]
-            distance = ((lat - alert_lat) ** 2 + (lng - alert_lng) ** 2) ** 0.5 * 111
-            if distance <= alert["radius_km"]:
-                filtered_alerts.append(alert)
-        alerts = filtered_alerts
+    # Filter by user location if provided: only alerts whose circle contains the point
+    alerts, next_cursor = await alerts_page(filter_query, lat, lng, limit, cursor, response_projection(WaterAlert, fields))
     
-    return [WaterAlert(**alert) for alert in alerts]
+    return list_response(WaterAlert, alerts, next_cursor, response, fields)
 
 @api_router.put("/water/alerts/{alert_id}/verify")
-async def verify_water_alert(alert_id: str, current_user: User = Depends(get_current_user)):
+async def verify_water_alert(alert_id: str, current_user: Principal = Depends(get_current_user)):
     alert = await db.water_alerts.find_one({"id": alert_id})
     if not alert:
         raise HTTPException(status_code=404, detail="Alert not found")
@@ -1023,47 +3638,273 @@ async def verify_water_alert(alert_id: str, current_user: User = Depends(get_cur
         {"id": alert_id},
         {"$set": {"verified": True, "verified_by": current_user.id, "updated_at": datetime.utcnow()}}
     )
+    await bump_versions("water_alerts")
     return {"message": "Alert verified successfully"}
 
+# Notification inbox
+@api_router.get("/notifications", response_model=List[Notification])
+async def get_notifications(
+    unread_only: bool = False,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    response: Response = None,
+    current_user: Principal = Depends(get_current_user)
+):
+    """The current user's notifications, newest first"""
+    filter_query = {"user_id": current_user.id}
+    if unread_only:
+        filter_query["read"] = False
+    notifications, next_cursor = await paginate(db.notifications, filter_query, "created_at", -1, limit, cursor, response_projection(Notification))
+    return list_response(Notification, notifications, next_cursor, response)
+
+@api_router.put("/notifications/read")
+async def mark_notifications_read(body: NotificationsRead, current_user: Principal = Depends(get_current_user)):
+    filter_query = {"user_id": current_user.id, "read": False}
+    if body.ids is not None:
+        filter_query["id"] = {"$in": body.ids}
+    result = await db.notifications.update_many(filter_query, {"$set": {"read": True}})
+    return {"message": "Notifications marked as read", "marked": result.modified_count}
+
 # Water Usage Tracking
-@api_router.post("/water/usage", response_model=WaterUsage)
-async def log_water_usage(usage_data: WaterUsageCreate, current_user: User = Depends(get_current_user)):
-    usage_dict = usage_data.dict()
-    usage_dict["user_id"] = current_user.id
-    
-    if not usage_dict["date"]:
-        usage_dict["date"] = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    
-    # Calculate total
-    total = (usage_dict["drinking_liters"] + usage_dict["cooking_liters"] + 
-             usage_dict["cleaning_liters"] + usage_dict["agriculture_liters"] + 
-             usage_dict["other_liters"])
-    usage_dict["total_liters"] = total
-    
-    usage = WaterUsage(**usage_dict)
-    
-    # Check if usage already exists for this date, update if so
-    existing = await db.water_usage.find_one({
-        "user_id": current_user.id,
-        "date": usage_dict["date"]
-    })
-    
-    if existing:
-        await db.water_usage.update_one(
-            {"id": existing["id"]},
-            {"$set": usage_dict}
+# One usage document per (user_id, day). Writes are single upserts keyed on
+# that pair, backed by the unique index, so concurrent posts cannot race.
+WATER_USAGE_CATEGORIES = ["drinking", "cooking", "cleaning", "agriculture", "other"]
+MAX_WATER_USAGE_BATCH = 1000
+WATER_USAGE_BATCH_CONCURRENCY = 16
+
+def usage_day(date: Optional[datetime]) -> datetime:
+    """Normalize a usage date to midnight UTC (naive, as stored)"""
+    if date is None:
+        date = datetime.utcnow()
+    elif date.tzinfo is not None:
+        date = (date - date.utcoffset()).replace(tzinfo=None)
+    return date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def water_usage_upsert(user_id: str, usage_data: WaterUsageCreate) -> Tuple[dict, dict]:
+    """Filter and update document for logging one day of usage"""
+    fields = usage_data.dict(exclude={"user_id"})
+    fields["user_id"] = user_id
+    fields["date"] = usage_day(fields["date"])
+    fields["total_liters"] = sum(fields[f"{category}_liters"] for category in WATER_USAGE_CATEGORIES)
+    update = {
+        "$set": fields,
+        "$setOnInsert": {"id": str(uuid.uuid4()), "created_at": datetime.utcnow()}
+    }
+    return {"user_id": user_id, "date": fields["date"]}, update
+
+async def write_water_usage(filter_query: dict, update: dict) -> Tuple[Optional[dict], dict]:
+    """Upsert one day of usage atomically; returns (before, after) for the rollups"""
+    try:
+        before = await db.water_usage.find_one_and_update(
+            filter_query, update, upsert=True, return_document=ReturnDocument.BEFORE
         )
-        return WaterUsage(**{**existing, **usage_dict})
-    else:
-        await db.water_usage.insert_one(usage.dict())
-        return usage
+    except DuplicateKeyError:
+        # Lost an insert race on the (user_id, date) unique index; the document exists now
+        before = await db.water_usage.find_one_and_update(
+            filter_query, update, return_document=ReturnDocument.BEFORE
+        )
+    return before, {**(before or update["$setOnInsert"]), **update["$set"]}
+
+async def upsert_water_usage(user_id: str, usage_data: WaterUsageCreate) -> dict:
+    """Upsert one day of usage, roll it up, and return the stored document"""
+    before, after = await write_water_usage(*water_usage_upsert(user_id, usage_data))
+    await apply_usage_rollups([(before, after)])
+    await bump_versions(version_scope("water_usage", user_id))
+    return after
+
+# Usage rollups
+# water_usage_rollups holds running sums so stats are O(1) reads:
+#   user:{id}                   all-time per user
+#   user:{id}:month:{YYYY-MM}   monthly per user
+#   community                   all-time, plus distinct `users`
+#   community:month:{YYYY-MM}   monthly, plus distinct `users`
+#   community:day:{YYYY-MM-DD}  daily, plus distinct `users`
+# Every usage write applies the delta between the previous and new version of
+# the day's document. rebuild_usage_rollups() recomputes them from scratch.
+ROLLUP_SUM_FIELDS = ["total_liters"] + [f"{category}_liters" for category in WATER_USAGE_CATEGORIES]
+
+def rollup_keys(user_id: str, day: datetime) -> Dict[str, str]:
+    month, date = day.strftime("%Y-%m"), day.strftime("%Y-%m-%d")
+    return {
+        "user": f"user:{user_id}",
+        "user_month": f"user:{user_id}:month:{month}",
+        "community": "community",
+        "community_month": f"community:month:{month}",
+        "community_day": f"community:day:{date}",
+    }
+
+async def increment_rollup(key: str, fields: Dict[str, float], scope: dict) -> Optional[dict]:
+    """Apply one rollup's increments atomically and return its days_logged from before"""
+    update = {"$inc": dict(fields), "$set": {"updated_at": datetime.utcnow()}, "$setOnInsert": scope}
+    try:
+        return await db.water_usage_rollups.find_one_and_update(
+            {"_id": key}, update, {"days_logged": 1}, upsert=True, return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # Another writer created the rollup between our match and insert
+        return await db.water_usage_rollups.find_one_and_update(
+            {"_id": key}, update, {"days_logged": 1}, return_document=ReturnDocument.BEFORE
+        )
+
+async def apply_usage_rollups(changes: List[Tuple[Optional[dict], dict]]):
+    """Apply (before, after) usage document changes to every affected rollup in one bulk write"""
+    if not changes:
+        return
+    increments: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(int))
+    scopes: Dict[str, dict] = {}
+    communities: Dict[str, str] = {}  # user-level rollup key -> community key it may add a user to
+    
+    for before, after in changes:
+        keys = rollup_keys(after["user_id"], after["date"])
+        delta = {field: after.get(field, 0.0) - (before or {}).get(field, 0.0) for field in ROLLUP_SUM_FIELDS}
+        delta["days_logged"] = 0 if before else 1
+        for scope, key in keys.items():
+            scopes[key] = {"scope": scope, **({"user_id": after["user_id"]} if scope.startswith("user") else {})}
+            for field, value in delta.items():
+                increments[key][field] += value
+        communities[keys["user"]] = keys["community"]
+        communities[keys["user_month"]] = keys["community_month"]
+        if not before:
+            increments[keys["community_day"]]["users"] += 1
+    
+    # A user counts toward a community `users` total when their own rollup goes
+    # from no days to some. Each user-level rollup is incremented atomically and
+    # returns its previous value, so concurrent first writes count a user once.
+    user_increments = {key: increments.pop(key) for key in communities}
+    previous = await asyncio.gather(*(increment_rollup(key, fields, scopes[key]) for key, fields in user_increments.items()))
+    for (key, fields), before in zip(user_increments.items(), previous):
+        if not (before or {}).get("days_logged") and fields["days_logged"] > 0:
+            increments[communities[key]]["users"] += 1
+    
+    operations = [
+        UpdateOne(
+            {"_id": key},
+            {"$inc": dict(fields), "$set": {"updated_at": datetime.utcnow()}, "$setOnInsert": scopes[key]},
+            upsert=True
+        )
+        for key, fields in increments.items()
+    ]
+    await db.water_usage_rollups.bulk_write(operations, ordered=False)
+
+async def rebuild_usage_rollups():
+    """Recompute every usage rollup from water_usage with server-side aggregations"""
+    sums = {field: {"$sum": f"${field}"} for field in ROLLUP_SUM_FIELDS}
+    month = {"$dateToString": {"format": "%Y-%m", "date": "$date"}}
+    day = {"$dateToString": {"format": "%Y-%m-%d", "date": "$date"}}
+    groupings = [
+        ("user", {"$concat": ["user:", "$user_id"]}, False),
+        ("user_month", {"$concat": ["user:", "$user_id", ":month:", month]}, False),
+        ("community", "community", True),
+        ("community_month", {"$concat": ["community:month:", month]}, True),
+        ("community_day", {"$concat": ["community:day:", day]}, True),
+    ]
+    await db.water_usage_rollups.delete_many({})
+    for scope, group_key, distinct_users in groupings:
+        group = {"_id": group_key, "days_logged": {"$sum": 1}, **sums}
+        fields = {"scope": scope, "updated_at": datetime.utcnow()}
+        if distinct_users:
+            group["user_ids"] = {"$addToSet": "$user_id"}
+            fields["users"] = {"$size": "$user_ids"}
+        else:
+            group["user_id"] = {"$first": "$user_id"}
+        pipeline = [{"$group": group}, {"$set": fields}]
+        if distinct_users:
+            pipeline.append({"$unset": "user_ids"})
+        pipeline.append({"$merge": {"into": "water_usage_rollups", "whenMatched": "replace"}})
+        await db.water_usage.aggregate(pipeline).to_list(None)
+
+async def ensure_usage_rollups():
+    """Build rollups once for deployments that logged usage before they existed"""
+    if not await db.water_usage_rollups.find_one({"_id": "community"}) and await db.water_usage.find_one({}, {"_id": 1}):
+        logger.info("usage rollups missing, rebuilding from water_usage")
+        await rebuild_usage_rollups()
+
+def usage_summary(rollup: Optional[dict]) -> Dict[str, Any]:
+    """Averages per logged day from a rollup document"""
+    if not rollup or not rollup.get("days_logged"):
+        return {}
+    days = rollup["days_logged"]
+    summary = {
+        "daily_average": round(rollup["total_liters"] / days, 2),
+        "total_days_logged": days,
+        "total_consumption": round(rollup["total_liters"], 2),
+        "category_averages": {category: round(rollup[f"{category}_liters"] / days, 2) for category in WATER_USAGE_CATEGORIES}
+    }
+    if "users" in rollup:
+        summary["users"] = rollup["users"]
+    return summary
+
+@api_router.post("/water/usage", response_model=WaterUsage)
+async def log_water_usage(usage_data: WaterUsageCreate, current_user: Principal = Depends(get_current_user)):
+    usage = await upsert_water_usage(current_user.id, usage_data)
+    return WaterUsage(**usage)
+
+@api_router.post("/water/usage/batch")
+async def log_water_usage_batch(batch: WaterUsageBatch, current_user: Principal = Depends(get_current_user)):
+    """Log many days of the caller's usage, with a result per item.
+
+    Each day is its own find_one_and_update rather than one bulk_write: the
+    rollups need the exact previous version of every day, which bulk_write
+    cannot return. A failed item is reported in its result and the rollups
+    are still applied for every item that was written.
+    """
+    if len(batch.items) > MAX_WATER_USAGE_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_WATER_USAGE_BATCH} items per batch")
+    
+    results = [{"index": i, "status": "pending"} for i in range(len(batch.items))]
+    
+    # Last write wins for repeated days within the batch
+    latest = {}
+    for i, item in enumerate(batch.items):
+        results[i].update({"user_id": item.user_id or current_user.id, "date": usage_day(item.date)})
+        if results[i]["user_id"] != current_user.id:
+            results[i].update({"status": "error", "error": "Cannot log usage for another user"})
+            continue
+        if results[i]["date"] in latest:
+            results[latest[results[i]["date"]]].update({"status": "skipped", "error": f"Superseded by item {i}"})
+        latest[results[i]["date"]] = i
+    
+    # Each day is its own atomic upsert so the rollups get the exact previous
+    # version, even if another request writes the same day concurrently
+    limiter = asyncio.Semaphore(WATER_USAGE_BATCH_CONCURRENCY)
+    
+    async def write(i: int) -> Optional[Tuple[Optional[dict], dict]]:
+        async with limiter:
+            try:
+                before, after = await write_water_usage(*water_usage_upsert(current_user.id, batch.items[i]))
+            except OperationFailure as e:
+                results[i].update({"status": "error", "error": str(e)})
+                return None
+            except Exception as e:
+                # e.g. a dropped connection: the days already written still need their rollups
+                logger.warning("Water usage batch item %d failed: %s", i, e)
+                results[i].update({"status": "error", "error": "Write failed, retry this item"})
+                return None
+        results[i]["status"] = "updated" if before else "inserted"
+        return before, after
+    
+    changes = [change for change in await asyncio.gather(*(write(i) for i in sorted(latest.values()))) if change]
+    if changes:
+        await apply_usage_rollups(changes)
+        await bump_versions(version_scope("water_usage", current_user.id))
+    
+    summary = {status_name: sum(1 for r in results if r["status"] == status_name) for status_name in ("inserted", "updated", "skipped", "error")}
+    return {"results": results, **summary}
 
 @api_router.get("/water/usage", response_model=List[WaterUsage])
 async def get_water_usage(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    request: Request = None,
+    response: Response = None,
+    current_user: Principal = Depends(get_current_user)
 ):
+    cached = await not_modified(request, response, version_scope("water_usage", current_user.id))
+    if cached:
+        return cached
+    
     filter_query = {"user_id": current_user.id}
     
     if start_date:
@@ -1074,51 +3915,286 @@ async def get_water_usage(
         else:
             filter_query["date"] = {"$lte": datetime.fromisoformat(end_date)}
     
-    usage_records = await db.water_usage.find(filter_query).sort("date", -1).to_list(1000)
-    return [WaterUsage(**usage) for usage in usage_records]
+    usage_records, next_cursor = await paginate(db.water_usage, filter_query, "date", -1, limit, cursor, response_projection(WaterUsage))
+    
+    return list_response(WaterUsage, usage_records, next_cursor, response)
 
 @api_router.get("/water/usage/stats")
-async def get_water_usage_stats(current_user: User = Depends(get_current_user)):
-    # Personal stats
-    personal_usage = await db.water_usage.find({"user_id": current_user.id}).to_list(1000)
+async def get_water_usage_stats(current_user: Principal = Depends(get_current_user)):
+    now = datetime.utcnow()
+    keys = rollup_keys(current_user.id, now)
+    rollups = {
+        doc["_id"]: doc
+        async for doc in db.water_usage_rollups.find({"_id": {"$in": list(keys.values())}})
+    }
     
-    if not personal_usage:
+    personal = rollups.get(keys["user"])
+    if not personal or not personal.get("days_logged"):
         return {"personal": {}, "community": {}}
     
-    # Calculate personal averages
-    total_days = len(personal_usage)
-    total_consumption = sum(usage["total_liters"] for usage in personal_usage)
-    avg_daily = total_consumption / total_days if total_days > 0 else 0
-    
-    # Category breakdown
-    categories = {
-        "drinking": sum(usage["drinking_liters"] for usage in personal_usage) / total_days,
-        "cooking": sum(usage["cooking_liters"] for usage in personal_usage) / total_days,
-        "cleaning": sum(usage["cleaning_liters"] for usage in personal_usage) / total_days,
-        "agriculture": sum(usage["agriculture_liters"] for usage in personal_usage) / total_days,
-        "other": sum(usage["other_liters"] for usage in personal_usage) / total_days
-    }
-    
     # Community stats (anonymized)
-    all_usage = await db.water_usage.find({}).to_list(10000)
-    community_total = sum(usage["total_liters"] for usage in all_usage)
-    community_users = len(set(usage["user_id"] for usage in all_usage))
-    community_avg = community_total / len(all_usage) if all_usage else 0
+    community = rollups.get(keys["community"]) or {}
+    community_days = community.get("days_logged", 0)
     
     return {
         "personal": {
-            "daily_average": round(avg_daily, 2),
-            "total_days_logged": total_days,
-            "total_consumption": round(total_consumption, 2),
-            "category_averages": {k: round(v, 2) for k, v in categories.items()}
+            **usage_summary(personal),
+            "this_month": usage_summary(rollups.get(keys["user_month"]))
         },
         "community": {
-            "average_daily_per_person": round(community_avg, 2),
-            "total_users_tracking": community_users,
-            "total_community_consumption": round(community_total, 2)
+            "average_daily_per_person": round(community.get("total_liters", 0.0) / community_days, 2) if community_days else 0,
+            "total_users_tracking": community.get("users", 0),
+            "total_community_consumption": round(community.get("total_liters", 0.0), 2),
+            "this_month": usage_summary(rollups.get(keys["community_month"])),
+            "today": usage_summary(rollups.get(keys["community_day"]))
         }
     }
 
+# Streaming export
+# Full dumps for partner syncs are streamed straight from the Motor cursor so
+# memory stays flat no matter how large the collection is.
+EXPORT_COLLECTIONS = {
+    "resources": {"filters": ["category", "type"], "location": "point"},
+    "water_sources": {"filters": ["type", "accessibility", "quality_status"], "location": "point"},
+    "water_alerts": {"filters": ["alert_type", "severity"], "location": "coverage"},
+    "quality_reports": {"filters": ["water_source_id"], "location": None},
+}
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "geojson": "application/geo+json"}
+EXPORT_PROJECTION = {"_id": 0, "geo": 0, "coverage_cells": 0, "fanout": 0, "quality_stats": 0, "distance_km": 0}
+EXPORT_BATCH_SIZE = 500
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+def json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def geojson_feature(doc: dict) -> dict:
+    properties = {k: v for k, v in doc.items() if k != "location"}
+    return {"type": "Feature", "geometry": geo_point(doc["location"]), "properties": properties}
+
+async def stream_export(cursor, format: str, covering: Optional[Tuple[float, float]] = None) -> AsyncIterator[bytes]:
+    """Serialize documents from cursor as NDJSON lines or GeoJSON features, in chunks"""
+    if format == "geojson":
+        yield b'{"type":"FeatureCollection","features":[\n'
+    
+    buffer, size, first = [], 0, True
+    async for doc in cursor:
+        if covering and not alerts_covering([doc], *covering):
+            continue
+        if format == "geojson":
+            line = ("" if first else ",") + json.dumps(geojson_feature(doc), default=json_default) + "\n"
+        else:
+            line = json.dumps(doc, default=json_default) + "\n"
+        buffer.append(line)
+        size += len(line)
+        # Flush the first document right away so clients see bytes early
+        if first or size >= EXPORT_CHUNK_BYTES:
+            yield "".join(buffer).encode()
+            buffer, size = [], 0
+        first = False
+    
+    if buffer:
+        yield "".join(buffer).encode()
+    if format == "geojson":
+        yield b"]}\n"
+
+@api_router.get("/export/{collection}")
+async def export_collection(
+    collection: str,
+    format: str = "ndjson",
+    category: Optional[str] = None,
+    type: Optional[str] = None,
+    accessibility: Optional[str] = None,
+    quality_status: Optional[str] = None,
+    alert_type: Optional[str] = None,
+    severity: Optional[str] = None,
+    water_source_id: Optional[str] = None,
+    active_only: bool = True,
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    radius: Optional[float] = 10.0,  # km, resources and water sources only
+    current_user: Principal = Depends(get_current_user)
+):
+    """Stream a collection as NDJSON or a GeoJSON FeatureCollection"""
+    spec = EXPORT_COLLECTIONS.get(collection)
+    if not spec:
+        raise HTTPException(status_code=404, detail=f"Unknown export collection: {collection}")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    if format == "geojson" and not spec["location"]:
+        raise HTTPException(status_code=400, detail=f"{collection} has no location and cannot be exported as geojson")
+    
+    filters = {
+        "category": category, "type": type, "accessibility": accessibility, "quality_status": quality_status,
+        "alert_type": alert_type, "severity": severity, "water_source_id": water_source_id
+    }
+    filters = {k: v for k, v in filters.items() if v is not None}
+    unsupported = sorted(set(filters) - set(spec["filters"]))
+    if unsupported:
+        raise HTTPException(status_code=400, detail=f"Unsupported filters for {collection}: {', '.join(unsupported)}")
+    
+    filter_query = dict(filters)
+    if collection in ("resources", "water_sources"):
+        filter_query["is_active"] = True
+    elif collection == "water_alerts" and active_only:
+        filter_query["active"] = True
+        filter_query["$or"] = [
+            {"expires_at": {"$gte": datetime.utcnow()}},
+            {"expires_at": None}
+        ]
+    
+    covering = None
+    if lat is not None and lng is not None:
+        if spec["location"] == "point":
+            filter_query["geo"] = {"$geoWithin": {"$centerSphere": [[lng, lat], radius / EARTH_RADIUS_KM]}}
+        elif spec["location"] == "coverage":
+            filter_query["coverage_cells"] = {"$in": point_coverage_cells(lat, lng)}
+            covering = (lat, lng)
+        else:
+            raise HTTPException(status_code=400, detail=f"{collection} cannot be filtered by location")
+    
+    cursor = db[collection].find(filter_query, EXPORT_PROJECTION).batch_size(EXPORT_BATCH_SIZE)
+    extension = "geojson" if format == "geojson" else "ndjson"
+    return StreamingResponse(
+        stream_export(cursor, format, covering),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{collection}.{extension}"'}
+    )
+
+# Live event stream endpoints
+def parse_stream_filter(values: Any, allowed: Optional[Tuple[str, ...]], name: str) -> Optional[Tuple[str, ...]]:
+    """A list or comma-separated string of names, checked against `allowed` when given"""
+    if values is None or values == "":
+        return None
+    if isinstance(values, str):
+        values = values.split(",")
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail=f"{name} must be a list or comma-separated string")
+    names = tuple(dict.fromkeys(str(value).strip() for value in values if str(value).strip()))
+    unknown = [value for value in names if allowed and value not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown {name}: {', '.join(unknown)}. Available: {', '.join(allowed)}")
+    return names or None
+
+def parse_subscription(lat: Any, lng: Any, radius: Any, topics: Any, categories: Any) -> Dict[str, Any]:
+    try:
+        lat, lng, radius = float(lat), float(lng), float(radius if radius is not None else 10.0)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="lat, lng and radius must be numbers")
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180) or radius <= 0:
+        raise HTTPException(status_code=400, detail="lat/lng out of range or radius not positive")
+    return {
+        "lat": lat,
+        "lng": lng,
+        "radius_km": radius,
+        "topics": parse_stream_filter(topics, STREAM_TOPICS, "topics") or STREAM_TOPICS,
+        "categories": parse_stream_filter(categories, tuple(RESOURCE_CATEGORIES), "categories"),
+    }
+
+def stream_message(event: dict) -> str:
+    return json.dumps({"topic": event["topic"], "type": event["type"], "data": event.get("data")}, default=json_default)
+
+async def sse_stream(subscription: Subscription) -> AsyncIterator[str]:
+    try:
+        yield f"event: subscribed\ndata: {json.dumps({'radius_km': subscription.radius_km})}\n\n"
+        while True:
+            event = await subscription.next_event(STREAM_KEEPALIVE_SECONDS)
+            yield f"data: {stream_message(event)}\n\n" if event else ": keepalive\n\n"
+    finally:
+        stream_hub.unsubscribe(subscription)
+
+@api_router.get("/stream")
+async def stream_events(
+    lat: float,
+    lng: float,
+    radius: float = 10.0,  # km, capped at STREAM_MAX_RADIUS_KM
+    topics: Optional[str] = None,  # resources,water_sources,water_alerts
+    categories: Optional[str] = None,  # resource categories
+    token: Optional[str] = None,  # for EventSource, which cannot send headers
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """Server-sent events for new resources, water sources and alerts near a point"""
+    await principal_for_token(credentials.credentials if credentials else token or "")
+    subscription = stream_hub.subscribe(**parse_subscription(lat, lng, radius, topics, categories))
+    return StreamingResponse(
+        sse_stream(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def receive_subscriptions(websocket: WebSocket, subscription: Subscription):
+    """Apply each {lat, lng, radius, topics, categories} message to the subscription"""
+    while True:
+        message = await websocket.receive_json()
+        try:
+            if not isinstance(message, dict):
+                raise HTTPException(status_code=400, detail="Expected a subscription object")
+            stream_hub.update(subscription, **parse_subscription(
+                message.get("lat"), message.get("lng"), message.get("radius"), message.get("topics"), message.get("categories")
+            ))
+            await websocket.send_json({"type": "subscribed", "radius_km": subscription.radius_km})
+        except HTTPException as e:
+            await websocket.send_json({"type": "error", "error": e.detail})
+
+@api_router.websocket("/stream")
+async def stream_websocket(websocket: WebSocket, token: Optional[str] = None):
+    """Same events as GET /stream; send a new subscription object at any time to move the area"""
+    try:
+        await principal_for_token(token or "")
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    
+    # The first message sets the area; until then nothing matches
+    subscription = None
+    while subscription is None:
+        try:
+            message = await websocket.receive_json()
+            if not isinstance(message, dict):
+                raise HTTPException(status_code=400, detail="Expected a subscription object")
+            subscription = stream_hub.subscribe(**parse_subscription(
+                message.get("lat"), message.get("lng"), message.get("radius"), message.get("topics"), message.get("categories")
+            ))
+        except HTTPException as e:
+            await websocket.send_json({"type": "error", "error": e.detail})
+        except WebSocketDisconnect:
+            return
+    await websocket.send_json({"type": "subscribed", "radius_km": subscription.radius_km})
+    
+    receiver = asyncio.create_task(receive_subscriptions(websocket, subscription))
+    try:
+        while True:
+            getter = asyncio.create_task(subscription.next_event())
+            done, _ = await asyncio.wait({receiver, getter}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                getter.cancel()
+                break
+            await websocket.send_text(stream_message(getter.result()))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        stream_hub.unsubscribe(subscription)
+
+# Operational metrics
+@api_router.get("/metrics")
+async def get_metrics(api_key_valid: bool = Depends(verify_mcp_api_key)):
+    """In-process cache and queue counters for this worker"""
+    return {
+        "principal_cache": principal_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "community_stats": community_stats.stats(),
+        "geocoder": geocoder.stats(),
+        "guide_usage": guide_usage.stats(),
+        "guide_cache": guide_cache.stats(),
+        "resource_search": resource_search.stats(),
+        "water_source_search": water_source_search.stats(),
+        "stream": {**stream_hub.stats(), "bus": stream_bus.stats()},
+        "alert_fanout": alert_fanout.stats()
+    }
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -1136,6 +4212,7 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, FACETS_HEADER, "ETag"],
 )
 
 # Configure logging
@@ -1145,6 +4222,64 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def bootstrap_database():
+    check_quality_half_life(datetime.utcnow())
+    if INDEX_BOOTSTRAP == "apply":
+        await backfill_spatial_fields()
+        await backfill_message_threads()
+        await backfill_quality_scores()
+    if INDEX_BOOTSTRAP != "off":
+        await bootstrap_indexes(INDEX_BOOTSTRAP)
+    await ensure_usage_rollups()
+    community_stats.start()
+    geocoder.start()
+    guide_usage.start()
+    guide_cache.start()
+    resource_search.start()
+    water_source_search.start()
+    stream_bus.start()
+    alert_fanout.start()
+    await load_gazetteer()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    community_stats.stop()
+    await geocoder.close()
+    await guide_usage.close()
+    guide_cache.stop()
+    resource_search.stop()
+    water_source_search.stop()
+    stream_bus.stop()
+    alert_fanout.stop()
     client.close()
+    password_hasher.shutdown()
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    
+    parser = argparse.ArgumentParser(description="GlobalHaven database index maintenance")
+    parser.add_argument("--check", action="store_true", help="report index drift and exit 1 if any required index is missing")
+    parser.add_argument("--rebuild-rollups", action="store_true", help="recompute water usage rollups from water_usage")
+    args = parser.parse_args()
+    
+    async def run_index_maintenance():
+        try:
+            if args.check:
+                report = await bootstrap_indexes("check")
+            elif args.rebuild_rollups:
+                await rebuild_usage_rollups()
+                report = {"water_usage_rollups": "rebuilt"}
+            else:
+                await backfill_spatial_fields()
+                report = await bootstrap_indexes("apply")
+        except RuntimeError as e:
+            logger.error(str(e))
+            return 1
+        finally:
+            client.close()
+        print(json.dumps(report, indent=2))
+        return 0
+    
+    sys.exit(asyncio.run(run_index_maintenance()))
@@ -1,5 +1,6 @@
 import requests
 import sys
+import json
 import uuid
 from datetime import datetime, timedelta
 import time
@@ -152,6 +153,167 @@ class GlobalHavenAPITester:
         
         return success
 
+    def test_get_resources_nearby(self, lat=37.7749, lng=-122.4194, radius=5.0):
+        """Test radius search returns nearest-first results with distance_km"""
+        success, response = self.run_test(
+            "Get Resources Nearby",
+            "GET",
+            "resources",
+            200,
+            params={"lat": lat, "lng": lng, "radius": radius}
+        )
+        
+        if not success:
+            return False
+        distances = [resource.get('distance_km') for resource in response]
+        if any(d is None or d > radius for d in distances) or distances != sorted(distances):
+            print(f"❌ Unexpected distances: {distances}")
+            return False
+        return True
+
+    def test_get_resources_paginated(self):
+        """Test that following X-Next-Cursor walks the list without repeats"""
+        headers = {'Authorization': f'Bearer {self.token}'}
+        self.tests_run += 1
+        print("\n🔍 Testing Get Resources Paginated...")
+        
+        try:
+            seen_ids = []
+            params = {"limit": 1}
+            for _ in range(5):
+                response = requests.get(f"{self.api_url}/resources", headers=headers, params=params)
+                if response.status_code != 200:
+                    print(f"❌ Failed - Expected 200, got {response.status_code}")
+                    return False
+                seen_ids += [resource['id'] for resource in response.json()]
+                next_cursor = response.headers.get('X-Next-Cursor')
+                if not next_cursor:
+                    break
+                params["cursor"] = next_cursor
+            
+            if len(seen_ids) != len(set(seen_ids)):
+                print(f"❌ Failed - Duplicate ids across pages: {seen_ids}")
+                return False
+            self.tests_passed += 1
+            print(f"✅ Passed - {len(seen_ids)} resources over {len(seen_ids)} pages")
+            return True
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+
+    def test_get_resources_sparse_fields(self):
+        """Test that fields= trims resources to the requested fields and rejects unknown ones"""
+        fields = ["id", "title", "category", "type", "location"]
+        success, response = self.run_test(
+            "Get Resources Sparse Fields",
+            "GET",
+            "resources",
+            200,
+            params={"fields": ",".join(fields)}
+        )
+        if not success or not all(set(resource) == set(fields) for resource in response):
+            return False
+        
+        success, _ = self.run_test(
+            "Get Resources Unknown Field",
+            "GET",
+            "resources",
+            400,
+            params={"fields": "title,password_hash"}
+        )
+        return success
+
+    def test_search_resources(self):
+        """Test ranked text search with typeahead prefix matching"""
+        success, response = self.run_test(
+            "Search Resources",
+            "GET",
+            "resources",
+            200,
+            params={"q": "test reso"}
+        )
+        if not success:
+            return False
+        if not any(resource.get("id") == self.test_resource_id for resource in response):
+            print("❌ Failed - Expected the test resource to match 'test reso'")
+            return False
+        return True
+
+    def test_get_resources_facets(self):
+        """Test that facets= returns per-value counts in the X-Facets header"""
+        headers = {'Authorization': f'Bearer {self.token}'}
+        self.tests_run += 1
+        print("\n🔍 Testing Get Resources Facets...")
+        
+        try:
+            response = requests.get(f"{self.api_url}/resources", headers=headers, params={"facets": "category,type", "limit": 1})
+            if response.status_code != 200 or 'X-Facets' not in response.headers:
+                print(f"❌ Failed - Expected 200 with X-Facets, got {response.status_code}")
+                return False
+            facets = json.loads(response.headers['X-Facets'])
+            if set(facets) != {"category", "type"} or not facets["category"]:
+                print(f"❌ Failed - Unexpected facet counts: {facets}")
+                return False
+            
+            response = requests.get(f"{self.api_url}/resources", headers=headers, params={"facets": "owner"})
+            if response.status_code != 400:
+                print(f"❌ Failed - Expected 400 for an unknown facet, got {response.status_code}")
+                return False
+            
+            self.tests_passed += 1
+            print(f"✅ Passed - Facets: {facets}")
+            return True
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+
+    def test_get_resources_not_modified(self):
+        """Test that repeating a list request with its ETag returns 304 with no body"""
+        headers = {'Authorization': f'Bearer {self.token}'}
+        self.tests_run += 1
+        print("\n🔍 Testing Get Resources Not Modified...")
+        
+        try:
+            response = requests.get(f"{self.api_url}/resources", headers=headers)
+            etag = response.headers.get('ETag')
+            if response.status_code != 200 or not etag:
+                print(f"❌ Failed - Expected 200 with an ETag, got {response.status_code} / {etag}")
+                return False
+            
+            response = requests.get(f"{self.api_url}/resources", headers={**headers, 'If-None-Match': etag})
+            if response.status_code != 304 or response.content:
+                print(f"❌ Failed - Expected empty 304, got {response.status_code}")
+                return False
+            self.tests_passed += 1
+            print("✅ Passed - 304 Not Modified")
+            return True
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+
+    def test_export_collection(self, collection="resources", format="ndjson"):
+        """Test streaming export of a collection"""
+        headers = {'Authorization': f'Bearer {self.token}'}
+        self.tests_run += 1
+        print(f"\n🔍 Testing Export {collection} ({format})...")
+        
+        try:
+            response = requests.get(f"{self.api_url}/export/{collection}", headers=headers, params={"format": format}, stream=True)
+            if response.status_code != 200:
+                print(f"❌ Failed - Expected 200, got {response.status_code}")
+                return False
+            body = b"".join(response.iter_content(chunk_size=None)).decode()
+            if format == "geojson":
+                count = len(json.loads(body)["features"])
+            else:
+                count = len([json.loads(line) for line in body.splitlines() if line])
+            self.tests_passed += 1
+            print(f"✅ Passed - {count} records")
+            return True
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+
     def test_get_resource_by_id(self):
         """Test getting a specific resource by ID"""
         if not self.test_resource_id:
@@ -362,6 +524,27 @@ class GlobalHavenAPITester:
         
         return success
 
+    def test_get_water_source_quality(self):
+        """Test the quality score and bucketed report history of a water source"""
+        if not self.test_water_source_id:
+            print("❌ No water source ID available for testing")
+            return False
+        
+        success, response = self.run_test(
+            "Get Water Source Quality",
+            "GET",
+            f"water/sources/{self.test_water_source_id}/quality",
+            200,
+            params={"bucket": "day", "periods": 7}
+        )
+        
+        if not success:
+            return False
+        if response.get('quality_score') != 1.0 or 'visual' not in response.get('by_test_type', {}):
+            print(f"❌ Failed - Unexpected quality summary: {response.get('quality_score')}")
+            return False
+        return sum(bucket['reports'] for bucket in response.get('history', [])) >= 1
+
     def test_create_infrastructure_plan(self):
         """Test creating an infrastructure plan"""
         test_data = {
@@ -518,6 +701,18 @@ class GlobalHavenAPITester:
         
         return success
 
+    def test_get_water_alerts_covering(self, lat=37.78, lng=-122.41):
+        """Test that a location inside the test alert's radius returns that alert"""
+        success, response = self.run_test(
+            "Get Water Alerts Covering Location",
+            "GET",
+            "water/alerts",
+            200,
+            params={"lat": lat, "lng": lng}
+        )
+        
+        return success and any(alert.get('id') == self.test_water_alert_id for alert in response)
+
     def test_verify_water_alert(self):
         """Test verifying a water alert"""
         if not self.test_water_alert_id:
@@ -555,6 +750,26 @@ class GlobalHavenAPITester:
         
         return success
 
+    def test_log_water_usage_batch(self):
+        """Test logging several days of water usage in one batch"""
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        test_data = {
+            "items": [
+                {"date": (today - timedelta(days=offset)).isoformat(), "drinking_liters": 2.0, "cooking_liters": 3.0}
+                for offset in range(1, 4)
+            ]
+        }
+        
+        success, response = self.run_test(
+            "Log Water Usage Batch",
+            "POST",
+            "water/usage/batch",
+            200,
+            data=test_data
+        )
+        
+        return success and all(result.get('status') in ('inserted', 'updated') for result in response.get('results', []))
+
     def test_get_water_usage(self):
         """Test getting water usage records"""
         success, _ = self.run_test(
@@ -677,6 +892,39 @@ class GlobalHavenAPITester:
         
         return success and 'water_source' in response
 
+    def test_mcp_bulk_create_water_sources(self):
+        """Test MCP bulk water source creation"""
+        if not self.user_id:
+            print("❌ No user ID available for testing")
+            return False
+        
+        data = {
+            "action": "bulk_create",
+            "data": {
+                "user_id": self.user_id,
+                "items": [
+                    {
+                        "name": f"MCP Bulk Water Source {i}",
+                        "type": "well",
+                        "location": {"lat": 37.7749 + i * 0.01, "lng": -122.4194},
+                        "accessibility": "public"
+                    }
+                    for i in range(3)
+                ] + [{"name": "Missing type and location"}]
+            }
+        }
+        
+        success, response = self.run_test(
+            "MCP Bulk Create Water Sources",
+            "POST",
+            "mcp/bulk_create_water_sources",
+            200,
+            data=data,
+            auth_type="mcp"
+        )
+        
+        return success and response.get('inserted') == 3 and response.get('error') == 1
+
     def test_mcp_create_water_alert(self):
         """Test MCP water alert creation"""
         if not self.user_id:
@@ -791,6 +1039,40 @@ class GlobalHavenAPITester:
         
         return success and 'resource' in response
 
+    def test_mcp_bulk_create_resources(self):
+        """Test MCP bulk resource creation"""
+        if not self.user_id:
+            print("❌ No user ID available for testing")
+            return False
+        
+        data = {
+            "action": "bulk_create",
+            "data": {
+                "user_id": self.user_id,
+                "items": [
+                    {
+                        "title": f"MCP Bulk Resource {i}",
+                        "description": "This resource was created via MCP bulk creation",
+                        "category": "food",
+                        "type": "available",
+                        "location": {"lat": 37.7749, "lng": -122.4194 + i * 0.01}
+                    }
+                    for i in range(3)
+                ]
+            }
+        }
+        
+        success, response = self.run_test(
+            "MCP Bulk Create Resources",
+            "POST",
+            "mcp/bulk_create_resources",
+            200,
+            data=data,
+            auth_type="mcp"
+        )
+        
+        return success and response.get('inserted') == 3
+
     def test_mcp_get_user_stats(self):
         """Test MCP get user stats endpoint"""
         data = {
@@ -808,6 +1090,122 @@ class GlobalHavenAPITester:
         
         return success and 'stats' in response and 'water_module' in response['stats']
 
+    def test_mcp_batch(self):
+        """Test running several MCP actions in one batch with per-action errors"""
+        data = {
+            "action": "batch",
+            "data": {
+                "actions": [
+                    {"action": "search_resources", "data": {"category": "food", "limit": 5}},
+                    {"action": "search_water_sources", "data": {"limit": 5}},
+                    {"action": "get_water_alerts"},
+                    {"action": "get_user_stats"},
+                    {"action": "no_such_action"}
+                ]
+            }
+        }
+        
+        success, response = self.run_test(
+            "MCP Batch",
+            "POST",
+            "mcp/batch",
+            200,
+            data=data,
+            auth_type="mcp"
+        )
+        
+        if not success:
+            return False
+        statuses = [result.get('status') for result in response.get('results', [])]
+        if statuses != ["ok", "ok", "ok", "ok", "error"]:
+            print(f"❌ Failed - Unexpected batch statuses: {statuses}")
+            return False
+        return True
+
+    def test_stream_subscribe(self):
+        """Test that the event stream accepts a subscription and announces it"""
+        self.tests_run += 1
+        print("\n🔍 Testing Stream Subscribe...")
+        
+        try:
+            params = {"lat": 37.7749, "lng": -122.4194, "radius": 5, "token": self.token}
+            with requests.get(f"{self.api_url}/stream", params=params, stream=True, timeout=10) as response:
+                if response.status_code != 200:
+                    print(f"❌ Failed - Expected 200, got {response.status_code}")
+                    return False
+                first_line = next(response.iter_lines(decode_unicode=True))
+            if first_line != "event: subscribed":
+                print(f"❌ Failed - Unexpected first line: {first_line}")
+                return False
+            self.tests_passed += 1
+            print("✅ Passed - Stream subscribed")
+            return True
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+
+    def test_message_threads(self):
+        """Test that sending a message updates its thread summary and marking the thread read clears it"""
+        if not self.user_id:
+            print("❌ No user ID available for testing")
+            return False
+        
+        success, message = self.run_test(
+            "Send Message",
+            "POST",
+            "messages",
+            200,
+            data={"receiver_id": self.user_id, "content": "Note to self"}
+        )
+        if not success or not message.get('thread_id'):
+            return False
+        
+        success, threads = self.run_test("Get Message Threads", "GET", "messages/threads", 200, params={"limit": 5})
+        thread = next((t for t in threads if t['id'] == message['thread_id']), None) if success else None
+        if not thread or thread['last_message']['id'] != message['id'] or thread['unread'].get(self.user_id, 0) < 1:
+            print("❌ Failed - Thread summary not updated")
+            return False
+        
+        success, history = self.run_test("Get Thread Messages", "GET", f"messages/threads/{thread['id']}", 200)
+        if not success or history[0]['id'] != message['id']:
+            return False
+        
+        success, response = self.run_test("Mark Thread Read", "PUT", f"messages/threads/{thread['id']}/read", 200)
+        return success and response.get('marked', 0) >= 1
+
+    def test_notifications(self):
+        """Test reading the notification inbox and marking it read"""
+        success, response = self.run_test(
+            "Get Notifications",
+            "GET",
+            "notifications",
+            200,
+            params={"unread_only": "true", "limit": 10}
+        )
+        if not success or not isinstance(response, list):
+            return False
+        
+        success, response = self.run_test(
+            "Mark Notifications Read",
+            "PUT",
+            "notifications/read",
+            200,
+            data={}
+        )
+        return success and 'marked' in response
+
+    def test_get_metrics(self):
+        """Test operational metrics endpoint"""
+        success, response = self.run_test(
+            "Get Metrics",
+            "GET",
+            "metrics",
+            200,
+            auth_type="mcp"
+        )
+        
+        return success and 'principal_cache' in response
+
 def main():
     # Setup
     tester = GlobalHavenAPITester()
@@ -843,6 +1241,12 @@ def main():
     tester.test_get_resources()
     tester.test_get_resources(category="food")
     tester.test_get_resources(type="available")
+    tester.test_get_resources_nearby()
+    tester.test_get_resources_paginated()
+    tester.test_get_resources_sparse_fields()
+    tester.test_search_resources()
+    tester.test_get_resources_facets()
+    tester.test_get_resources_not_modified()
     tester.test_get_resource_by_id()
     tester.test_update_resource()
 
@@ -864,6 +1268,7 @@ def main():
     tester.test_get_quality_reports()
     if tester.test_water_source_id:
         tester.test_get_quality_reports(water_source_id=tester.test_water_source_id)
+        tester.test_get_water_source_quality()
 
     # Test Infrastructure Plans
     tester.test_create_infrastructure_plan()
@@ -881,10 +1286,12 @@ def main():
     tester.test_create_water_alert()
     tester.test_get_water_alerts()
     tester.test_get_water_alerts(alert_type="contamination")
+    tester.test_get_water_alerts_covering()
     tester.test_verify_water_alert()
 
     # Test Water Usage
     tester.test_log_water_usage()
+    tester.test_log_water_usage_batch()
     tester.test_get_water_usage()
     tester.test_get_water_usage_stats()
 
@@ -894,17 +1301,36 @@ def main():
     tester.test_mcp_get_water_alerts()
     tester.test_mcp_get_purification_guides()
     tester.test_mcp_create_water_source()
+    tester.test_mcp_bulk_create_water_sources()
     tester.test_mcp_create_water_alert()
     tester.test_mcp_log_water_usage()
 
     # Test other MCP endpoints
     tester.test_mcp_search_resources()
     tester.test_mcp_create_resource()
+    tester.test_mcp_bulk_create_resources()
     tester.test_mcp_get_user_stats()
+    tester.test_mcp_batch()
+
+    # Test streaming exports
+    tester.test_export_collection("resources")
+    tester.test_export_collection("water_sources", format="geojson")
+    tester.test_export_collection("water_alerts")
+    tester.test_export_collection("quality_reports")
 
     # Test geocoding
     tester.test_geocode("San Francisco, CA")
 
+    # Test messaging
+    tester.test_message_threads()
+    tester.test_notifications()
+
+    # Test live event stream
+    tester.test_stream_subscribe()
+
+    # Test operational metrics
+    tester.test_get_metrics()
+
     # Test resource deletion
     tester.test_delete_resource()
 
@@ -67,6 +67,36 @@ function App() {
     }
   }, [token, selectedCategory, selectedType, currentView]);
 
+  // Live updates for the area around the user instead of re-fetching lists
+  useEffect(() => {
+    if (!token || !userLocation) return;
+    const params = new URLSearchParams({
+      lat: userLocation.lat,
+      lng: userLocation.lng,
+      radius: 50,
+      token
+    });
+    const stream = new EventSource(`${API}/stream?${params}`);
+    stream.onmessage = (message) => {
+      const event = JSON.parse(message.data);
+      if (event.type === 'lagged') {
+        loadResources();
+        if (currentView === 'water') loadWaterData();
+      } else if (event.topic === 'resources') {
+        const resource = event.data;
+        if ((selectedCategory === 'all' || resource.category === selectedCategory) &&
+            (selectedType === 'all' || resource.type === selectedType)) {
+          setResources((current) => [resource, ...current.filter((r) => r.id !== resource.id)]);
+        }
+      } else if (event.topic === 'water_alerts') {
+        setWaterAlerts((current) => [event.data, ...current.filter((a) => a.id !== event.data.id)]);
+      } else if (event.topic === 'water_sources') {
+        setWaterSources((current) => [event.data, ...current.filter((s) => s.id !== event.data.id)]);
+      }
+    };
+    return () => stream.close();
+  }, [token, userLocation, selectedCategory, selectedType, currentView]);
+
   const loadResources = async () => {
     try {
       const params = {};
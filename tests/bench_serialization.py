@@ -0,0 +1,64 @@
+"""Time rendering a 1000-item /api/resources page with each FAST_SERIALIZATION mode.
+
+    python tests/bench_serialization.py [items] [rounds]
+"""
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "bench")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+import server  # noqa: E402
+from server import Resource, list_response  # noqa: E402
+
+
+def stored_resources(count):
+    now = datetime.utcnow()
+    return [
+        {
+            "id": str(uuid.uuid4()), "title": f"Resource {i}", "description": "Surplus maize flour, 10kg bags",
+            "category": "food", "type": "available", "user_id": str(uuid.uuid4()),
+            "location": {"lat": -1.28 + i * 1e-4, "lng": 36.82}, "address": "Kibera, Nairobi", "quantity": "10 bags",
+            "contact_info": None, "expiry_date": None, "is_active": True, "created_at": now, "updated_at": now,
+        }
+        for i in range(count)
+    ]
+
+
+loop = asyncio.new_event_loop()
+
+
+def render(mode, docs, field):
+    """Everything FastAPI does between the handler fetching docs and the response body"""
+    server.FAST_SERIALIZATION = mode
+    content = list_response(Resource, docs, None, JSONResponse(None))
+    if isinstance(content, JSONResponse):
+        return content.body
+    return JSONResponse(loop.run_until_complete(serialize_response(field=field, response_content=content))).body
+
+
+def main(items=1000, rounds=20):
+    route = next(r for r in server.app.routes if getattr(r, "path", None) == "/api/resources" and "GET" in r.methods)
+    docs = stored_resources(items)
+    baseline = None
+    for mode in ("off", "validate", "trusted"):
+        render(mode, docs, route.response_field)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            render(mode, docs, route.response_field)
+        elapsed = (time.perf_counter() - start) / rounds
+        baseline = baseline or elapsed
+        print(f"{mode:>8}: {elapsed * 1000:7.2f} ms per {items}-item page  ({baseline / elapsed:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
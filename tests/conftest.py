@@ -0,0 +1,271 @@
+"""Shared setup for the backend unit tests: import path, settings, and in-memory Motor fakes"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+from pymongo import InsertOne  # noqa: E402
+from pymongo.errors import BulkWriteError, DuplicateKeyError  # noqa: E402
+
+from server import EARTH_RADIUS_KM, haversine_km  # noqa: E402
+
+
+def get_path(doc, path):
+    for part in path.split("."):
+        doc = doc.get(part) if isinstance(doc, dict) else None
+    return doc
+
+
+def set_path(doc, path, value):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def matches(doc, query):
+    """The query operators the code under test uses"""
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, clause) for clause in condition):
+                return False
+            continue
+        value = get_path(doc, key)
+        if isinstance(condition, dict) and "$geoWithin" in condition:
+            (lng, lat), radius = condition["$geoWithin"]["$centerSphere"]
+            if value is None:
+                return False
+            point_lng, point_lat = value["coordinates"]
+            if haversine_km(lat, lng, point_lat, point_lng) > radius * EARTH_RADIUS_KM:
+                return False
+        elif isinstance(condition, dict) and "$gt" in condition:
+            if value is None or not value > condition["$gt"]:
+                return False
+        elif isinstance(condition, dict) and "$in" in condition:
+            if value not in condition["$in"]:
+                return False
+        elif isinstance(condition, dict) and "$exists" in condition:
+            if (value is not None) != condition["$exists"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def evaluate(expression, doc):
+    """The aggregation expressions used in $group keys and pipeline updates"""
+    if isinstance(expression, str) and expression.startswith("$"):
+        return get_path(doc, expression[1:])
+    if isinstance(expression, dict):
+        (operator, args), = expression.items()
+        values = [evaluate(arg, doc) for arg in args]
+        if operator == "$max":
+            return max(values)
+        if operator == "$subtract":
+            return values[0] - values[1]
+        if operator == "$ifNull":
+            return values[0] if values[0] is not None else values[1]
+        raise NotImplementedError(operator)
+    return expression
+
+
+def apply_update(doc, update, inserted=False):
+    """Apply an update document or pipeline in place, the way MongoDB would"""
+    if isinstance(update, list):
+        for stage in update:
+            for field, expression in stage["$set"].items():
+                set_path(doc, field, evaluate(expression, doc))
+        return
+    if inserted:
+        for field, value in update.get("$setOnInsert", {}).items():
+            set_path(doc, field, value)
+    for field, value in update.get("$set", {}).items():
+        set_path(doc, field, value)
+    for field, amount in update.get("$inc", {}).items():
+        set_path(doc, field, (get_path(doc, field) or 0) + amount)
+    for field, value in update.get("$max", {}).items():
+        current = get_path(doc, field)
+        set_path(doc, field, value if current is None else max(current, value))
+
+
+def run_pipeline(docs, pipeline):
+    """The aggregation stages the server uses. $geoNear orders by distance only,
+    so equal distances keep insertion order, which is as arbitrary as Mongo's"""
+    docs = [dict(doc) for doc in docs]
+    for stage in pipeline:
+        (operator, spec), = stage.items()
+        if operator == "$geoNear":
+            lng, lat = spec["near"]["coordinates"]
+            located = []
+            for doc in docs:
+                if "geo" in doc and matches(doc, spec.get("query", {})):
+                    point_lng, point_lat = doc["geo"]["coordinates"]
+                    distance_km = haversine_km(lat, lng, point_lat, point_lng)
+                    if spec.get("minDistance", 0) <= distance_km * 1000 <= spec["maxDistance"]:
+                        located.append({**doc, spec["distanceField"]: distance_km})
+            docs = sorted(located, key=lambda doc: doc[spec["distanceField"]])
+        elif operator == "$match":
+            docs = [doc for doc in docs if matches(doc, spec)]
+        elif operator == "$sort":
+            for field, direction in reversed(list(spec.items())):
+                docs.sort(key=lambda doc: doc[field], reverse=direction < 0)
+        elif operator == "$limit":
+            docs = docs[:spec]
+        elif operator == "$project":
+            docs = [{key: value for key, value in doc.items() if spec.get(key, 1)} for doc in docs]
+        elif operator == "$group":
+            counts = {}
+            for doc in docs:
+                key = evaluate(spec["_id"], doc)
+                counts[key] = counts.get(key, 0) + 1
+            docs = [{"_id": key, "count": count} for key, count in counts.items()]
+        elif operator == "$facet":
+            docs = [{name: run_pipeline(docs, branch) for name, branch in spec.items()}]
+        else:
+            raise NotImplementedError(operator)
+    return docs
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __aiter__(self):
+        self._iter = iter(self.docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length):
+        return self.docs[:length] if length else list(self.docs)
+
+
+class FakeCollection:
+    """In-memory documents behind the subset of the Motor collection API the server uses.
+
+    Records finds, aggregate pipelines, bulk_write batches and update_one calls.
+    Set `results` to answer aggregate() with canned output, `fail_next` to make
+    the next bulk_write raise, and `interleave` to yield to the event loop in
+    every call so concurrent callers interleave like they would against Mongo.
+    """
+
+    def __init__(self, docs=(), results=None):
+        self.docs = [dict(doc) for doc in docs]
+        self.results = results
+        self.fail_next = None
+        self.interleave = False
+        self.finds = 0
+        self.pipelines = []
+        self.batches = []
+        self.updates = []
+
+    async def _tick(self):
+        if self.interleave:
+            await asyncio.sleep(0)
+
+    def _first(self, query, sort=None):
+        docs = [doc for doc in self.docs if matches(doc, query)]
+        for field, direction in reversed(sort or []):
+            docs.sort(key=lambda doc: doc[field], reverse=direction < 0)
+        return docs[0] if docs else None
+
+    def _upsert(self, query, update):
+        doc = {key: value for key, value in query.items() if not key.startswith("$") and not isinstance(value, dict)}
+        apply_update(doc, update, inserted=True)
+        self.docs.append(doc)
+        return doc
+
+    def find(self, query, projection=None):
+        self.finds += 1
+        return FakeCursor([dict(doc) for doc in self.docs if matches(doc, query)])
+
+    async def find_one(self, query, projection=None, sort=None):
+        await self._tick()
+        doc = self._first(query, sort)
+        return dict(doc) if doc is not None else None
+
+    async def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=False):
+        await self._tick()
+        doc = self._first(query)
+        if doc is None:
+            if not upsert:
+                return None
+            doc = self._upsert(query, update)
+            return dict(doc) if return_document else None
+        before = dict(doc)
+        apply_update(doc, update)
+        return dict(doc) if return_document else before
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        if self.results is not None:
+            return FakeCursor(self.results)
+        return FakeCursor(run_pipeline(self.docs, pipeline))
+
+    async def insert_one(self, document):
+        await self._tick()
+        if any(doc.get("id") == document.get("id") for doc in self.docs if "id" in document):
+            raise DuplicateKeyError("duplicate key")
+        self.docs.append(dict(document))
+
+    async def update_one(self, query, update, upsert=False):
+        await self._tick()
+        self.updates.append((query, update))
+        doc = self._first(query)
+        if doc is not None:
+            apply_update(doc, update)
+        elif upsert:
+            self._upsert(query, update)
+
+    async def replace_one(self, query, replacement, upsert=False):
+        await self._tick()
+        self.docs = [doc for doc in self.docs if not matches(doc, query)] + [dict(replacement)]
+
+    async def bulk_write(self, operations, ordered=True):
+        await self._tick()
+        self.batches.append(list(operations))
+        if self.fail_next is not None:
+            error, self.fail_next = self.fail_next, None
+            raise error
+        existing = {doc["id"] for doc in self.docs if "id" in doc}
+        errors, inserted = [], 0
+        for index, operation in enumerate(operations):
+            if isinstance(operation, InsertOne):
+                if operation._doc["id"] in existing:
+                    errors.append({"index": index, "code": 11000, "errmsg": "duplicate key"})
+                    continue
+                self.docs.append(operation._doc)
+                existing.add(operation._doc["id"])
+                inserted += 1
+            else:
+                doc = self._first(operation._filter)
+                if doc is not None:
+                    apply_update(doc, operation._doc)
+                elif operation._upsert:
+                    self._upsert(operation._filter, operation._doc)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": inserted})
+
+        class Result:
+            inserted_count = inserted
+        return Result()
+
+
+class FakeDatabase:
+    """Collections by attribute; any collection not passed in starts empty"""
+
+    def __init__(self, **collections):
+        self.__dict__.update(collections)
+
+    def __getattr__(self, name):
+        collection = FakeCollection()
+        setattr(self, name, collection)
+        return collection
@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime
+
+from server import AlertFanout
+
+from .conftest import FakeCollection, FakeDatabase
+
+
+def user(user_id, lat, lng):
+    return {"id": user_id, "is_active": True, "location": {"lat": lat, "lng": lng}, "geo": {"type": "Point", "coordinates": [lng, lat]}}
+
+
+def source(source_id, owner, lat, lng):
+    return {"id": source_id, "added_by": owner, "is_active": True, "geo": {"type": "Point", "coordinates": [lng, lat]}}
+
+
+ALERT = {
+    "id": "a1", "title": "Boil water", "alert_type": "contamination", "severity": "high",
+    "location": {"lat": 0.0, "lng": 0.0}, "radius_km": 10.0, "water_source_ids": ["far-well"],
+    "issued_by": "issuer", "created_at": datetime(2026, 1, 1), "expires_at": None,
+}
+
+
+def make_database():
+    return FakeDatabase(
+        users=FakeCollection([user("issuer", 0.0, 0.0), user("near", 0.05, 0.0), user("far", 1.0, 1.0), user("owner", 2.0, 2.0)]),
+        water_sources=FakeCollection([
+            source("near-well", "near", 0.01, 0.0), source("far-well", "owner", 3.0, 3.0), source("other", "far", 3.0, 3.0)
+        ]),
+    )
+
+
+def test_fan_out_reaches_nearby_users_and_source_owners():
+    database = make_database()
+    fanout = AlertFanout(database, workers=1, batch_size=100)
+    assert asyncio.run(fanout.fan_out(ALERT)) == 2
+
+    inbox = {entry["user_id"]: entry for entry in database.notifications.docs}
+    assert set(inbox) == {"near", "owner"}
+    assert round(inbox["near"]["distance_km"], 1) == 5.6
+    assert inbox["owner"]["distance_km"] is None
+    assert inbox["near"]["water_source_ids"] == ["near-well", "far-well"]
+    assert (inbox["near"]["priority"], inbox["near"]["read"]) == (1, False)
+    assert database.water_alerts.updates == [({"id": "a1"}, {"$set": {"fanout": "done"}})]
+
+
+def test_fan_out_is_batched_and_idempotent():
+    database = make_database()
+    database.users.docs += [user(f"u{i}", 0.0, 0.01 * i) for i in range(5)]
+    fanout = AlertFanout(database, workers=1, batch_size=2)
+    assert asyncio.run(fanout.fan_out(ALERT)) == 7
+    assert [len(batch) for batch in database.notifications.batches] == [2, 2, 2, 1]
+    assert asyncio.run(fanout.fan_out(ALERT)) == 0
+    assert len(database.notifications.docs) == 7
+
+
+def test_severe_alerts_are_fanned_out_first():
+    fanout = AlertFanout(make_database(), workers=1, batch_size=100)
+
+    async def order():
+        for alert_id, severity in [("a", "low"), ("b", "critical"), ("c", "unknown"), ("d", "high"), ("e", "critical")]:
+            fanout.enqueue({"id": alert_id, "severity": severity})
+        return [(await fanout.queue.get())[2]["id"] for _ in range(5)]
+
+    assert asyncio.run(order()) == ["b", "e", "d", "a", "c"]
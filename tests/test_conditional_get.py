@@ -0,0 +1,114 @@
+import asyncio
+from datetime import datetime
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+import server
+from server import Principal, ResourceCreate, TextIndex, WaterAlertCreate, WaterUsageCreate, etag_matches, list_etag, version_scope
+
+from .conftest import FakeCollection, FakeDatabase
+
+USER = Principal(id="u1", username="ana", email="ana@example.org", created_at=datetime(2026, 1, 1))
+
+
+def request(path, query="", if_none_match=None):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": query.encode(), "headers": headers})
+
+
+def versions(**scopes):
+    """collection_versions with {scope: version}"""
+    return FakeCollection([{"_id": scope, "version": version} for scope, version in scopes.items()])
+
+
+def bumped(collection):
+    return [op._filter["_id"] for batch in collection.batches for op in batch]
+
+
+class Untouched:
+    def __getattr__(self, name):
+        raise AssertionError(f"{name} ran on a collection that should not be read")
+
+
+def test_etag_depends_on_version_and_query_but_not_parameter_order():
+    etag = list_etag("resources", 3, request("/api/resources", "category=food&limit=10"))
+    assert etag == list_etag("resources", 3, request("/api/resources", "limit=10&category=food"))
+    assert etag != list_etag("resources", 4, request("/api/resources", "category=food&limit=10"))
+    assert etag != list_etag("resources", 3, request("/api/resources", "category=food&limit=20"))
+    assert etag != list_etag("resources", 3, request("/api/resources", "category=food&limit=10"), 12345)
+    assert etag.startswith('"') and etag.endswith('"')
+
+
+def test_if_none_match():
+    etag = '"abc"'
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('"x", W/"abc"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"abcd"', etag)
+    assert not etag_matches(None, etag)
+
+
+def test_version_scopes():
+    assert version_scope("resources") == "resources"
+    assert version_scope("water_usage", "u1") == "water_usage:user:u1"
+
+
+def test_matching_etag_answers_304_before_any_page_query(monkeypatch):
+    scope = version_scope("water_usage", USER.id)
+    monkeypatch.setattr(server, "db", FakeDatabase(collection_versions=versions(**{scope: 5}), water_usage=Untouched()))
+    etag = list_etag(scope, 5, request("/api/water/usage", "limit=10"))
+
+    response = asyncio.run(server.get_water_usage(
+        limit=10, request=request("/api/water/usage", "limit=10", etag), response=Response(), current_user=USER
+    ))
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+
+def test_write_paths_bump_their_list_scopes(monkeypatch):
+    resource = {"id": "r1", "user_id": USER.id, "is_active": True}
+    database = FakeDatabase(resources=FakeCollection([resource]))
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "resource_search", TextIndex(None, "resources", {"title": 1}, (), 10))
+    monkeypatch.setattr(server, "alert_fanout", type("Fanout", (), {"enqueue": lambda self, alert: None})())
+
+    async def nothing(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(server, "publish_events", nothing)
+    monkeypatch.setattr(server, "apply_usage_rollups", nothing)
+    location = {"lat": 0.0, "lng": 0.0}
+
+    async def main():
+        await server.create_resource(ResourceCreate(title="Rice", description="", category="food", type="offer", location=location), USER)
+        await server.delete_resource("r1", USER)
+        await server.create_water_alert(WaterAlertCreate(title="Boil", description="", alert_type="contamination", severity="high", location=location), USER)
+        await server.log_water_usage(WaterUsageCreate(drinking_liters=2.0), USER)
+
+    asyncio.run(main())
+    assert bumped(database.collection_versions) == ["resources", "resources", "water_alerts", "water_usage:user:u1"]
+
+
+def test_search_tag_changes_with_local_writes(monkeypatch):
+    rice = {"id": "r1", "title": "Rice", "description": "", "category": "food", "type": "offer", "user_id": USER.id,
+            "location": {"lat": 0.0, "lng": 0.0}, "is_active": True}
+    monkeypatch.setattr(server, "db", FakeDatabase(collection_versions=versions(resources=1)))
+    index = TextIndex(FakeCollection([rice]), "resources", {"title": 1}, ("category", "type"), 10)
+    index.version, index._loaded = 1, True
+    monkeypatch.setattr(server, "resource_search", index)
+
+    def search(if_none_match=None):
+        response = Response()
+        result = asyncio.run(server.get_resources(
+            q="rice", limit=10, request=request("/api/resources", "q=rice", if_none_match), response=response, current_user=USER
+        ))
+        return result, response.headers.get("ETag")
+
+    _, etag = search()
+    assert search(etag)[0].status_code == 304
+    # A local write indexes the document without a sync, and bumps the collection version
+    index.add(rice)
+    asyncio.run(server.bump_versions("resources"))
+    result, new_etag = search(etag)
+    assert new_etag != etag and [resource.id for resource in result] == ["r1"]
@@ -0,0 +1,71 @@
+import asyncio
+
+from pymongo.errors import BulkWriteError
+
+from server import CounterBuffer
+
+from .conftest import FakeCollection
+
+
+def written(batch):
+    return [(op._filter, op._doc) for op in batch]
+
+
+def test_increments_are_aggregated_into_one_bulk_write():
+    collection = FakeCollection()
+    flushed = []
+
+    async def on_flush(increments):
+        flushed.append(increments)
+
+    buffer = CounterBuffer("views", collection, on_flush=on_flush)
+
+    async def main():
+        for _ in range(50):
+            buffer.increment("g1", "usage_count")
+        buffer.increment("g2", "usage_count", 3)
+        assert buffer.pending_count("g1", "usage_count") == 50
+        return await buffer.flush()
+
+    assert asyncio.run(main()) == 53
+    assert [written(batch) for batch in collection.batches] == [[
+        ({"id": "g1"}, {"$inc": {"usage_count": 50}}),
+        ({"id": "g2"}, {"$inc": {"usage_count": 3}}),
+    ]]
+    assert flushed == [{"g1": {"usage_count": 50}, "g2": {"usage_count": 3}}]
+    assert buffer.stats()["pending_keys"] == 0
+
+
+def test_failed_flush_is_retried():
+    collection = FakeCollection()
+    buffer = CounterBuffer("views", collection)
+
+    async def main():
+        buffer.increment("g1", "usage_count")
+        buffer.increment("g2", "usage_count")
+        collection.fail_next = BulkWriteError({"writeErrors": [{"index": 1, "errmsg": "boom"}]})
+        first = await buffer.flush()
+        buffer.increment("g2", "usage_count")
+        second = await buffer.flush()
+        return first, second
+
+    assert asyncio.run(main()) == (1, 2)
+    assert written(collection.batches[-1]) == [({"id": "g2"}, {"$inc": {"usage_count": 2}})]
+    assert buffer.stats()["failures"] == 1
+
+
+def test_close_flushes_and_max_keys_triggers_early_flush():
+    collection = FakeCollection()
+    buffer = CounterBuffer("views", collection, flush_interval=3600, max_keys=3)
+
+    async def main():
+        buffer.start()
+        for key in ("a", "b", "c"):
+            buffer.increment(key, "hits")
+        await asyncio.sleep(0)
+        assert len(collection.batches) == 1
+        buffer.increment("d", "hits")
+        await buffer.close()
+
+    asyncio.run(main())
+    assert [len(batch) for batch in collection.batches] == [3, 1]
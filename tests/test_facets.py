@@ -0,0 +1,102 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import FACET_MAX_BUCKETS, TextIndex, encode_cursor, facets_header, geo_point, list_page, parse_facets
+
+from .conftest import FakeCollection
+
+
+def test_parse_facets():
+    assert parse_facets("resources", None) == ()
+    assert parse_facets("resources", "type, category,type") == ("type", "category")
+    assert parse_facets("water_sources", ["quality_status"]) == ("quality_status",)
+    with pytest.raises(HTTPException) as error:
+        parse_facets("infrastructure_plans", "plan_type,owner")
+    assert error.value.status_code == 400
+    with pytest.raises(HTTPException):
+        parse_facets("resources", {"category": 1})
+
+
+def test_page_and_counts_share_one_facet_stage():
+    collection = FakeCollection(results=[{
+        "page": [{"id": "c", "created_at": 3}, {"id": "b", "created_at": 2}, {"id": "a", "created_at": 1}],
+        "category": [{"_id": "food", "count": 2}, {"_id": "water", "count": 5}, {"_id": None, "count": 1}],
+    }])
+    page, next_cursor, counts = asyncio.run(list_page(
+        collection, {"is_active": True}, None, 2, encode_cursor([4, "d"]), {"_id": 0}, ("category",)
+    ))
+    assert [doc["id"] for doc in page] == ["c", "b"]
+    assert next_cursor == encode_cursor([2, "b"])
+    assert list(counts["category"].items()) == [("water", 5), ("food", 2), ("unknown", 1)]
+
+    [pipeline] = collection.pipelines
+    assert pipeline[0] == {"$match": {"is_active": True}}
+    stage = pipeline[1]["$facet"]
+    # The cursor only narrows the page; the counts cover every match
+    assert "$match" in stage["page"][0] and stage["page"][-2:] == [{"$limit": 3}, {"$project": {"_id": 0}}]
+    assert stage["category"] == [
+        {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": FACET_MAX_BUCKETS},
+    ]
+
+
+def test_geo_counts_cover_the_whole_radius():
+    collection = FakeCollection(results=[{
+        "page": [{"id": "b", "distance_km": 2.0}, {"id": "a", "distance_km": 2.0}, {"id": "c", "distance_km": 3.0}],
+        "type": [],
+    }])
+    page, _, _ = asyncio.run(list_page(collection, {"is_active": True}, (1.0, 2.0, 5.0), 10, encode_cursor([1.5, "x"]), None, ("type",)))
+    near = collection.pipelines[0][0]["$geoNear"]
+    assert near["maxDistance"] == 5000 and near["query"] == {"is_active": True}
+    assert "minDistance" not in near
+    # $geoNear already orders the page; only distance ties are settled in memory
+    assert not any("$sort" in step for step in collection.pipelines[0][1]["$facet"]["page"])
+    assert [doc["id"] for doc in page] == ["a", "b", "c"]
+
+
+def test_geo_facet_pages_return_every_tie():
+    # Items bulk-created at one geocoded address, returned by $geoNear out of id order
+    collection = FakeCollection([
+        {"id": f"s{index}", "is_active": True, "type": "offer", "geo": geo_point({"lat": 0.1, "lng": 0.1})}
+        for index in reversed(range(5))
+    ])
+
+    async def main():
+        ids, cursor = [], None
+        while True:
+            page, cursor, counts = await list_page(collection, {"is_active": True}, (0.0, 0.0, 50.0), 2, cursor, None, ("type",))
+            assert counts == {"type": {"offer": 5}}
+            ids += [doc["id"] for doc in page]
+            if cursor is None:
+                return ids
+
+    assert asyncio.run(main()) == [f"s{index}" for index in range(5)]
+
+
+def test_facets_header_stays_under_the_limit(monkeypatch):
+    monkeypatch.setattr(server, "FACETS_HEADER_MAX_BYTES", 200)
+    facets = {
+        "category": {f"category-{index:02d}": 40 - index for index in range(20)},
+        "type": {"offer": 7, "request": 2},
+    }
+    header = facets_header(facets)
+    assert len(header) <= 200
+    parsed = json.loads(header)
+    assert parsed["type"] == {"offer": 7, "request": 2}
+    # The smallest buckets of the widest field go first
+    assert list(parsed["category"]) == list(facets["category"])[:len(parsed["category"])]
+    assert len(facets["category"]) == 20
+    assert facets_header(facets) == header
+
+
+def test_text_search_counts_every_match():
+    index = TextIndex(None, "resources", {"title": 1}, ("category", "type"), 10)
+    for doc_id, category in (("a", "food"), ("b", "food"), ("c", "tools"), ("d", "tools")):
+        index.add({"id": doc_id, "title": "rice" if doc_id != "d" else "hammer", "category": category, "type": "offer"})
+    counts = index.facet_counts(index.rank("rice", {}, None, None, None), ("category", "type"))
+    assert counts == {"category": {"food": 2, "tools": 1}, "type": {"offer": 3}}
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from server import Gazetteer, normalize_place_name
+
+# geonameid, name, asciiname, alternatenames, lat, lng, feature class, feature code,
+# country, cc2, admin1, admin2, admin3, admin4, population, elevation, dem, timezone, modified
+ROWS = [
+    ("192950", "Kenya", "Kenya", "Kenia", "1", "38", "A", "PCLI", "KE", "", "00", "", "", "", "47564296"),
+    ("192709", "Nairobi Area", "Nairobi Area", "", "-1.28", "36.82", "A", "ADM1", "KE", "", "05", "", "", "", "0"),
+    ("184745", "Nairobi", "Nairobi", "Nairobi City", "-1.28333", "36.81667", "P", "PPLC", "KE", "", "05", "", "", "", "2750547"),
+    ("191220", "Kibera", "Kibera", "", "-1.3133", "36.7869", "P", "PPL", "KE", "", "05", "", "", "", "170070"),
+    ("149590", "Tanzania", "Tanzania", "", "-6", "35", "A", "PCLI", "TZ", "", "00", "", "", "", "41892895"),
+    ("160196", "Dodoma", "Dodoma", "", "-6.17221", "35.73947", "P", "PPLC", "TZ", "", "03", "", "", "", "180541"),
+    ("999001", "Kibera", "Kibera", "", "-3.5", "34.1", "P", "PPL", "TZ", "", "08", "", "", "", "500"),
+    ("2643743", "São Paulo", "Sao Paulo", "", "-23.5475", "-46.63611", "P", "PPLA", "BR", "", "27", "", "", "", "10021295"),
+]
+
+
+@pytest.fixture(scope="module")
+def gazetteer(tmp_path_factory):
+    path = tmp_path_factory.mktemp("gazetteer") / "places.tsv"
+    path.write_text("\n".join("\t".join(row + ("", "", "Africa/Nairobi", "2024-01-01")) for row in ROWS) + "\n", encoding="utf-8")
+    return Gazetteer.load(str(path))
+
+
+def test_normalize_place_name():
+    assert normalize_place_name("  São-Paulo ") == "sao paulo"
+
+
+def test_exact_match_prefers_population(gazetteer):
+    assert gazetteer.lookup("Kibera") == {"lat": -1.3133, "lng": 36.7869}
+
+
+def test_alternate_and_accent_free_names(gazetteer):
+    assert gazetteer.lookup("nairobi city") == {"lat": -1.28333, "lng": 36.81667}
+    assert gazetteer.lookup("Sao Paulo")["lat"] == -23.5475
+
+
+def test_fuzzy_match(gazetteer):
+    assert gazetteer.lookup("Nairobbi") == {"lat": -1.28333, "lng": 36.81667}
+    assert gazetteer.lookup("Zanzibar") is None
+
+
+def test_prefix_search(gazetteer):
+    assert [match["name"] for match in gazetteer.search("dod")] == ["Dodoma"]
+
+
+def test_country_and_region_scoping(gazetteer):
+    assert gazetteer.lookup("Kibera, Tanzania") == {"lat": -3.5, "lng": 34.1}
+    assert gazetteer.lookup("Kibera, TZ") == {"lat": -3.5, "lng": 34.1}
+    assert gazetteer.lookup("Kibera, Nairobi Area, Kenya") == {"lat": -1.3133, "lng": 36.7869}
+    assert gazetteer.search("Dodoma", country="KE") == []
+
+
+def test_lookup_is_fast(gazetteer):
+    start = time.perf_counter()
+    for _ in range(1000):
+        gazetteer.lookup("Kibera, Kenya")
+    assert (time.perf_counter() - start) / 1000 < 0.001
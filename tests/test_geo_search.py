@@ -0,0 +1,38 @@
+import asyncio
+
+from server import geo_point, geo_search
+
+from .conftest import FakeCollection
+
+
+def located(doc_id, lat, lng):
+    return {"id": doc_id, "is_active": True, "geo": geo_point({"lat": lat, "lng": lng})}
+
+
+def walk(collection, limit):
+    """Every id geo_search returns, following cursors to the end"""
+    async def main():
+        ids, cursor = [], None
+        while True:
+            page, cursor = await geo_search(collection, {"is_active": True}, 0.0, 0.0, 50.0, limit, cursor)
+            ids += [doc["id"] for doc in page]
+            if cursor is None:
+                return ids
+    return asyncio.run(main())
+
+
+def test_pages_follow_distance():
+    collection = FakeCollection([located(f"p{index}", 0.0, index * 0.01) for index in range(7)])
+    assert walk(collection, 3) == [f"p{index}" for index in range(7)]
+
+
+def test_ties_across_a_page_boundary_are_all_returned():
+    # One geocoded address shared by many items; the fake's $geoNear returns
+    # equal distances in insertion order, here the reverse of id order
+    shared = [located(f"s{index}", 0.1, 0.1) for index in reversed(range(6))]
+    collection = FakeCollection([located("near", 0.0, 0.01), *shared, located("far", 0.2, 0.2)])
+    ids = walk(collection, 2)
+    assert ids == ["near", *(f"s{index}" for index in range(6)), "far"]
+    # The ring re-read is sorted by id only, never the whole radius by distance
+    assert any({"$sort": {"id": 1}} in pipeline for pipeline in collection.pipelines)
+    assert not any({"$sort": {"distance_km": 1, "id": 1}} in pipeline for pipeline in collection.pipelines)
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import server
+from server import Geocoder, geocode_many, normalize_address
+
+PLACES = {"nairobi, kenya": {"lat": "-1.2864", "lon": "36.8172"}}
+
+
+class StubNominatim(BaseHTTPRequestHandler):
+    """Answers /search like Nominatim for the places in PLACES, slowly"""
+
+    requests = []
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)["q"][0]
+        StubNominatim.requests.append((time.monotonic(), query))
+        time.sleep(0.05)
+        place = PLACES.get(normalize_address(query))
+        body = json.dumps([place] if place else []).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_url():
+    StubNominatim.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubNominatim)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/search"
+    server.shutdown()
+
+
+def run(geocoder, coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await geocoder.close()
+    return asyncio.run(main())
+
+
+def test_normalize_address():
+    assert normalize_address("  Nairobi ,Kenya. ") == "nairobi, kenya"
+    assert normalize_address("NAIROBI,   KENYA") == "nairobi, kenya"
+
+
+def test_repeated_lookups_are_cached(stub_url):
+    geocoder = Geocoder(stub_url, min_interval=0)
+
+    async def lookups():
+        first = await geocoder.geocode("Nairobi, Kenya")
+        second = await geocoder.geocode("  nairobi ,KENYA")
+        return first, second
+
+    first, second = run(geocoder, lookups())
+    assert first == second == {"lat": -1.2864, "lng": 36.8172}
+    assert len(StubNominatim.requests) == 1
+    assert geocoder.stats()["memory"]["hits"] == 1
+
+
+def test_concurrent_lookups_are_coalesced(stub_url):
+    geocoder = Geocoder(stub_url, min_interval=0)
+
+    async def lookups():
+        return await asyncio.gather(*[geocoder.geocode("Nairobi, Kenya") for _ in range(10)])
+
+    results = run(geocoder, lookups())
+    assert all(result == {"lat": -1.2864, "lng": 36.8172} for result in results)
+    assert len(StubNominatim.requests) == 1
+    assert geocoder.stats()["coalesced"] == 9
+
+
+def test_misses_are_negatively_cached(stub_url):
+    geocoder = Geocoder(stub_url, min_interval=0)
+
+    async def lookups():
+        return [await geocoder.geocode("Atlantis") for _ in range(3)]
+
+    assert run(geocoder, lookups()) == [None, None, None]
+    assert len(StubNominatim.requests) == 1
+    assert geocoder.stats()["negative_hits"] == 2
+
+
+def test_upstream_requests_are_throttled(stub_url):
+    geocoder = Geocoder(stub_url, min_interval=0.2)
+
+    async def lookups():
+        return await asyncio.gather(*[geocoder.geocode(f"Village {i}") for i in range(3)])
+
+    run(geocoder, lookups())
+    times = [at for at, _ in StubNominatim.requests]
+    assert len(times) == 3
+    assert all(later - earlier >= 0.2 for earlier, later in zip(times, times[1:]))
+
+
+def test_upstream_errors_are_not_cached():
+    geocoder = Geocoder("http://127.0.0.1:9/search", min_interval=0, timeout=1)
+
+    async def lookups():
+        return [await geocoder.geocode("Nairobi, Kenya") for _ in range(2)]
+
+    assert run(geocoder, lookups()) == [None, None]
+    assert geocoder.stats()["upstream_errors"] == 2
+
+
+def test_bulk_lookups_beyond_the_cap_are_deferred(stub_url, monkeypatch):
+    geocoder = Geocoder(stub_url, min_interval=0)
+    monkeypatch.setattr(server, "geocoder", geocoder)
+    monkeypatch.setattr(server, "GEOCODER_PROVIDERS", ["nominatim"])
+
+    async def lookups():
+        first = await geocode_many(["Nairobi, Kenya", "nairobi,kenya", "Atlantis", "Village 1"], max_lookups=1)
+        second = await geocode_many(["Nairobi, Kenya", "Atlantis"], max_lookups=1)
+        return first, second
+
+    (locations, deferred), (again, deferred_again) = run(geocoder, lookups())
+    assert locations["nairobi, kenya"] == {"lat": -1.2864, "lng": 36.8172}
+    assert deferred == {"atlantis", "village 1"}
+    # The cached answer is reused and the next address gets its lookup
+    assert again == {"nairobi, kenya": {"lat": -1.2864, "lng": 36.8172}, "atlantis": None}
+    assert deferred_again == set()
+    assert [query for _, query in StubNominatim.requests] == ["Nairobi, Kenya", "Atlantis"]
@@ -0,0 +1,86 @@
+import asyncio
+import random
+
+import pytest
+
+import server
+from server import GuideCache
+
+from .conftest import FakeCollection
+
+
+@pytest.fixture
+def guides(monkeypatch):
+    async def version(scope):
+        return 7
+
+    monkeypatch.setattr(server, "collection_version", version)
+    rng = random.Random(3)
+    return [
+        {
+            "id": f"g{i:02d}", "is_active": i % 10 != 0, "community_rating": rng.choice([0.0, 2.5, 4.0]),
+            "method_type": rng.choice(["boiling", "filtration", "solar"]),
+            "effectiveness": rng.choice(["high", "medium"]), "difficulty_level": rng.choice(["easy", "hard"]),
+        }
+        for i in range(60)
+    ]
+
+
+def reference(guides, filters):
+    matching = [g for g in guides if g["is_active"] and all(g[k] == v for k, v in filters.items() if v)]
+    return [g["id"] for g in sorted(matching, key=lambda g: (g["community_rating"], g["id"]), reverse=True)]
+
+
+def walk(cache, filters, limit):
+    async def main():
+        ids, cursor = [], None
+        while True:
+            page, cursor = await cache.page(filters, limit, cursor)
+            ids += [guide["id"] for guide in page]
+            if not cursor:
+                return ids
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {"method_type": "boiling"},
+    {"method_type": "solar", "difficulty_level": "easy"},
+    {"effectiveness": "medium", "difficulty_level": "hard", "method_type": None},
+    {"method_type": "unknown"},
+])
+def test_pages_match_sorted_filtered_scan(guides, filters):
+    cache = GuideCache(FakeCollection(guides), "purification_guides", 30)
+    assert walk(cache, filters, 4) == reference(guides, filters)
+    assert cache.version == 7
+
+
+def test_reads_hit_memory_until_invalidated(guides):
+    collection = FakeCollection(guides)
+    cache = GuideCache(collection, "purification_guides", 30)
+
+    async def main():
+        await cache.page({}, 5)
+        assert await cache.get("g01") is not None
+        assert await cache.get("g10") is None  # inactive
+        assert collection.finds == 1
+        cache.invalidate()
+        await cache.page({}, 5)
+        assert collection.finds == 2
+
+    asyncio.run(main())
+
+
+def test_flushed_increments_update_the_copy_in_place(guides):
+    collection = FakeCollection(guides)
+    cache = GuideCache(collection, "purification_guides", 30)
+
+    async def main():
+        before = (await cache.get("g01")).get("usage_count", 0)
+        version = cache.version
+        cache.apply_increments({"g01": {"usage_count": 3}, "gone": {"usage_count": 1}})
+        assert (await cache.get("g01"))["usage_count"] == before + 3
+        assert collection.finds == 1
+        assert cache.version == version
+
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import MCPRequest, mcp_batch, mcp_batch_stages
+
+
+@pytest.fixture
+def actions(monkeypatch):
+    log = []
+
+    def action(name, delay=0.1, fail=None):
+        async def handler(request, api_key_valid):
+            log.append(("start", name))
+            await asyncio.sleep(delay)
+            log.append(("end", name))
+            if fail:
+                raise HTTPException(status_code=fail, detail=f"{name} failed")
+            return {"name": name, "data": request.data}
+        return handler
+
+    monkeypatch.setattr(server, "MCP_ACTIONS", {
+        "search_resources": action("search_resources"),
+        "get_water_alerts": action("get_water_alerts"),
+        "get_user_stats": action("get_user_stats", fail=503),
+        "create_resource": action("create_resource", delay=0.01),
+    })
+    return log
+
+
+def batch(*actions):
+    return asyncio.run(mcp_batch(MCPRequest(action="batch", data={"actions": list(actions)}), True))
+
+
+def test_reads_run_concurrently_and_keep_order(actions):
+    start = time.perf_counter()
+    body = batch(
+        {"action": "search_resources", "data": {"q": "rice"}},
+        {"action": "get_water_alerts"},
+        {"action": "get_user_stats"},
+        {"action": "unknown"},
+    )
+    assert time.perf_counter() - start < 0.25
+    assert [(r["index"], r["status"]) for r in body["results"]] == [(0, "ok"), (1, "ok"), (2, "error"), (3, "error")]
+    assert body["results"][0]["result"] == {"name": "search_resources", "data": {"q": "rice"}}
+    assert body["results"][2]["status_code"] == 503
+    assert (body["ok"], body["error"]) == (2, 2)
+
+
+def test_concurrency_is_limited(actions, monkeypatch):
+    monkeypatch.setattr(server, "MCP_BATCH_CONCURRENCY", 2)
+    start = time.perf_counter()
+    batch(*[{"action": "search_resources"}] * 4)
+    assert time.perf_counter() - start >= 0.2
+
+
+def test_writes_are_barriers(actions):
+    assert mcp_batch_stages([
+        {"action": "search_resources"}, {"action": "create_resource"}, {"action": "create_resource"},
+        {"action": "search_resources"}, {"action": "get_user_stats"},
+    ]) == [[0], [1], [2], [3, 4]]
+    batch({"action": "create_resource"}, {"action": "search_resources"})
+    assert actions.index(("end", "create_resource")) < actions.index(("start", "search_resources"))
+
+
+def test_writes_run_one_at_a_time_in_order(actions):
+    batch({"action": "create_resource", "data": {"n": 1}}, {"action": "create_resource", "data": {"n": 2}})
+    assert actions == [("start", "create_resource"), ("end", "create_resource")] * 2
+
+
+def test_batch_limits():
+    with pytest.raises(HTTPException):
+        batch()
+    with pytest.raises(HTTPException):
+        batch(*[{"action": "get_user_stats"}] * (server.MAX_MCP_BATCH_ACTIONS + 1))
@@ -0,0 +1,86 @@
+import asyncio
+from datetime import datetime
+
+import server
+from server import Message, backfill_message_threads, decrement_thread_unread, message_thread_id, record_thread_message
+
+from .conftest import FakeCollection, FakeDatabase
+
+
+def thread_database(messages=()):
+    return FakeDatabase(messages=FakeCollection(messages), message_threads=FakeCollection())
+
+
+def message(sender, receiver, minute, is_read=False, resource_id=None, **extra):
+    return {
+        "id": f"m{minute}", "sender_id": sender, "receiver_id": receiver, "content": f"hi {minute}",
+        "resource_id": resource_id, "is_read": is_read, "created_at": datetime(2026, 5, 1, 12, minute), **extra
+    }
+
+
+def test_thread_id_is_the_same_in_both_directions():
+    assert message_thread_id("alice", "bob", None) == message_thread_id("bob", "alice", None)
+    assert message_thread_id("alice", "bob", "res-1") == message_thread_id("bob", "alice", "res-1")
+
+
+def test_threads_are_per_pair_and_per_resource():
+    ids = {
+        message_thread_id("alice", "bob", None),
+        message_thread_id("alice", "bob", "res-1"),
+        message_thread_id("alice", "bob", "res-2"),
+        message_thread_id("alice", "carol", None),
+    }
+    assert len(ids) == 4
+
+
+def test_record_thread_message_upserts_last_message_and_unread(monkeypatch):
+    database = thread_database()
+    monkeypatch.setattr(server, "db", database)
+    thread_id = message_thread_id("alice", "bob", None)
+
+    async def main():
+        for sender, receiver, minute in (("alice", "bob", 1), ("alice", "bob", 2), ("bob", "alice", 3)):
+            await record_thread_message(Message(**message(sender, receiver, minute, thread_id=thread_id)))
+
+    asyncio.run(main())
+    [thread] = database.message_threads.docs
+    assert thread["participants"] == ["alice", "bob"]
+    assert thread["created_at"] == datetime(2026, 5, 1, 12, 1)
+    assert thread["updated_at"] == datetime(2026, 5, 1, 12, 3)
+    assert thread["last_message"]["content"] == "hi 3"
+    assert thread["unread"] == {"bob": 2, "alice": 1}
+
+
+def test_unread_decrement_is_clamped_at_zero(monkeypatch):
+    database = thread_database()
+    database.message_threads.docs = [{"id": "t1", "unread": {"bob": 2}}]
+    monkeypatch.setattr(server, "db", database)
+
+    async def main():
+        await decrement_thread_unread("t1", "bob", 1)
+        assert database.message_threads.docs[0]["unread"]["bob"] == 1
+        await decrement_thread_unread("t1", "bob", 3)
+        await decrement_thread_unread("t1", "alice", 1)
+
+    asyncio.run(main())
+    assert database.message_threads.docs[0]["unread"] == {"bob": 0, "alice": 0}
+
+
+def test_backfill_assigns_threads_and_rebuilds_them(monkeypatch):
+    database = thread_database([
+        message("alice", "bob", 1, is_read=True),
+        message("bob", "alice", 2),
+        message("alice", "bob", 3),
+        message("alice", "bob", 4, resource_id="res-1"),
+    ])
+    monkeypatch.setattr(server, "db", database)
+
+    asyncio.run(backfill_message_threads())
+    pair, about_resource = message_thread_id("alice", "bob", None), message_thread_id("alice", "bob", "res-1")
+    assert [doc["thread_id"] for doc in database.messages.docs] == [pair, pair, pair, about_resource]
+    threads = {thread["id"]: thread for thread in database.message_threads.docs}
+    assert threads[pair]["unread"] == {"alice": 1, "bob": 1}
+    assert threads[pair]["last_message"]["id"] == "m3"
+    assert threads[pair]["created_at"] == datetime(2026, 5, 1, 12, 1)
+    assert threads[about_resource]["resource_id"] == "res-1"
+    assert threads[about_resource]["unread"] == {"bob": 1}
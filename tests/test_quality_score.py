@@ -0,0 +1,92 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+from server import (
+    EXPORT_PROJECTION, QualityReport, check_quality_half_life, effective_reports, quality_score, quality_stats_update
+)
+
+NOW = datetime(2026, 6, 1)
+
+
+def report(rating, test_type="visual", days_ago=0, **fields):
+    return QualityReport(water_source_id="w", reporter_id="u", test_type=test_type, overall_rating=rating,
+                         test_date=NOW - timedelta(days=days_ago), **fields)
+
+
+def apply(reports):
+    """Fold reports into stats the way MongoDB applies the $inc/$max/$set updates"""
+    flat = defaultdict(float)
+    for item in reports:
+        update = quality_stats_update(item)
+        for field, amount in update["$inc"].items():
+            flat[field] += amount
+        for field, value in update["$max"].items():
+            flat[field] = max(flat.get(field) or value, value)
+        flat.update(update["$set"])
+    stats = {}
+    for field, value in flat.items():
+        target = stats
+        *parents, leaf = field.split(".")[1:]
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[leaf] = value
+    return stats
+
+
+def test_score_is_a_time_decayed_weighted_average(monkeypatch):
+    monkeypatch.setattr(server, "QUALITY_SCORE_HALF_LIFE_DAYS", 30)
+    stats = apply([report("unsafe", days_ago=30), report("safe")])
+    # The older report counts half as much: (0 * 0.5 + 1 * 1) / 1.5
+    assert quality_score(stats) == pytest.approx(2 / 3, abs=1e-4)
+    assert effective_reports(stats, NOW) == pytest.approx(1.5)
+    assert effective_reports(stats, NOW + timedelta(days=30)) == pytest.approx(0.75)
+
+
+def test_reliable_tests_outweigh_visual_checks():
+    stats = apply([report("safe"), report("unsafe", "laboratory")])
+    assert quality_score(stats) == pytest.approx(0.25)
+
+
+def test_order_does_not_matter():
+    reports = [report("safe", days_ago=10), report("caution", "field_kit", days_ago=3), report("unsafe", days_ago=1)]
+    assert quality_score(apply(reports)) == quality_score(apply(reversed(reports)))
+
+
+def test_per_test_type_aggregates():
+    stats = apply([
+        report("unsafe", "laboratory", days_ago=2, ph_level=6.0, bacteria_present=True),
+        report("safe", "laboratory", ph_level=7.0, bacteria_present=False),
+        report("safe", "odd.type$"),
+        report("unknown"),
+    ])
+    lab = stats["by_test_type"]["laboratory"]
+    assert (lab["reports"], lab["safe"], lab["unsafe"], lab["last_rating"]) == (2, 1, 1, "safe")
+    assert lab["ph_sum"] / lab["ph_count"] == 6.5
+    assert (lab["bacteria_positive"], lab["bacteria_tested"]) == (1, 2)
+    assert stats["by_test_type"]["other"]["reports"] == 1
+    # Unrecognised ratings are counted but not scored
+    assert stats["reports"] == 4
+    assert stats["by_test_type"]["visual"]["reports"] == 1
+    assert "weight" not in stats["by_test_type"]["visual"]
+
+
+def test_no_scored_reports_means_no_score():
+    assert quality_score({}) is None
+    assert quality_score(apply([report("unknown")])) is None
+
+
+def test_half_lives_that_would_overflow_are_refused(monkeypatch):
+    check_quality_half_life(NOW)
+    monkeypatch.setattr(server, "QUALITY_SCORE_HALF_LIFE_DAYS", 1)
+    with pytest.raises(RuntimeError, match="at least 5 days"):
+        check_quality_half_life(NOW)
+    monkeypatch.setattr(server, "QUALITY_SCORE_HALF_LIFE_DAYS", 0)
+    with pytest.raises(RuntimeError):
+        check_quality_half_life(NOW)
+
+
+def test_aggregates_are_not_exported():
+    assert EXPORT_PROJECTION["quality_stats"] == 0
@@ -0,0 +1,77 @@
+import random
+import time
+
+from server import TextIndex, search_tokens
+
+
+def make_index(docs):
+    index = TextIndex(None, "resources", {"title": 3, "description": 1}, ("category",), 10)
+    for doc in docs:
+        index.add(doc)
+    return index
+
+
+def resource(doc_id, title, description="", category="food", lat=0.0, lng=0.0, is_active=True):
+    return {"id": doc_id, "title": title, "description": description, "category": category,
+            "location": {"lat": lat, "lng": lng}, "is_active": is_active}
+
+
+def ranked_ids(index, query, filters=None, lat=None, lng=None, radius_km=None):
+    ranked = index.rank(query, filters or {}, lat, lng, radius_km)
+    return [doc_id for _, doc_id, _ in sorted(ranked, key=lambda match: (-match[0], match[1]))]
+
+
+def test_search_tokens():
+    assert search_tokens("Bags of RICE, Café!") == ["bag", "of", "rice", "cafe"]
+    assert search_tokens("glass gas") == ["glass", "gas"]
+
+
+def test_title_matches_outrank_description_matches():
+    index = make_index([
+        resource("a", "Tarps", "spare rice sacks could also be used"),
+        resource("b", "Rice", "25kg"),
+        resource("c", "Insulin", "pens"),
+    ])
+    assert ranked_ids(index, "rice") == ["b", "a"]
+    assert ranked_ids(index, "insulin pens") == ["c"]
+    assert ranked_ids(index, "zzz") == []
+
+
+def test_last_word_matches_as_prefix():
+    index = make_index([resource("a", "Rice"), resource("b", "Rice cooker"), resource("c", "Insulin")])
+    assert ranked_ids(index, "ric") == ["a", "b"]
+    assert ranked_ids(index, "rice coo") == ["b", "a"]
+
+
+def test_filters_radius_and_proximity_blend():
+    index = make_index([
+        resource("far", "Rice", lat=0.4),
+        resource("near", "Rice", "bags of rice", lat=0.01),
+        resource("tools", "Rice cooker", category="tools", lat=0.0),
+    ])
+    assert ranked_ids(index, "rice", {"category": "food"}) == ["far", "near"]
+    assert ranked_ids(index, "rice", {"category": "food"}, lat=0.0, lng=0.0, radius_km=100) == ["near", "far"]
+    assert ranked_ids(index, "rice", {}, lat=0.0, lng=0.0, radius_km=10) == ["near", "tools"]
+
+
+def test_updates_and_removals():
+    index = make_index([resource("a", "Rice"), resource("b", "Beans")])
+    index.add(resource("a", "Maize"))
+    assert ranked_ids(index, "rice") == []
+    assert ranked_ids(index, "maize") == ["a"]
+    index.add(resource("b", "Beans", is_active=False))
+    assert ranked_ids(index, "beans") == []
+    assert index.stats()["documents"] == 1
+
+
+def test_typeahead_latency():
+    rng = random.Random(5)
+    words = [f"{a}{b}{c}" for a in "bcdfgklmnprst" for b in "aeiou" for c in ["n", "r", "ce", "lin", "sh"]]
+    index = make_index([
+        resource(str(i), " ".join(rng.sample(words, 3)), " ".join(rng.choices(words, k=20)), lat=rng.uniform(-1, 1), lng=rng.uniform(-1, 1))
+        for i in range(20000)
+    ])
+    start = time.perf_counter()
+    for prefix in ["ri", "ma", "bal", "rice tan", "sosh"]:
+        index.rank(prefix, {}, 0.0, 0.0, 50)
+    assert (time.perf_counter() - start) / 5 < 0.25
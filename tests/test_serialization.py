@@ -0,0 +1,80 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import server
+from server import (
+    SPARSE_CACHE_SIZE, FastJSONResponse, Resource, WaterAlert, parse_fields, response_projection, serialize_page, sparse_model
+)
+
+NOW = datetime(2025, 3, 1, 12, 30, 15, 123000)
+
+RESOURCES = [
+    {
+        "id": "r1", "title": "Maize flour", "description": "10kg bags, ünopened", "category": "food", "type": "available",
+        "user_id": "u1", "location": {"lat": -1.28, "lng": 36.82}, "address": "Kibera", "quantity": "3",
+        "contact_info": None, "expiry_date": NOW, "is_active": True, "created_at": NOW, "updated_at": NOW, "distance_km": 0.25,
+    },
+    # Stored before the optional fields existed
+    {
+        "id": "r2", "title": "Tarps", "description": "Blue", "category": "shelter", "type": "needed",
+        "user_id": "u2", "location": {"lat": 0.0, "lng": 0.0}, "created_at": NOW, "updated_at": NOW,
+    },
+]
+
+
+def standard_body(model, docs):
+    return json.loads(JSONResponse(jsonable_encoder([model(**doc) for doc in docs])).body)
+
+
+@pytest.mark.parametrize("mode", ["validate", "trusted"])
+def test_fast_page_matches_response_model(monkeypatch, mode):
+    monkeypatch.setattr(server, "FAST_SERIALIZATION", mode)
+    body = json.loads(FastJSONResponse(serialize_page(Resource, RESOURCES)).body)
+    assert body == standard_body(Resource, RESOURCES)
+
+
+def test_projection_is_exactly_the_response_fields():
+    projection = response_projection(WaterAlert)
+    assert projection.pop("_id") == 0
+    assert set(projection) == set(WaterAlert.model_fields)
+    assert "coverage_cells" not in projection
+
+
+def test_validate_mode_rejects_bad_documents(monkeypatch):
+    monkeypatch.setattr(server, "FAST_SERIALIZATION", "validate")
+    with pytest.raises(ValueError):
+        serialize_page(Resource, [{"id": "r3"}])
+
+
+@pytest.mark.parametrize("mode", ["off", "validate", "trusted"])
+def test_sparse_fieldset_trims_page(monkeypatch, mode):
+    monkeypatch.setattr(server, "FAST_SERIALIZATION", mode)
+    fields = parse_fields(Resource, "id,title, location,title")
+    body = json.loads(FastJSONResponse(serialize_page(Resource, RESOURCES, fields)).body)
+    assert body == [{"id": doc["id"], "title": doc["title"], "location": doc["location"]} for doc in RESOURCES]
+
+
+def test_sparse_projection_keeps_paging_keys():
+    projection = response_projection(WaterAlert, ("title",))
+    assert {"title", "id", "created_at", "location", "radius_km"} <= set(projection)
+    assert "description" not in projection
+
+
+def test_unknown_fields_are_rejected():
+    with pytest.raises(HTTPException) as error:
+        parse_fields(Resource, ["title", "password_hash"])
+    assert error.value.status_code == 400
+    assert "password_hash" in error.value.detail
+
+
+def test_field_order_does_not_multiply_models():
+    fields = parse_fields(Resource, "title,id,location")
+    assert fields == parse_fields(Resource, ["location", "title", "id"]) == ("id", "title", "location")
+    assert sparse_model(Resource, fields) is sparse_model(Resource, parse_fields(Resource, "location,id,title"))
+    assert sparse_model.cache_info().maxsize == SPARSE_CACHE_SIZE
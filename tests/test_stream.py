@@ -0,0 +1,81 @@
+import asyncio
+
+from server import LocalEventBus, StreamHub
+
+
+def event(topic, lat, lng, radius_km=0.0, category=None):
+    return {"topic": topic, "type": "created", "location": {"lat": lat, "lng": lng}, "radius_km": radius_km, "category": category, "data": {}}
+
+
+def drain(subscription):
+    events = []
+    while not subscription.queue.empty():
+        events.append(subscription.queue.get_nowait())
+    return events
+
+
+def test_events_reach_only_nearby_subscriptions():
+    hub = StreamHub(max_radius_km=50, queue_size=10)
+    nairobi = hub.subscribe(-1.29, 36.82, 10)
+    mombasa = hub.subscribe(-4.04, 39.67, 10)
+
+    hub.dispatch(event("resources", -1.30, 36.80))
+    hub.dispatch(event("resources", -1.60, 36.82))  # ~35km away
+    assert len(drain(nairobi)) == 1
+    assert drain(mombasa) == []
+    assert len(hub.candidates({"lat": -1.30, "lng": 36.80})) == 1
+
+
+def test_alert_circles_reach_subscriptions_they_overlap():
+    hub = StreamHub(max_radius_km=50, queue_size=10)
+    subscription = hub.subscribe(-1.29, 36.82, 10)
+    hub.dispatch(event("water_alerts", -1.60, 36.82, radius_km=30))
+    hub.dispatch(event("water_alerts", -1.60, 36.82, radius_km=5))
+    assert [e["radius_km"] for e in drain(subscription)] == [30]
+
+
+def test_topics_and_categories_filter_events():
+    hub = StreamHub(max_radius_km=50, queue_size=10)
+    subscription = hub.subscribe(0.0, 0.0, 10, topics=("resources", "water_alerts"), categories=("food",))
+    hub.dispatch(event("resources", 0.0, 0.0, category="tools"))
+    hub.dispatch(event("resources", 0.0, 0.0, category="food"))
+    hub.dispatch(event("water_sources", 0.0, 0.0))
+    hub.dispatch(event("water_alerts", 0.0, 0.0, radius_km=1))
+    assert [e["topic"] for e in drain(subscription)] == ["resources", "water_alerts"]
+
+
+def test_radius_is_capped_and_subscriptions_move():
+    hub = StreamHub(max_radius_km=20, queue_size=10)
+    subscription = hub.subscribe(0.0, 0.0, 500)
+    assert subscription.radius_km == 20
+    hub.update(subscription, 10.0, 10.0, 5)
+    hub.dispatch(event("resources", 0.0, 0.0))
+    hub.dispatch(event("resources", 10.0, 10.01))
+    assert [e["location"]["lng"] for e in drain(subscription)] == [10.01]
+    hub.unsubscribe(subscription)
+    assert hub.stats()["subscriptions"] == hub.stats()["cells"] == 0
+
+
+def test_slow_subscribers_are_told_they_lagged():
+    hub = StreamHub(max_radius_km=50, queue_size=2)
+    subscription = hub.subscribe(0.0, 0.0, 10)
+    for _ in range(3):
+        hub.dispatch(event("resources", 0.0, 0.0))
+    assert hub.stats()["dropped"] == 1
+
+    async def read():
+        return [(await subscription.next_event(0.01)) for _ in range(4)]
+
+    received = asyncio.run(read())
+    assert received[0]["type"] == "lagged"
+    assert [e["topic"] for e in received[1:3]] == ["resources", "resources"]
+    assert received[3] is None
+
+
+def test_local_bus_delivers_to_handlers():
+    bus, hub = LocalEventBus(), StreamHub(max_radius_km=50, queue_size=10)
+    bus.subscribe(hub.dispatch)
+    subscription = hub.subscribe(0.0, 0.0, 10)
+    asyncio.run(bus.publish([event("resources", 0.0, 0.0), event("resources", 5.0, 5.0)]))
+    assert len(drain(subscription)) == 1
+    assert bus.stats()["received"] == 2
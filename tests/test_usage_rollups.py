@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime
+
+import server
+from server import Principal, WaterUsageBatch, WaterUsageBatchItem, apply_usage_rollups, log_water_usage_batch
+
+from .conftest import FakeDatabase
+
+
+def rollup_database():
+    database = FakeDatabase()
+    # Yield in every call so concurrent writers interleave
+    database.water_usage_rollups.interleave = True
+    return database
+
+
+def usage(user_id, day, liters):
+    return {"user_id": user_id, "date": datetime(2026, 3, day), "total_liters": liters, "drinking_liters": liters}
+
+
+def test_deltas_between_versions_of_a_day(monkeypatch):
+    database = rollup_database()
+    monkeypatch.setattr(server, "db", database)
+    first = usage("u1", 1, 4.0)
+
+    async def main():
+        await apply_usage_rollups([(None, first)])
+        await apply_usage_rollups([(first, usage("u1", 1, 10.0))])
+
+    asyncio.run(main())
+    rollups = {doc["_id"]: doc for doc in database.water_usage_rollups.docs}
+    assert rollups["user:u1"]["days_logged"] == 1
+    assert rollups["user:u1"]["total_liters"] == 10.0
+    assert rollups["user:u1:month:2026-03"]["drinking_liters"] == 10.0
+    assert rollups["user:u1"]["scope"] == "user" and rollups["user:u1"]["user_id"] == "u1"
+    for key in ("community", "community:month:2026-03", "community:day:2026-03-01"):
+        assert rollups[key]["users"] == 1
+        assert rollups[key]["total_liters"] == 10.0
+
+
+def test_concurrent_first_days_count_a_user_once(monkeypatch):
+    database = rollup_database()
+    monkeypatch.setattr(server, "db", database)
+
+    async def main():
+        await asyncio.gather(
+            apply_usage_rollups([(None, usage("u1", 1, 2.0))]),
+            apply_usage_rollups([(None, usage("u1", 2, 3.0))]),
+            apply_usage_rollups([(None, usage("u2", 2, 1.0))]),
+        )
+
+    asyncio.run(main())
+    rollups = {doc["_id"]: doc for doc in database.water_usage_rollups.docs}
+    assert rollups["user:u1"]["days_logged"] == 2
+    assert rollups["community"]["users"] == 2
+    assert rollups["community"]["days_logged"] == 3
+    assert rollups["community:month:2026-03"]["users"] == 2
+    assert rollups["community:day:2026-03-01"]["users"] == 1
+    assert rollups["community:day:2026-03-02"]["users"] == 2
+
+
+def test_batch_rolls_up_the_items_that_were_written(monkeypatch):
+    database = rollup_database()
+    write = database.water_usage.find_one_and_update
+
+    async def flaky(filter_query, update, **kwargs):
+        if filter_query["date"].day == 2:
+            raise ConnectionError("connection reset")
+        return await write(filter_query, update, **kwargs)
+
+    database.water_usage.find_one_and_update = flaky
+    monkeypatch.setattr(server, "db", database)
+    user = Principal(id="u1", username="u1", email="u1@example.org", created_at=datetime(2026, 1, 1))
+    items = [WaterUsageBatchItem(date=datetime(2026, 3, day), drinking_liters=float(day)) for day in (1, 2, 3)]
+
+    body = asyncio.run(log_water_usage_batch(WaterUsageBatch(items=items), user))
+    assert [result["status"] for result in body["results"]] == ["inserted", "error", "inserted"]
+    assert (body["inserted"], body["error"]) == (2, 1)
+    rollups = {doc["_id"]: doc for doc in database.water_usage_rollups.docs}
+    assert rollups["user:u1"]["days_logged"] == 2
+    assert rollups["user:u1"]["total_liters"] == 4.0